@@ -1,43 +1,87 @@
 import cv2
 import math
 import numpy as np
+from bufferpool import checkout_frame
+
+# Cache of circle grid remap tables used by the circle filter, keyed by frame resolution
+circle_grid_cache = {}
+
+def get_circle_grid(width, height, cell_width, cell_height, radius, thickness):
+    """
+    Builds (or loads from cache) a remap table pointing every pixel of the circle grid at the cell it is coloured by
+    """
+    
+    key = (width, height, cell_width, cell_height, radius, thickness)
+    grid = circle_grid_cache.get(key)
+    if grid is None:
+        new_width, new_height = int(width / cell_width), int(height / cell_height)
+        
+        # Rasterize every ring once, using the cell index (plus one) as its colour.
+        # Rings are drawn in the same order as before, so overlapping edges go to the same cell.
+        # Index 0 is left for the background.
+        cell_map = np.zeros((height, width), dtype=np.int32)
+        for i in range(new_height):
+            for j in range(new_width):
+                coord = (j * cell_width + cell_width, i * cell_height)
+                cv2.circle(cell_map, coord, radius, i * new_width + j + 1, thickness)
+        
+        # Turn the cell indices into coordinates on the downscaled image.
+        # Background pixels point outside of the image so that remap fills them with black.
+        map_y, map_x = np.divmod(cell_map - 1, new_width)
+        map_x[cell_map == 0] = -1
+        map_y[cell_map == 0] = -1
+        fixed_map, _ = cv2.convertMaps(map_x.astype(np.float32), map_y.astype(np.float32), cv2.CV_16SC2, nninterpolation=True)
+        
+        grid = ((new_width, new_height), fixed_map)
+        circle_grid_cache[key] = grid
+    return grid
 
 # Code stolen from: https://github.com/codegiovanni/Webcam_Effect/blob/main/webcam_effect.py
 # Just needed a random example of a computationally heavy video effect.
 def circle_video_filter(video):
-    output = np.zeros(video._frame.shape, dtype=np.int8)
-    
     cell_width, cell_height = 12, 12
-    new_width, new_height = int(video.width / cell_width), int(video.height / cell_height)
+    height, width = video._frame.shape[:2]
+    (new_width, new_height), grid_map = get_circle_grid(width, height, cell_width, cell_height, 5, 2)
     small_image = cv2.resize(video._frame, (new_width, new_height), interpolation=cv2.INTER_NEAREST)
+    
+    # Stamp the colour of every cell onto its ring in one pass, into a reusable frame buffer
+    video._frame = cv2.remap(small_image, grid_map, None, cv2.INTER_NEAREST, dst=checkout_frame(video._frame.shape), borderMode=cv2.BORDER_CONSTANT, borderValue=0)
 
-    for i in range(new_height):
-        for j in range(new_width):
-            color = small_image[i, j]
-            B = int(color[0])
-            G = int(color[1])
-            R = int(color[2])
-
-            coord = (j * cell_width + cell_width, i * cell_height)
+# Cache of remap tables used by the wavy filter, keyed by frame resolution
+wavy_map_cache = {}
 
-            cv2.circle(output, coord, 5, (B, G, R), 2)
-            
-    video._frame = output
+def get_wavy_maps(width, height):
+    """
+    Builds (or loads from cache) the per-resolution tables used by the wavy filter
+    """
+    
+    maps = wavy_map_cache.get((width, height))
+    if maps is None:
+        # Sine phase for every column. Evaluated in the same order as the original per-pixel loop
+        # so the truncated offsets come out exactly the same.
+        column_phases = [(2 * 3.14 * j / 150) for j in range(width)]
+        # Remap coordinates. Columns never move, rows get shifted by the per-column offset every frame
+        map_x = np.tile(np.arange(width, dtype=np.float32), (height, 1))
+        rows = np.arange(height, dtype=np.float32).reshape(height, 1)
+        map_y = np.empty((height, width), dtype=np.float32)
+        
+        maps = (column_phases, map_x, rows, map_y)
+        wavy_map_cache[(width, height)] = maps
+    return maps
 
 # Image Warping Effect
 def wavy_image_filter(video):
-    import time
-    output = np.zeros(video._frame.shape, dtype=np.int8)
-    height, width, _ = video._frame.shape
-    img = np.copy(video._frame)
- 
-    for i in range(height): 
-        for j in range(width): 
-            offset_y = int(16.0 * math.sin((2 * 3.14 * j / 150) + video.frame_controller.frames_rendered)) 
-            if i+offset_y < height: 
-                output[i,j] = img[(i+offset_y)%height,j] 
-            else: 
-                output[i,j] = 0 
-        time.sleep(0.000001)  # some stupid hack to get cpu intensive tasks to not hog cpu
+    height, width = video._frame.shape[:2]
+    column_phases, map_x, rows, map_y = get_wavy_maps(width, height)
+    
+    # Calculate the vertical offset of each column for this frame
+    frame_number = video.frame_controller.frames_rendered
+    offsets = np.array([int(16.0 * math.sin(phase + frame_number)) for phase in column_phases], dtype=np.float32)
+    
+    # Pixels shifted above the top wrap around to the bottom.
+    # Pixels shifted past the bottom land outside the source, which remap fills with black.
+    np.add(rows, offsets, out=map_y)
+    map_y[map_y < 0] += height
     
-    video._frame = output
+    # Remap can't work in place, so the result goes into a reusable frame buffer
+    video._frame = cv2.remap(video._frame, map_x, map_y, cv2.INTER_NEAREST, dst=checkout_frame(video._frame.shape), borderMode=cv2.BORDER_CONSTANT, borderValue=0)
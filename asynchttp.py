@@ -0,0 +1,76 @@
+#
+# Minimal HTTP/1.x request parsing for asyncio servers.
+# Kept free of Wormhole and Flask imports, so that lightweight serving processes (see workers.py) can use it too.
+#
+
+import asyncio
+
+
+class AsyncRequest():
+    """
+    Minimal parsed HTTP request
+    """
+
+    def __init__(self, method: str, path: str, query: str, version: str, headers: dict[str, str], body: bytes, peer):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.peer = peer
+
+
+async def read_request(reader: asyncio.StreamReader, peer=None, max_body_size: int = 16 * 1024 * 1024):
+    """
+    Reads and parses one HTTP request from the stream. Returns None if the client went away.
+    """
+
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        return None
+
+    # Parse the request line and headers
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    method, target, version = request_line.split(" ", 2)
+    headers = {}
+    for line in header_lines:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    path, _, query = target.partition("?")
+
+    # Read the request body, if any
+    content_length = int(headers.get("content-length", 0) or 0)
+    if content_length > max_body_size:
+        raise ValueError(f"Request Body Too Large! ({content_length} bytes)")
+    body = await reader.readexactly(content_length) if content_length else b""
+
+    return AsyncRequest(method, path, query, version, headers, body, peer)
+
+
+def normalize_route(path: str):
+    # Treat "/route" and "/route/" as the same route
+    return path.rstrip("/") or "/"
+
+
+def parse_rendition_query(query: dict):
+    """
+    Reads the width, quality and fps parameters of a stream request (from Flask request.args or parse_qs).
+    Invalid values are ignored.
+    """
+
+    rendition = {}
+    for name, parse in (("width", int), ("quality", int), ("fps", float)):
+        values = query.get(name)
+        if isinstance(values, list):
+            values = values[-1] if values else None
+        try:
+            rendition[name] = parse(values) if values else None
+        except ValueError:
+            rendition[name] = None
+        # Also catches NaN
+        if rendition[name] is not None and not rendition[name] > 0:
+            rendition[name] = None
+    return rendition
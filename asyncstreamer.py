@@ -0,0 +1,296 @@
+#
+# Asyncio streaming backend for Wormhole.
+# Viewers are served by coroutines on a single event loop instead of one WSGI worker thread each.
+#
+
+from wormhole.controller import FlaskController
+from turbofix import SharedJPEGEncoder, SharedMJPEGStreamer
+from startup import startup_timer
+from scheduler import get_frame_signal
+from asynchttp import AsyncRequest, read_request, normalize_route, parse_rendition_query
+
+import asyncio
+import io
+import logging
+import socket
+import sys
+import traceback
+from http import HTTPStatus
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qs, unquote_to_bytes
+
+
+class AsyncController(FlaskController):
+    """
+    Network controller that serves streams from an asyncio event loop.
+    Stream routes added with add_stream_route are served natively by coroutines.
+    Every other route is added to Flask like usual and served through its WSGI app on an executor.
+    (SocketIO based protocols are not supported by this controller.)
+    A listener socket that is already bound (see startup.create_listener) can be passed in to serve on.
+    """
+
+    def __init__(self, *args, listener: Optional[socket.socket] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listener = listener
+        self.stream_routes: dict[str, Callable[[AsyncRequest, asyncio.StreamWriter], Awaitable[None]]] = {}
+        # Stream routes that only stand in for a stream until it is built (see lazy.py)
+        self.placeholder_routes: set[str] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def add_stream_route(
+        self,
+        route: str,
+        handler: Callable[[AsyncRequest, asyncio.StreamWriter], Awaitable[None]],
+        strict_url: bool = True,
+        placeholder: bool = False
+    ):
+        logging.debug(f"Adding Stream Route {route} with handler {handler}")
+        # Validate Route. Placeholder routes can be replaced by the actual stream.
+        if not route.startswith('/'):
+            raise ValueError("Route must start with '/'")
+        if route in self.wormhole.routes or (normalize_route(route) in self.stream_routes and normalize_route(route) not in self.placeholder_routes):
+            raise ValueError(f"Route {route} already exists")
+        if self.wormhole.advanced_features and strict_url and route.startswith('/wormhole'):
+            logging.warning("The 'wormhole' keyword in the route is reserved. Using it may cause issues.")
+
+        self.stream_routes[normalize_route(route)] = handler
+        if placeholder:
+            self.placeholder_routes.add(normalize_route(route))
+        else:
+            self.placeholder_routes.discard(normalize_route(route))
+
+    def start_server(self, *args, **kwargs):
+        logging.info(f"Starting Async Server on {self.host}:{self.port}")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.serve())
+
+    async def serve(self):
+        if self.listener is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=self.listener)
+        else:
+            server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await read_request(reader, peer=writer.get_extra_info("peername"))
+            if request is None:
+                return
+
+            # Stream routes are served right on the event loop. Everything else goes to Flask.
+            handler = self.stream_routes.get(normalize_route(request.path))
+            if handler:
+                await handler(request, writer)
+            else:
+                await self.serve_wsgi(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Client went away
+            pass
+        except Exception as e:
+            logging.error(f"Error While Handling Request! {e}")
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    def build_environ(self, request: AsyncRequest):
+        """
+        Builds the WSGI environment for a request
+        """
+
+        peer_host, peer_port = (request.peer or ("", 0))[:2]
+        environ = {
+            "REQUEST_METHOD": request.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(request.path).decode("latin-1"),
+            "QUERY_STRING": request.query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": request.version,
+            "REMOTE_ADDR": str(peer_host),
+            "REMOTE_PORT": str(peer_port),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(request.body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for key, value in request.headers.items():
+            key = key.upper().replace("-", "_")
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                environ[f"HTTP_{key}"] = value
+        return environ
+
+    async def serve_wsgi(self, request: AsyncRequest, writer: asyncio.StreamWriter):
+        """
+        Serves a request through the Flask WSGI app. The app and its response body run on the default executor.
+        """
+
+        loop = asyncio.get_running_loop()
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start["status"] = status
+            response_start["headers"] = headers
+            return writer.write
+
+        body = await loop.run_in_executor(None, self.app, self.build_environ(request), start_response)
+        try:
+            # Send the headers. Connections are not kept alive.
+            head = f"HTTP/1.1 {response_start['status']}\r\n"
+            for key, value in response_start["headers"]:
+                if key.lower() != "connection":
+                    head += f"{key}: {value}\r\n"
+            head += "Connection: close\r\n\r\n"
+            writer.write(head.encode("latin-1"))
+
+            # Send the body. Streamed responses (like the other Wormhole streamers) are pulled chunk by chunk.
+            body_iterator = iter(body)
+            while True:
+                chunk = await loop.run_in_executor(None, next, body_iterator, None)
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            if hasattr(body, "close"):
+                await loop.run_in_executor(None, body.close)
+
+
+class AsyncTurboMJPEGStreamer(SharedMJPEGStreamer):
+    """
+    Motion JPEG streamer for the AsyncController.
+    Frames are encoded once per stream, and every viewer waits on the same new-frame future.
+    Like TurboMJPEGStreamer, viewers can pick a rendition with the width, quality and fps query parameters,
+    and single frames are available from /stream/snapshot.jpg (served through Flask).
+    """
+
+    def __init__(self, *args, send_buffer_size: Optional[int] = 256 * 1024, **kwargs):
+        self.send_buffer_size = send_buffer_size
+        # Latest part of every rendition in use, and the future that resolves once any of them changes
+        self.latest_parts: dict[SharedJPEGEncoder, tuple[int, bytes]] = {}
+        self.new_part: Optional[asyncio.Future] = None
+        self.ticker: Optional[asyncio.Task] = None
+
+        super().__init__(*args, **kwargs)
+
+    def add_feed_route(self):
+        # Sanity Check
+        if not hasattr(self.controller, "add_stream_route"):
+            raise TypeError("AsyncTurboMJPEGStreamer Requires The AsyncController Network Controller!")
+
+        # Add the video feed route to the network controller
+        self.controller.add_stream_route(self.route, self.video_feed, strict_url=self.strict_url)
+
+    async def tick(self):
+        """
+        Picks up every frame the video publishes (see scheduler.FrameSignal), up to the stream frame rate,
+        and wakes up every viewer. Only runs while there are viewers.
+        """
+
+        loop = asyncio.get_running_loop()
+        frame_signal = get_frame_signal(self.video)
+        while self.clients > 0:
+            tick_start = loop.time()
+            frames_seen = frame_signal.count
+            try:
+                # Encoding every rendition in use happens off the event loop, in one go
+                latest_parts = await loop.run_in_executor(None, self.renditions.get_parts)
+                if latest_parts != self.latest_parts:
+                    self.latest_parts = latest_parts
+                    new_part, self.new_part = self.new_part, loop.create_future()
+                    new_part.set_result(latest_parts)
+            except Exception as e:
+                # Encoding errors are handled by the encoder, so this should not happen normally
+                self.error_state.record(e, "Error While Streaming JPEG!")
+                await asyncio.sleep(1)
+
+            # Wait for the next frame, no sooner than the stream frame rate allows.
+            # Without new frames, still check once per keepalive, to pick up placeholders for failing videos.
+            await asyncio.sleep(max(1 / self.max_fps - (loop.time() - tick_start), 0))
+            await frame_signal.wait_async(frames_seen, self.keepalive_interval or 1 / self.max_fps)
+        self.ticker = None
+
+    async def get_part(self, encoder: SharedJPEGEncoder, latest_parts: dict):
+        # Renditions that were just picked up won't be in the latest parts until the next tick
+        if encoder in latest_parts:
+            return latest_parts[encoder]
+        return await asyncio.get_running_loop().run_in_executor(None, encoder.get_part)
+
+    async def video_feed(self, request: AsyncRequest, writer: asyncio.StreamWriter):
+        writer.write((
+            f"HTTP/1.1 {HTTPStatus.OK.value} {HTTPStatus.OK.phrase}\r\n"
+            f"Content-Type: multipart/x-mixed-replace; boundary={self.boundary}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1"))
+        await self.send_frames(request, writer)
+
+    async def send_frames(self, request: AsyncRequest, writer: asyncio.StreamWriter):
+        """
+        Sends frames to a viewer whose response headers were already sent, until they disconnect
+        """
+
+        # Keep the kernel send buffer small, so slow viewers push back on us
+        # instead of quietly piling up seconds worth of stale frames
+        client_socket = writer.get_extra_info("socket")
+        if self.send_buffer_size and client_socket is not None:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+
+        # Pick the rendition asked for by the viewer
+        rendition = parse_rendition_query(parse_qs(request.query))
+        width, quality = rendition["width"], rendition["quality"]
+        frame_time = 1 / min(rendition["fps"] or self.max_fps, self.max_fps)
+
+        # Register the viewer and start checking for frames if they are the first one
+        client = self.add_client(width, quality)
+        if self.ticker is None:
+            self.new_part = asyncio.get_running_loop().create_future()
+            self.ticker = asyncio.ensure_future(self.tick())
+
+        loop = asyncio.get_running_loop()
+        last_part = None
+        last_send_time = 0.0
+        try:
+            # Send the current frame right away, then every new one as it arrives.
+            # Slow viewers simply pick up the newest frame once they catch up.
+            if client.encoder in self.latest_parts:
+                last_part = self.latest_parts[client.encoder][1]
+                last_send_time = loop.time()
+                writer.write(last_part)
+                startup_timer.frame_sent()
+            while True:
+                # Viewers are only woken up for new frames. If nothing changes for a while, resend the current one as a keepalive.
+                try:
+                    latest_parts = await asyncio.wait_for(asyncio.shield(self.new_part), self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    latest_parts = self.latest_parts
+
+                # Viewers with a lower frame rate wait out the rest of their frame time, then take the newest frame
+                wait_time = last_send_time + frame_time - loop.time()
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time)
+                    latest_parts = self.latest_parts
+
+                sequence, part = await self.get_part(client.get_encoder(), latest_parts)
+                if not sequence:
+                    continue
+
+                # Nothing new for this viewer. Only resend the frame as a keepalive.
+                if part is last_part and (self.keepalive_interval is None or loop.time() - last_send_time < self.keepalive_interval):
+                    continue
+
+                # Time how long the viewer takes to accept the frame
+                send_start = loop.time()
+                writer.write(part)
+                await writer.drain()
+                last_part = part
+                last_send_time = send_start
+                client.frame_sent(sequence, loop.time() - send_start)
+        finally:
+            self.remove_client(client)
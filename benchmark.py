@@ -0,0 +1,583 @@
+#
+# Benchmarks for the Wormhole Demo Server.
+#
+# python benchmark.py micro                   Times every frame modifier and the JPEG encode path on synthetic frames
+# python benchmark.py load --launch           Starts the server and measures delivered fps, latency and server CPU
+#                                             against the number of connected clients
+# python benchmark.py compare old.json new.json   Compares two result files and flags regressions
+#
+# Results are saved as JSON with --output, so runs from different releases can be compared.
+#
+
+import argparse
+import asyncio
+import cv2
+import json
+import math
+import numpy as np
+import os
+import platform
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+# Directory of the demo server, for launching it and reading its git version
+SERVER_DIR = Path(__file__).resolve().parent
+
+
+#
+# --- Shared Helpers ---
+#
+
+
+def summarize_times(times: list[float]):
+    """
+    Summarizes a list of durations (in seconds) as milliseconds
+    """
+
+    if not times:
+        return None
+    times_ms = np.array(times) * 1000
+    p50, p95, p99 = np.percentile(times_ms, (50, 95, 99))
+    return {
+        "mean_ms": float(times_ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "min_ms": float(times_ms.min()),
+        "max_ms": float(times_ms.max())
+    }
+
+
+def get_metadata(args: argparse.Namespace):
+    """
+    Describes the machine and version the benchmark ran on
+    """
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SERVER_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "arguments": {key: value for key, value in vars(args).items() if key != "handler"}
+    }
+
+
+def save_results(results: dict, output: Optional[str]):
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results Saved To {output}")
+
+
+#
+# --- Microbenchmarks ---
+#
+
+
+def make_synthetic_frame(width: int, height: int, seed: int = 0):
+    """
+    Builds a test frame out of gradients, shapes and noise, so that JPEG encoding costs about as much as it would on real video
+    """
+
+    rng = np.random.default_rng(seed)
+    xs = np.linspace(0, 1, width, dtype=np.float32).reshape(1, width)
+    ys = np.linspace(0, 1, height, dtype=np.float32).reshape(height, 1)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (xs * 200 + ys * 55).astype(np.uint8)
+    frame[..., 1] = ((1 - xs) * 120 + ys * 100).astype(np.uint8)
+    frame[..., 2] = (np.abs(np.sin(xs * 6 + ys * 4)) * 255).astype(np.uint8)
+
+    # Hard edges and texture
+    for _ in range(24):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(20, max(width, height) // 6))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(frame, (x, y), (x + size, y + size // 2), color, -1)
+        cv2.circle(frame, (x, y), size // 3, color[::-1], 3)
+    cv2.add(frame, rng.integers(0, 16, frame.shape, dtype=np.uint8), dst=frame)
+    return frame
+
+
+def time_function(function: Callable[[], None], iterations: int, warmup: int, prepare: Optional[Callable[[], None]] = None):
+    """
+    Calls the function warmup + iterations times, timing everything but the prepare step
+    """
+
+    times = []
+    for iteration in range(warmup + iterations):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if iteration >= warmup:
+            times.append(elapsed)
+    return times
+
+
+def run_micro(args: argparse.Namespace):
+    # Imported here, so that the load generator does not pull in Wormhole (and its gevent monkey patching)
+    import render_messages
+    import advanced_video_effect
+    import filters
+    from offload import WorkerVideo
+    from turbofix import SharedJPEGEncoder
+
+    class BenchmarkVideo(WorkerVideo):
+        """
+        Stand-in video for the microbenchmarks. Every call to next_frame counts as a new frame.
+        """
+
+        def __init__(self, frame: np.ndarray):
+            super().__init__(frame.copy(), frame.shape[1], frame.shape[0], 0)
+            self.frame_version: int = 0
+
+        def get_frame(self):
+            return self._frame
+
+        def next_frame(self):
+            self.frame_version += 1
+            self.frame_controller.frames_rendered += 1
+
+    width, height = args.size
+    source_frame = make_synthetic_frame(width, height)
+    gray_frame = cv2.cvtColor(source_frame, cv2.COLOR_BGR2GRAY)
+    video = BenchmarkVideo(source_frame)
+
+    def reset_frame():
+        # Modifiers draw on (or replace) the frame, so every run starts from a fresh copy of the source.
+        # Fresh buffers, like the frames videos get from the buffer pool
+        video._frame = source_frame.copy()
+        video.frame_controller.frames_rendered += 1
+
+    # Every message renderer and video effect, as used by the demo streams
+    modifiers: dict[str, Callable] = {}
+    for module in (render_messages, advanced_video_effect):
+        for name in dir(module):
+            function = getattr(module, name)
+            if name.endswith(("_message", "_filter")) and callable(function) and function.__module__ == module.__name__:
+                modifiers[f"{module.__name__}.{name}"] = function
+    modifiers["filters.GrayscaleFilter"] = filters.GrayscaleFilter()
+    modifiers["filters.GrayscaleFilter(channels=1)"] = filters.GrayscaleFilter(channels=1)
+    modifiers["filters.InvertFilter"] = filters.InvertFilter()
+    modifiers["filters.BrightnessContrastFilter"] = filters.BrightnessContrastFilter(20, 1.2)
+    modifiers["filters.ChannelSwapFilter"] = filters.ChannelSwapFilter()
+
+    benchmarks: dict[str, tuple[Callable, Callable]] = {}
+    for name, modifier in modifiers.items():
+        benchmarks[f"modifier {name}"] = (lambda modifier=modifier: modifier(video), reset_frame)
+
+    # The TurboMJPEGStreamer encode path. Each run encodes a new frame, as a first client would.
+    encoders = {
+        "q85 422": (source_frame, {}),
+        "q85 420": (source_frame, {"subsampling": "420"}),
+        "q85 444": (source_frame, {"subsampling": "444"}),
+        "q85 gray": (gray_frame, {}),
+        "q50 422 width=640": (source_frame, {"quality": 50, "width": 640}),
+    }
+    for name, (frame, options) in encoders.items():
+        encoder_video = BenchmarkVideo(frame)
+        encoder = SharedJPEGEncoder(encoder_video, **{"quality": 85, **options})
+        benchmarks[f"encode {name}"] = (encoder.get_part, encoder_video.next_frame)
+
+    # Run the benchmarks
+    results = []
+    print(f"Running Microbenchmarks On {width}x{height} Frames ({args.iterations} Iterations, {args.warmup} Warmup)")
+    for name, (function, prepare) in benchmarks.items():
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        times = time_function(function, args.iterations, args.warmup, prepare)
+        summary = summarize_times(times)
+        results.append({"name": name, "iterations": len(times), **summary})
+        print(f"{name:<60} p50 {summary['p50_ms']:8.3f} ms  p95 {summary['p95_ms']:8.3f} ms  p99 {summary['p99_ms']:8.3f} ms")
+
+    save_results({"benchmark": "micro", "metadata": get_metadata(args), "results": results}, args.output)
+
+
+#
+# --- Load Generator ---
+#
+
+
+def get_process_tree_cpu_time(pid: int):
+    """
+    Total CPU time (in seconds) used by a process and all of its children, such as offload workers.
+    Only supported on Linux. Returns None elsewhere, or if the process is gone.
+    """
+
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    parents: dict[int, int] = {}
+    cpu_times: dict[int, float] = {}
+    try:
+        proc_entries = os.listdir("/proc")
+    except OSError:
+        return None
+
+    for entry in proc_entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # The process name can contain spaces, so the fields are read from after it
+        fields = stat[stat.rindex(")") + 2:].split()
+        parents[int(entry)] = int(fields[1])
+        cpu_times[int(entry)] = (int(fields[11]) + int(fields[12])) / clock_ticks
+
+    if pid not in cpu_times:
+        return None
+    total, pending = 0.0, [pid]
+    while pending:
+        process = pending.pop()
+        total += cpu_times.get(process, 0.0)
+        pending.extend(child for child, parent in parents.items() if parent == process)
+    return total
+
+
+class StreamClient():
+    """
+    Single MJPEG viewer. Frames are counted by their multipart boundaries and never decoded,
+    so the load generator stays cheap compared to the server.
+    """
+
+    def __init__(self, host: str, port: int, path: str, read_size: int = 256 * 1024):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.read_size = read_size
+
+        # Set by the load generator while the measurement window is open
+        self.measuring: bool = False
+        # Client Statistics
+        self.frames: int = 0
+        self.bytes: int = 0
+        self.frame_intervals: list[float] = []
+        self.first_frame_latency: Optional[float] = None
+        self.last_frame_time: Optional[float] = None
+        self.error: Optional[str] = None
+
+    async def run(self):
+        start = time.perf_counter()
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            # HTTP/1.0, so the stream comes back without chunked encoding
+            writer.write(f"GET {self.path} HTTP/1.0\r\nHost: {self.host}:{self.port}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+
+            # Parse the response head for the multipart boundary
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            status_line, *header_lines = head.split("\r\n")
+            if status_line.split(" ")[1] != "200":
+                raise ConnectionError(f"Server Responded With {status_line}")
+            headers = {key.strip().lower(): value.strip() for key, _, value in (line.partition(":") for line in header_lines) if key}
+            content_type = headers.get("content-type", "")
+            if "boundary=" not in content_type:
+                raise ConnectionError(f"Response Is Not A Multipart Stream! ({content_type})")
+            marker = b"--" + content_type.split("boundary=", 1)[1].strip("\"").encode("latin-1")
+
+            # Count boundaries as they come in. The tail covers boundaries split between two reads.
+            tail = b""
+            while True:
+                chunk = await reader.read(self.read_size)
+                if not chunk:
+                    raise ConnectionError("Server Closed The Stream")
+                data = tail + chunk
+                tail = data[-(len(marker) - 1):]
+                new_frames = data.count(marker)
+                if not new_frames:
+                    if self.measuring:
+                        self.bytes += len(chunk)
+                    continue
+
+                now = time.perf_counter()
+                if self.first_frame_latency is None:
+                    self.first_frame_latency = now - start
+                if self.measuring:
+                    self.bytes += len(chunk)
+                    self.frames += new_frames
+                    if self.last_frame_time is not None:
+                        self.frame_intervals.append(now - self.last_frame_time)
+                self.last_frame_time = now
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+async def measure_load(host: str, port: int, path: str, clients: int, warmup: float, duration: float, server_pid: Optional[int]):
+    """
+    Connects a number of clients to a stream, and measures what they receive once they are warmed up
+    """
+
+    stream_clients = [StreamClient(host, port, path) for _ in range(clients)]
+    tasks = [asyncio.create_task(client.run()) for client in stream_clients]
+    try:
+        await asyncio.sleep(warmup)
+
+        # Open the measurement window
+        for client in stream_clients:
+            client.measuring = True
+            client.last_frame_time = None
+        start = time.perf_counter()
+        server_cpu_start = get_process_tree_cpu_time(server_pid) if server_pid else None
+        client_cpu_start = time.process_time()
+        await asyncio.sleep(duration)
+        for client in stream_clients:
+            client.measuring = False
+        elapsed = time.perf_counter() - start
+        server_cpu_end = get_process_tree_cpu_time(server_pid) if server_pid else None
+        client_cpu = time.process_time() - client_cpu_start
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Summarize the clients
+    fps = [client.frames / elapsed for client in stream_clients]
+    intervals = [interval for client in stream_clients for interval in client.frame_intervals]
+    first_frames = [client.first_frame_latency for client in stream_clients if client.first_frame_latency is not None]
+    errors = [client.error for client in stream_clients if client.error]
+    server_cpu = None
+    if server_cpu_start is not None and server_cpu_end is not None:
+        server_cpu = (server_cpu_end - server_cpu_start) / elapsed * 100
+
+    return {
+        "route": path,
+        "clients": clients,
+        "duration": elapsed,
+        "fps_mean": float(np.mean(fps)),
+        "fps_min": float(np.min(fps)),
+        "fps_total": float(np.sum(fps)),
+        "frame_interval": summarize_times(intervals),
+        "first_frame_latency": summarize_times(first_frames),
+        "megabits_per_second": sum(client.bytes for client in stream_clients) * 8 / elapsed / 1e6,
+        "server_cpu_percent": server_cpu,
+        "client_cpu_percent": client_cpu / elapsed * 100,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5]
+    }
+
+
+async def wait_for_server(host: str, port: int, path: str, timeout: float):
+    """
+    Waits until the server answers the given path
+    """
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}:{port}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            if b" 200 " in status_line:
+                return True
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    return False
+
+
+def launch_server(host: str, port: int, server_args: str, log_file: Optional[str]):
+    """
+    Starts the demo server in its own process group, so its worker processes can be stopped along with it
+    """
+
+    command = [sys.executable, str(SERVER_DIR / "main.py"), "--host", host, "--port", str(port), *shlex.split(server_args)]
+    print(f"Launching Server: {shlex.join(command)}")
+    output = open(log_file, "w") if log_file else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=SERVER_DIR, stdout=output, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def stop_server(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+async def run_load_levels(args: argparse.Namespace, host: str, port: int, server_pid: Optional[int]):
+    results = []
+    for route in args.routes:
+        for clients in args.clients:
+            result = await measure_load(host, port, route, clients, args.warmup, args.duration, server_pid)
+            results.append(result)
+
+            interval = result["frame_interval"] or {}
+            cpu = f"{result['server_cpu_percent']:6.1f}%" if result["server_cpu_percent"] is not None else "   n/a"
+            print(
+                f"{route:<24} {clients:>4} clients  "
+                f"fps mean {result['fps_mean']:6.2f} min {result['fps_min']:6.2f}  "
+                f"interval p95 {interval.get('p95_ms', math.nan):7.1f} ms  "
+                f"server cpu {cpu}  errors {result['errors']}"
+            )
+
+            # Give on demand videos a moment to wind down between levels
+            await asyncio.sleep(args.cooldown)
+    return results
+
+
+def find_max_clients(results: list[dict], target_fps: Optional[float], tolerance: float = 0.9):
+    """
+    Highest tested client count per route where every client still got close to the target fps.
+    Without a target, the fps delivered to the smallest tested client count is used.
+    """
+
+    max_clients = {}
+    for route in dict.fromkeys(result["route"] for result in results):
+        levels = sorted((result for result in results if result["route"] == route), key=lambda result: result["clients"])
+        target = target_fps or levels[0]["fps_mean"]
+        passing = [result["clients"] for result in levels if result["fps_min"] >= target * tolerance and not result["errors"]]
+        max_clients[route] = {"target_fps": target, "max_clients": max(passing) if passing else 0}
+    return max_clients
+
+
+def run_load(args: argparse.Namespace):
+    url = urlsplit(args.url)
+    host, port = url.hostname or "127.0.0.1", url.port or 80
+
+    server = None
+    server_pid = args.pid
+    if args.launch:
+        server = launch_server(host, port, args.server_args, args.server_log)
+        server_pid = server.pid
+    try:
+        if not asyncio.run(wait_for_server(host, port, args.ready_path, args.startup_timeout)):
+            print(f"Server At {args.url} Did Not Answer {args.ready_path} Within {args.startup_timeout} Seconds!")
+            sys.exit(1)
+
+        print(f"Running Load Test Against {args.url} ({args.warmup}s Warmup, {args.duration}s Per Level)")
+        results = asyncio.run(run_load_levels(args, host, port, server_pid))
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    max_clients = find_max_clients(results, args.target_fps)
+    for route, summary in max_clients.items():
+        print(f"{route:<24} handles {summary['max_clients']} clients at {summary['target_fps']:.1f} fps")
+
+    save_results({"benchmark": "load", "metadata": get_metadata(args), "results": results, "max_clients": max_clients}, args.output)
+
+
+#
+# --- Comparing Results ---
+#
+
+
+def run_compare(args: argparse.Namespace):
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    if old["benchmark"] != new["benchmark"]:
+        print(f"Can Not Compare {old['benchmark']} Results With {new['benchmark']} Results!")
+        sys.exit(2)
+
+    # Metric to compare for each result, and whether higher is better
+    if new["benchmark"] == "micro":
+        def key(result): return result["name"]
+        metric, higher_is_better = "p50_ms", False
+    else:
+        def key(result): return f"{result['route']} {result['clients']} clients"
+        metric, higher_is_better = "fps_mean", True
+
+    old_results = {key(result): result for result in old["results"]}
+    regressions = 0
+    print(f"Comparing {metric} ({old['metadata'].get('commit')} -> {new['metadata'].get('commit')})")
+    for result in new["results"]:
+        old_result = old_results.get(key(result))
+        if old_result is None or not old_result[metric]:
+            print(f"{key(result):<60} {result[metric]:10.3f}  (new)")
+            continue
+        change = (result[metric] - old_result[metric]) / old_result[metric]
+        regressed = (-change if higher_is_better else change) > args.threshold
+        regressions += regressed
+        print(f"{key(result):<60} {old_result[metric]:10.3f} -> {result[metric]:10.3f}  {change * 100:+7.1f}%{'  REGRESSION' if regressed else ''}")
+
+    print(f"{regressions} Regressions Over {args.threshold * 100:.0f}%")
+    sys.exit(1 if regressions else 0)
+
+
+#
+# --- Command Line ---
+#
+
+
+def parse_size(size: str):
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_counts(counts: str):
+    return sorted({int(count) for count in counts.split(",")})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wormhole Demo Server Benchmarks')
+    subparsers = parser.add_subparsers(required=True)
+
+    micro = subparsers.add_parser('micro', help='Time frame modifiers and JPEG encoding on synthetic frames')
+    micro.add_argument('--size', type=parse_size, default=(1920, 1080), help='Frame size, such as 1920x1080')
+    micro.add_argument('--iterations', type=int, default=200)
+    micro.add_argument('--warmup', type=int, default=10)
+    micro.add_argument('--only', type=str, nargs='*', help='Only run benchmarks whose name contains one of these')
+    micro.add_argument('--output', type=str, default=None)
+    micro.set_defaults(handler=run_micro)
+
+    load = subparsers.add_parser('load', help='Measure delivered fps, latency and server CPU against the number of clients')
+    load.add_argument('--url', type=str, default='http://127.0.0.1:8000')
+    load.add_argument('--launch', action='store_true', help='Start the demo server for the test, and stop it afterwards')
+    load.add_argument('--server-args', type=str, default='', help='Extra arguments for main.py, such as "--video video.webm --async"')
+    load.add_argument('--server-log', type=str, default=None)
+    load.add_argument('--pid', type=int, default=None, help='Process ID of an already running server, for measuring its CPU usage')
+    load.add_argument('--routes', type=str, nargs='+', default=['/', '/lowres', '/overlay'])
+    load.add_argument('--clients', type=parse_counts, default=[1, 5, 10, 25, 50], help='Comma separated client counts, such as 1,5,10')
+    load.add_argument('--warmup', type=float, default=3.0)
+    load.add_argument('--duration', type=float, default=10.0)
+    load.add_argument('--cooldown', type=float, default=1.0)
+    load.add_argument('--target-fps', type=float, default=None)
+    load.add_argument('--ready-path', type=str, default='/metrics', help='Path that answers once the server is fully set up')
+    load.add_argument('--startup-timeout', type=float, default=60.0)
+    load.add_argument('--output', type=str, default=None)
+    load.set_defaults(handler=run_load)
+
+    compare = subparsers.add_parser('compare', help='Compare two result files of the same benchmark')
+    compare.add_argument('old', type=str)
+    compare.add_argument('new', type=str)
+    compare.add_argument('--threshold', type=float, default=0.1, help='Relative change that counts as a regression')
+    compare.set_defaults(handler=run_compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
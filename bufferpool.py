@@ -0,0 +1,75 @@
+#
+# Reusable frame buffers.
+# Videos check out their next frame from the pool instead of allocating a brand new array every frame.
+#
+
+import logging
+import numpy as np
+import sys
+from threading import Lock
+
+
+def count_free_references():
+    """
+    Reference count of a buffer that only the pool knows about, as seen from FrameBufferPool.checkout
+    """
+
+    buffers = [np.empty(0, np.uint8)]
+    for buffer in buffers:
+        return sys.getrefcount(buffer)
+
+
+FREE_REFERENCES = count_free_references()
+
+
+class FrameBufferPool():
+    """
+    Pool of reusable frame buffers, with one list of buffers per frame shape.
+    Checkouts are reference counted by Python itself. Once nothing references a buffer anymore
+    (videos, streamers, views of the buffer, ...), it goes back to the pool on its own.
+    Buffers are never handed out twice while they are in use, so frame identity checks stay valid.
+    """
+
+    def __init__(self, max_buffers: int = 16):
+        self.max_buffers = max_buffers
+        self.buffers: dict[tuple, list[np.ndarray]] = {}
+        self.lock = Lock()
+
+        # Pool Statistics
+        self.allocations: int = 0
+        self.overflows: int = 0
+
+    def checkout(self, shape: tuple, dtype=np.uint8):
+        """
+        Returns a buffer of the given shape that nothing else is using. Contents are left over from its last use.
+        """
+
+        with self.lock:
+            buffers = self.buffers.setdefault((tuple(shape), np.dtype(dtype)), [])
+            for buffer in buffers:
+                if sys.getrefcount(buffer) <= FREE_REFERENCES:
+                    return buffer
+
+            # Every buffer is in use, so make a new one.
+            # Once the pool is full, buffers are handed out without being tracked.
+            buffer = np.empty(shape, dtype)
+            if len(buffers) < self.max_buffers:
+                buffers.append(buffer)
+                self.allocations += 1
+            else:
+                if not self.overflows:
+                    logging.warning(f"Frame Buffer Pool For {shape} Frames Is Full! Frames Are Being Held For Too Long.")
+                self.overflows += 1
+            return buffer
+
+    def __repr__(self):
+        sizes = ", ".join(f"{shape}: {len(buffers)}" for (shape, _), buffers in self.buffers.items())
+        return f"<FrameBufferPool [{sizes}]>"
+
+
+# Pool shared by every video in the process
+frame_pool = FrameBufferPool()
+
+
+def checkout_frame(shape: tuple, dtype=np.uint8):
+    return frame_pool.checkout(shape, dtype)
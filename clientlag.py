@@ -0,0 +1,79 @@
+#
+# Per-client lag tracking for MJPEG streams, and the lower quality that clients drop to while they are behind.
+# Kept free of Wormhole imports, so that serving processes (see workers.py) can use it too.
+#
+
+import time
+from typing import Optional
+
+
+class ClientLagTracker():
+    """
+    Tracks how far behind a single client is, based on how much of its time is spent blocked sending frames.
+    Clients that can't keep up are flagged as behind, and get to retry the full stream after a backoff.
+    """
+
+    def __init__(
+        self,
+        window: float = 2.0,
+        behind_threshold: float = 0.8,
+        min_fallback_time: float = 10.0,
+        max_fallback_time: float = 120.0
+    ):
+        self.window = window
+        self.behind_threshold = behind_threshold
+        self.max_fallback_time = max_fallback_time
+
+        # Fraction of the last window spent blocked on sending frames. Close to 1 means the client can't keep up.
+        self.load: float = 0.0
+        self.window_start: float = time.time()
+        self.window_busy: float = 0.0
+        # Whether the client is behind, and how long it stays that way before trying the full stream again
+        self.behind: bool = False
+        self.behind_until: float = 0.0
+        # How long the current fallback lasts, and how long the next one will
+        self.behind_time: float = min_fallback_time
+        self.fallback_time: float = min_fallback_time
+        # Number of encoded frames the client never received
+        self.frames_skipped: int = 0
+        self.last_sequence: int = 0
+
+    def frame_sent(self, sequence: int, send_time: float):
+        # Count any frames that were encoded since the last send as skipped
+        if self.last_sequence and sequence > self.last_sequence + 1:
+            self.frames_skipped += sequence - self.last_sequence - 1
+        self.last_sequence = sequence
+
+        # Update the load once per window
+        now = time.time()
+        self.window_busy += send_time
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        self.load = self.window_busy / elapsed
+        self.window_start = now
+        self.window_busy = 0.0
+
+        if self.load > self.behind_threshold:
+            # Client is behind. Each time this happens, wait longer before trying the full stream again
+            if not self.behind:
+                self.behind = True
+                self.last_sequence = 0
+                self.behind_time = self.fallback_time
+                self.fallback_time = min(self.fallback_time * 2, self.max_fallback_time)
+            self.behind_until = now + self.behind_time
+        elif self.behind and now >= self.behind_until:
+            # Give the full stream another try
+            self.behind = False
+            self.last_sequence = 0
+
+
+def get_fallback_quality(quality: Optional[int], stream_quality: int, fallback_quality: Optional[int]):
+    """
+    Quality a client drops to while it is behind. Clients that already asked for a quality at or below the fallback
+    quality keep their own, as switching would only make their frames larger.
+    """
+
+    if not fallback_quality or fallback_quality >= (quality or stream_quality):
+        return quality
+    return fallback_quality
@@ -0,0 +1,67 @@
+#
+# Region-only versions of Wormhole's draw_overlay and blend_frames.
+# Only the pixels under the overlay are read and written, so drawing a small inset
+# costs an inset's worth of memory traffic instead of a full frame.
+#
+
+import cv2
+import numpy as np
+from typing import Optional
+
+
+def get_overlay_region(frame: np.ndarray, position: tuple[int, int], overlay_size: tuple[int, int]):
+    """
+    Returns the part of the frame covered by the overlay (clipped to the frame) and the matching crop of the overlay
+    """
+
+    frame_height, frame_width = frame.shape[:2]
+    pos_x, pos_y = position
+    overlay_width, overlay_height = overlay_size
+
+    # Clip the overlay rectangle to the frame
+    x1, y1 = max(pos_x, 0), max(pos_y, 0)
+    x2, y2 = min(pos_x + overlay_width, frame_width), min(pos_y + overlay_height, frame_height)
+    if x1 >= x2 or y1 >= y2:
+        return None, None
+
+    return frame[y1:y2, x1:x2], (slice(y1 - pos_y, y2 - pos_y), slice(x1 - pos_x, x2 - pos_x))
+
+
+def composite_overlay(
+    frame: np.ndarray,
+    overlay_image: np.ndarray,
+    position: tuple[int, int],
+    overlay_size: Optional[tuple[int, int]] = None,
+    transparency: float = 1.0
+):
+    """
+    Draws an image on top of another image, in place. Only the destination rectangle is touched.
+    With a transparency below 1, the overlay is blended with what is underneath it.
+    """
+
+    # Overlays are drawn at their own size by default.
+    # Passing in pre-scaled frames (see pipeline.SoftCopy) skips the resize entirely.
+    if overlay_size is None:
+        overlay_size = (overlay_image.shape[1], overlay_image.shape[0])
+    elif (overlay_image.shape[1], overlay_image.shape[0]) != overlay_size:
+        overlay_image = cv2.resize(overlay_image, overlay_size)
+
+    region, crop = get_overlay_region(frame, position, overlay_size)
+    if region is None:
+        return frame
+    overlay_image = overlay_image[crop]
+
+    # Match the channels of the frame. Converted straight into the frame when possible.
+    if overlay_image.ndim == 2 and region.ndim == 3:
+        if transparency >= 1.0:
+            cv2.cvtColor(overlay_image, cv2.COLOR_GRAY2BGR, dst=region)
+            return frame
+        overlay_image = cv2.cvtColor(overlay_image, cv2.COLOR_GRAY2BGR)
+
+    if transparency >= 1.0:
+        np.copyto(region, overlay_image)
+    else:
+        # Same math as blend_frames, limited to the region
+        cv2.addWeighted(overlay_image, transparency, region, 1 - transparency, 0, dst=region)
+
+    return frame
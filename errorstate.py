@@ -0,0 +1,75 @@
+#
+# Shared error state for videos and streams.
+# Failures are recorded once per video or stream, no matter how many viewers run into them,
+# and repeated errors are only logged every so often.
+#
+
+import logging
+import time
+from threading import Lock
+from typing import Optional
+
+
+class ErrorState():
+    """
+    Tracks whether something is currently failing.
+    The first error is logged with its traceback. After that, repeats of the same error
+    are suppressed and only summarized once per log_interval.
+    """
+
+    def __init__(self, name: str, log_interval: float = 30.0):
+        self.name = name
+        self.log_interval = log_interval
+        self.lock = Lock()
+
+        # Current Error
+        self.failing: bool = False
+        self.error: Optional[str] = None
+        self.failing_since: float = 0.0
+        # Error Statistics
+        self.failures: int = 0
+        self.suppressed: int = 0
+        self.last_log_time: float = 0.0
+
+    def record(self, error: Exception, message: str = "Error!"):
+        """
+        Records a failure. Must be called from within the except block, so the traceback can be logged.
+        """
+
+        now = time.time()
+        with self.lock:
+            new_error = not self.failing or str(error) != self.error
+            if new_error:
+                self.failing_since = now if not self.failing else self.failing_since
+                self.failing = True
+                self.error = str(error)
+            self.failures += 1
+
+            # Log new errors right away, and repeats of the same error once per interval
+            if new_error:
+                logging.error(f"{message} ({self.name}) {error}", exc_info=True)
+            elif now - self.last_log_time >= self.log_interval:
+                logging.error(f"{message} ({self.name}) Still Failing After {self.failures} Errors! {self.suppressed} Similar Errors Suppressed. {error}")
+            else:
+                self.suppressed += 1
+                return
+            self.last_log_time = now
+            self.suppressed = 0
+
+    def recover(self):
+        """
+        Clears the error state, once things work again
+        """
+
+        if not self.failing:
+            return
+        with self.lock:
+            if self.failing:
+                logging.info(f"{self.name} Recovered After {self.failures} Errors Over {time.time() - self.failing_since:.1f} Seconds")
+                self.failing = False
+                self.error = None
+                self.failures = 0
+                self.suppressed = 0
+
+    def __repr__(self):
+        return f"<ErrorState {self.name} {'failing: ' + str(self.error) if self.failing else 'ok'}>"
@@ -0,0 +1,143 @@
+#
+# Built-in color filters for use as frame modifiers.
+# Every filter works on the frame in place and keeps its own scratch buffers around,
+# so applying a filter does not allocate any new frames.
+#
+
+from bufferpool import checkout_frame
+
+import cv2
+import numpy as np
+from typing import Sequence, Union
+
+
+class FrameFilter():
+    """
+    Base class for in-place frame filters. Subclasses implement apply(frame).
+    """
+
+    def __init__(self):
+        # Scratch buffers, keyed by name and frame shape
+        self.buffers: dict[tuple, np.ndarray] = {}
+
+    def get_buffer(self, name: str, shape: tuple, dtype=np.uint8):
+        buffer = self.buffers.get((name, shape))
+        if buffer is None:
+            buffer = np.empty(shape, dtype)
+            self.buffers[(name, shape)] = buffer
+        return buffer
+
+    def apply(self, frame: np.ndarray):
+        raise NotImplementedError
+
+    def __call__(self, video):
+        self.apply(video._frame)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}>"
+
+
+class GrayscaleFilter(FrameFilter):
+    """
+    Converts the frame to grayscale. By default the image is kept 3 channel.
+    With channels=1, the frame is replaced by a single channel frame instead, which skips expanding it
+    back to BGR and lets streamers encode it as a grayscale JPEG. Modifiers after it then see a 2D frame.
+    """
+
+    def __init__(self, channels: int = 3):
+        super().__init__()
+        if channels not in (1, 3):
+            raise ValueError(f"Grayscale frames must have 1 or 3 channels, not {channels}!")
+        self.channels = channels
+
+    def apply(self, frame: np.ndarray):
+        if frame.ndim < 3:
+            return
+        gray = self.get_buffer("gray", frame.shape[:2])
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=frame)
+
+    def __call__(self, video):
+        if self.channels == 3:
+            return super().__call__(video)
+        frame = video._frame
+        if frame.ndim < 3:
+            return
+        # Single channel frames are replaced, so they come from the frame pool like the rest of the video's frames
+        video._frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=checkout_frame(frame.shape[:2]))
+
+    def __repr__(self):
+        return f"<GrayscaleFilter channels={self.channels}>"
+
+
+class InvertFilter(FrameFilter):
+    """
+    Inverts the colors of the frame
+    """
+
+    def apply(self, frame: np.ndarray):
+        cv2.bitwise_not(frame, dst=frame)
+
+
+class LUTFilter(FrameFilter):
+    """
+    Maps every pixel value through a lookup table.
+    The table has 256 entries, or 256 entries per channel with a shape of (256, 3).
+    """
+
+    def __init__(self, table: Union[np.ndarray, Sequence[int]]):
+        super().__init__()
+        self.set_table(table)
+
+    def set_table(self, table: Union[np.ndarray, Sequence[int]]):
+        table = np.clip(np.asarray(table), 0, 255).astype(np.uint8)
+        if table.shape not in ((256,), (256, 3)):
+            raise ValueError(f"Lookup table must have a shape of (256,) or (256, 3), not {table.shape}!")
+        # OpenCV wants per channel tables as a 256 pixel image
+        self.table = table.reshape(256, 1, -1)
+
+    def apply(self, frame: np.ndarray):
+        cv2.LUT(frame, self.table, dst=frame)
+
+
+class BrightnessContrastFilter(LUTFilter):
+    """
+    Scales the frame by the contrast, then adds the brightness. Values are clipped to 0-255.
+    """
+
+    def __init__(self, brightness: float = 0, contrast: float = 1.0):
+        self.brightness = brightness
+        self.contrast = contrast
+        super().__init__(np.arange(256) * contrast + brightness)
+
+    def set_table(self, table: Union[np.ndarray, Sequence[int]]):
+        # Round instead of truncating, to match cv2.convertScaleAbs
+        super().set_table(np.rint(table))
+
+    def __repr__(self):
+        return f"<BrightnessContrastFilter brightness={self.brightness} contrast={self.contrast}>"
+
+
+class ChannelSwapFilter(FrameFilter):
+    """
+    Reorders the color channels of the frame. order lists the source channel of each output channel.
+    The default order swaps BGR and RGB.
+    """
+
+    def __init__(self, order: Sequence[int] = (2, 1, 0)):
+        super().__init__()
+        if sorted(order) != [0, 1, 2]:
+            raise ValueError(f"Channel order must be a permutation of (0, 1, 2), not {order}!")
+        self.order = tuple(order)
+        # Pairs of (source channel, destination channel) for mixChannels
+        self.from_to = [index for pair in zip(self.order, (0, 1, 2)) for index in pair]
+
+    def apply(self, frame: np.ndarray):
+        if frame.ndim < 3:
+            return
+        swapped = self.get_buffer("swapped", frame.shape)
+        cv2.mixChannels([frame], [swapped], self.from_to)
+        np.copyto(frame, swapped)
+
+    def __repr__(self):
+        return f"<ChannelSwapFilter order={self.order}>"
@@ -0,0 +1,200 @@
+from pipeline import FileVideo
+from bufferpool import checkout_frame
+from profiler import profiler
+from scheduler import frame_scheduler, count_frame
+
+import cv2
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class CachedFileVideo(FileVideo):
+    """
+    Creates a video object from a video file, decoding it only once.
+    The first pass through the file is decoded normally and saved as raw frames to a cache on disk.
+    Every loop after that (and every restart of the server) plays back from a memory mapped copy of the cache.
+    Recording the cache runs on the video thread. Playback runs on the frame scheduler, like regular file videos.
+    Only repeating videos use the cache, as others are only decoded once anyways.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        cache_dir: str,
+        *args,
+        max_cache_bytes: int = 16 * 1024 ** 3,
+        **kwargs  # Any Additional Arguments for FileVideo
+    ):
+        # Cache Properties
+        # These need to be set before FileVideo starts the video thread
+        self.cache_dir: Path = Path(cache_dir)
+        self.max_cache_bytes: int = max_cache_bytes
+        self.cache_name: Optional[str] = None
+        self.cached_frames: Optional[np.ndarray] = None
+
+        # Initialize File Video
+        super().__init__(filename, *args, **kwargs)
+
+    def get_cache_name(self):
+        """
+        Cache entries are keyed by the hash of the video file and the output resolution
+        """
+
+        return f"{self.get_file_hash()}-{self.width}x{self.height}"
+
+    def get_file_hash(self):
+        """
+        Returns the SHA-256 of the video file. Hashing large files takes a while, so the hash is saved to a sidecar
+        in the cache directory along with the size and modification time of the file, and only recomputed once those change.
+        """
+
+        path = Path(self.filename).resolve()
+        stat = path.stat()
+        sidecar_path = Path(self.cache_dir, f"{hashlib.sha256(str(path).encode()).hexdigest()}.source.json")
+        try:
+            sidecar = json.loads(sidecar_path.read_text())
+            if sidecar["filename"] == str(path) and sidecar["size"] == stat.st_size and sidecar["mtime_ns"] == stat.st_mtime_ns:
+                return sidecar["hash"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        logging.info(f"Hashing Video File {self.filename} For The Frame Cache")
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        sidecar_path.write_text(json.dumps({
+            "filename": str(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": file_hash.hexdigest()
+        }))
+        return file_hash.hexdigest()
+
+    def load_cache(self):
+        """
+        Memory maps the cached frames, if a complete cache exists for this video
+        """
+
+        frames_path = Path(self.cache_dir, f"{self.cache_name}.frames")
+        info_path = Path(self.cache_dir, f"{self.cache_name}.json")
+        if not frames_path.exists() or not info_path.exists():
+            return None
+
+        # Sanity check the cache before using it
+        info = json.loads(info_path.read_text())
+        frame_shape = (self.height, self.width, self.pixel_size)
+        if tuple(info.get("frame_shape", ())) != frame_shape or frames_path.stat().st_size != info.get("frames", 0) * int(np.prod(frame_shape)):
+            logging.warning(f"Frame Cache {frames_path} Does Not Match The Video! Ignoring Cache.")
+            return None
+
+        # Frames are copied out before anything draws on them (see render_cached_frame), so the mapping can be read-only
+        return np.memmap(frames_path, dtype=np.uint8, mode="r", shape=(info["frames"], *frame_shape))
+
+    def record_cache(self):
+        """
+        Decodes one pass of the video file while saving every frame to the cache.
+        Returns True if the cache was completed.
+        """
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        frames_path = Path(self.cache_dir, f"{self.cache_name}.frames")
+        partial_path = Path(self.cache_dir, f"{self.cache_name}.frames.partial")
+        frame_size = self.width * self.height * self.pixel_size
+
+        logging.info(f"Recording Frame Cache For {self.filename} To {frames_path}")
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        frames_written = 0
+        ret = True
+        with open(partial_path, "wb") as cache_file:
+            while True:
+                try:
+                    # Read Frame
+                    frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                    frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                    start = time.perf_counter()
+                    ret, frame = self.cap.read(image=checkout_frame((frame_height, frame_width, self.pixel_size)))
+                    profiler.record_video(self, "decode", time.perf_counter() - start)
+                    # The first pass is done once we run out of frames
+                    if not ret:
+                        break
+
+                    # If sizes does not match, resize frame
+                    if frame.shape[1] != self.width or frame.shape[0] != self.height:
+                        start = time.perf_counter()
+                        frame = cv2.resize(frame, (self.width, self.height), dst=self.new_frame())
+                        profiler.record_video(self, "resize", time.perf_counter() - start)
+
+                    # Give up on the cache if the video is too big for it
+                    if (frames_written + 1) * frame_size > self.max_cache_bytes:
+                        logging.warning(f"Video {self.filename} Is Too Large For The Frame Cache! Falling Back To Decoding.")
+                        break
+                    cache_file.write(np.ascontiguousarray(frame).data)
+                    frames_written += 1
+
+                    # Set Frame
+                    self.set_frame(frame)
+                    self.frame_controller.next_frame()
+                except Exception as e:
+                    self.handle_render_error(e, message="Error While Recording Frame Cache!")
+                    break
+
+        # Only publish the cache if the full video made it in
+        if ret or frames_written == 0:
+            partial_path.unlink(missing_ok=True)
+            return False
+        os.replace(partial_path, frames_path)
+        Path(self.cache_dir, f"{self.cache_name}.json").write_text(json.dumps({
+            "filename": str(self.filename),
+            "frames": frames_written,
+            "frame_shape": [self.height, self.width, self.pixel_size]
+        }))
+        logging.info(f"Frame Cache For {self.filename} Finished With {frames_written} Frames")
+        return True
+
+    def video_loop(self):
+        # Videos that don't repeat play through once, and then stop
+        if not self.repeat:
+            return super().video_loop()
+
+        # Load the cache, or record it during the first pass of the video
+        try:
+            self.cache_name = self.get_cache_name()
+            self.cached_frames = self.load_cache()
+            if self.cached_frames is None and self.record_cache():
+                self.cached_frames = self.load_cache()
+        except Exception as e:
+            logging.error(f"Error While Setting Up Frame Cache For {self.filename}! {e}")
+
+        # Fall back to regular decoding if the cache is unavailable
+        if self.cached_frames is None:
+            return super().video_loop()
+
+        # Decoder is no longer needed
+        self.cap.release()
+
+        # Hand playback over to the frame scheduler. The video thread ends here.
+        self.frame_index = 0
+        self.frame_task = frame_scheduler.add(self, self.render_cached_frame, 1 / self.max_fps)
+
+    def render_cached_frame(self):
+        try:
+            # Copy the frame out of the memory mapped cache into a pooled buffer, which frame modifiers can draw on
+            start = time.perf_counter()
+            frame = self.new_frame()
+            np.copyto(frame, self.cached_frames[self.frame_index])
+            profiler.record_video(self, "copy", time.perf_counter() - start)
+            self.set_frame(frame)
+            count_frame(self.frame_controller)
+            self.frame_index = (self.frame_index + 1) % len(self.cached_frames)
+        except Exception as e:
+            self.handle_render_error(e, message="Error While Reading Frame Cache!", wait=False)
+            return 1.0
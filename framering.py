@@ -0,0 +1,150 @@
+#
+# Shared memory ring of encoded frames, for handing one stream to several serving processes (see workers.py).
+# One process publishes, any number of processes read. Nothing is locked across processes:
+# every slot carries a version number that readers check before and after copying it out (a seqlock).
+#
+
+import logging
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+# Layout of the ring header (int64 values)
+HEADER_SEQUENCE = 0  # Sequence number of the latest published frame. 0 until the first one.
+HEADER_SLOTS = 1
+HEADER_SLOT_SIZE = 2
+HEADER_MAX_READERS = 3
+HEADER_VIEWERS = 4  # Followed by one viewer count per reader process
+HEADER_FIELDS = 4
+
+
+def attach_shared_memory(name: str):
+    """
+    Opens shared memory created by another process, without taking ownership of it.
+    Otherwise, the resource tracker of this process would remove the memory once this process exits.
+    """
+
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python versions before 3.13 always track shared memory
+        shared_memory = SharedMemory(name=name)
+        resource_tracker.unregister(shared_memory._name, "shared_memory")
+        return shared_memory
+
+
+class FrameRing():
+    """
+    Ring of the most recent encoded frames of a stream, in shared memory.
+    Frames are numbered from 1, and frame n lives in slot n % slots. While frame n is being written,
+    its slot version is 2n - 1, and once it is done, 2n. Readers only trust a copy when the version
+    was 2n both before and after copying it, so frames overwritten mid read are simply read again.
+    Readers also report their viewer counts through the header, each in their own field,
+    so the publisher knows when anyone is watching.
+    """
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        slots: int = 3,
+        slot_size: int = 1024 * 1024,
+        max_readers: int = 64
+    ):
+        self.owner = name is None
+        if self.owner:
+            # Create a new ring
+            header_size = (HEADER_FIELDS + max_readers) * 8
+            self.shared_memory = SharedMemory(create=True, size=header_size + slots * 16 + slots * slot_size)
+            header = np.ndarray((HEADER_FIELDS + max_readers,), dtype=np.int64, buffer=self.shared_memory.buf)
+            header[:] = 0
+            header[HEADER_SLOTS] = slots
+            header[HEADER_SLOT_SIZE] = slot_size
+            header[HEADER_MAX_READERS] = max_readers
+        else:
+            # Attach to an existing ring, taking the layout from its header
+            self.shared_memory = attach_shared_memory(name)
+            header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shared_memory.buf)
+            slots, slot_size, max_readers = (int(value) for value in header[HEADER_SLOTS:HEADER_MAX_READERS + 1])
+
+        self.name = self.shared_memory.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_readers = max_readers
+
+        # Views into the shared memory
+        header_size = (HEADER_FIELDS + max_readers) * 8
+        self.header = np.ndarray((HEADER_FIELDS + max_readers,), dtype=np.int64, buffer=self.shared_memory.buf)
+        self.viewers = self.header[HEADER_VIEWERS:]
+        self.slot_versions = np.ndarray((slots, 2), dtype=np.int64, buffer=self.shared_memory.buf, offset=header_size)
+        self.slot_data = np.ndarray((slots, slot_size), dtype=np.uint8, buffer=self.shared_memory.buf, offset=header_size + slots * 16)
+
+        # Publisher State
+        self.frames_dropped: int = 0
+
+    @property
+    def sequence(self):
+        return int(self.header[HEADER_SEQUENCE])
+
+    def publish(self, frame: bytes):
+        """
+        Writes a new frame into the ring. Only one process may publish to a ring.
+        Frames larger than a slot are dropped.
+        """
+
+        if len(frame) > self.slot_size:
+            if not self.frames_dropped:
+                logging.warning(f"Frame Of {len(frame)} Bytes Does Not Fit In Frame Ring {self.name} ({self.slot_size} Byte Slots)! Dropping Frame.")
+            self.frames_dropped += 1
+            return False
+
+        sequence = self.sequence + 1
+        slot = sequence % self.slots
+        self.slot_versions[slot, 0] = 2 * sequence - 1
+        self.slot_data[slot, :len(frame)] = np.frombuffer(frame, dtype=np.uint8)
+        self.slot_versions[slot, 1] = len(frame)
+        self.slot_versions[slot, 0] = 2 * sequence
+        self.header[HEADER_SEQUENCE] = sequence
+        return True
+
+    def read(self, retries: int = 8):
+        """
+        Returns the latest frame as a (sequence, frame) tuple, or (0, b"") if nothing was published yet
+        """
+
+        for _ in range(retries):
+            sequence = self.sequence
+            if not sequence:
+                return 0, b""
+            slot = sequence % self.slots
+            version = self.slot_versions[slot, 0]
+            length = int(self.slot_versions[slot, 1])
+            frame = self.slot_data[slot, :length].tobytes()
+            # Keep the copy only if the slot was not touched while copying
+            if version == 2 * sequence and self.slot_versions[slot, 0] == version:
+                return sequence, frame
+        return 0, b""
+
+    def set_viewers(self, reader: int, viewers: int):
+        self.viewers[reader] = viewers
+
+    def get_viewers(self):
+        return int(self.viewers.sum())
+
+    def unlink(self):
+        """
+        Removes the ring from the system. Processes that are already attached to it keep working.
+        """
+
+        if self.owner:
+            self.shared_memory.unlink()
+            self.owner = False
+
+    def close(self):
+        # Drop the views first, as shared memory can not be closed while they still exist
+        self.header = self.viewers = self.slot_versions = self.slot_data = None
+        self.shared_memory.close()
+        self.unlink()
+
+    def __repr__(self):
+        return f"<FrameRing {self.name} {self.slots}x{self.slot_size} bytes, frame {self.sequence if self.header is not None else 'closed'}>"
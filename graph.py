@@ -0,0 +1,537 @@
+#
+# Declarative stream graphs.
+# Instead of wiring videos together in code, sources, copies, frame modifiers and routes are described in a TOML file
+# (see streams.toml), which is checked as a whole before anything gets built.
+# Copies that start with the same work (same upstream, same kind and size of copy, and the same leading frame modifiers)
+# share one video for that work, and only the part where they differ is done separately.
+#
+
+import functools
+import importlib
+import json
+import logging
+import os
+import sys
+import tomllib
+from typing import Any, Optional
+
+# Settings for each type of video. Number means int or float.
+VIDEO_KEYS = {
+    "file": {"path": str, "max_fps": "number", "width": int, "height": int, "repeat": bool, "frame_cache": str, "print_fps": bool},
+    "relay": {"url": str, "width": int, "height": int, "max_fps": "number", "on_demand": bool},
+    "soft": {"from": str, "width": int, "height": int, "on_demand": bool, "modifiers": list},
+    "hard": {"from": str, "width": int, "height": int, "max_fps": "number", "on_demand": bool, "modifiers": list}
+}
+REQUIRED_VIDEO_KEYS = {
+    "file": ("path",),
+    "relay": ("url", "width", "height"),
+    "soft": ("from",),
+    "hard": ("from",)
+}
+# Settings for streams, passed on to the streamer (other than video, managed and priority)
+STREAM_KEYS = {
+    "video": str,
+    "managed": bool,
+    "quality": int,
+    "subsampling": str,
+    "fallback_quality": int,
+    "dedupe_frames": bool,
+    "keepalive_interval": "number",
+    "max_renditions": int,
+    "snapshot_lease": "number",
+    "fps_override": "number",
+    "priority": int
+}
+
+# Names of setting types, for error messages
+TYPE_NAMES = {str: "String", int: "Integer", bool: "Boolean", list: "List", "number": "Number"}
+
+# Modules that frame modifiers are looked up in by name. Anything else can be given as "module:name".
+MODIFIER_MODULES = ("render_messages", "filters", "wormhole.utils", "advanced_video_effect", "offload")
+
+
+def check_type(value: Any, expected):
+    # bools are ints in Python, but not in configs
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if expected is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, expected)
+
+
+def resolve_name(name: str):
+    """
+    Finds a frame modifier (or anything else) by name, in MODIFIER_MODULES or in the module given as "module:name"
+    """
+
+    if ":" in name:
+        module_name, _, attribute = name.partition(":")
+        return getattr(importlib.import_module(module_name), attribute)
+    for module_name in MODIFIER_MODULES:
+        module = importlib.import_module(module_name)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise ValueError(f"Unknown Frame Modifier {name}! Not Found In {', '.join(MODIFIER_MODULES)}.")
+
+
+def create_modifier(spec):
+    """
+    Creates a frame modifier from its config. Modifiers are given either by name, or as a table with a name.
+    Classes (such as filters) are created with the rest of the table as arguments,
+    and frame_modifiers arguments are created as modifiers themselves (see offload.OffloadedModifiers).
+    """
+
+    if isinstance(spec, str):
+        spec = {"name": spec}
+    modifier = resolve_name(spec["name"])
+    arguments = {key: value for key, value in spec.items() if key != "name"}
+    if "frame_modifiers" in arguments:
+        arguments["frame_modifiers"] = [create_modifier(nested) for nested in arguments["frame_modifiers"]]
+    if arguments or isinstance(modifier, type):
+        return modifier(**arguments)
+    return modifier
+
+
+def get_modifier_name(spec):
+    return spec if isinstance(spec, str) else spec.get("name", "?")
+
+
+class GraphNode():
+    """
+    A step of the stream graph: a source, a copy of another node, or a frame modifier applied on top of another node.
+    Every chain of steps is only planned once, so videos starting with the same steps share nodes.
+    Only some nodes become actual videos: sources, videos named in the config, and nodes where chains split up.
+    """
+
+    def __init__(self, parent: Optional["GraphNode"], step: tuple):
+        self.parent = parent
+        self.step = step
+        self.children: dict[tuple, GraphNode] = {}
+        # Named videos (and inline stream videos) that end at this node
+        self.names: list[str] = []
+        self.on_demand: bool = True
+        # Video built for this node, if it is built
+        self.video = None
+
+    @property
+    def kind(self):
+        return self.step[0]
+
+    def does_work(self):
+        # Modifiers, hard copies and resizes all cost something per frame. Plain soft copies don't.
+        if self.kind == "soft":
+            return self.step[1] is not None
+        return True
+
+    def is_built(self):
+        return self.parent is None or bool(self.names) or (len(self.children) > 1 and self.does_work())
+
+    def get_base(self):
+        """
+        Returns the closest built ancestor, and the steps from it to this node
+        """
+
+        steps, node = [self], self.parent
+        while not node.is_built():
+            steps.insert(0, node)
+            node = node.parent
+        return node, steps
+
+    def describe(self):
+        if self.kind == "file":
+            return f"File {self.step[1]}"
+        if self.kind == "relay":
+            return f"Relay {self.step[1]}"
+        base, steps = self.get_base()
+        copy = steps[0] if steps[0].kind in ("soft", "hard") else None
+        modifiers = [get_modifier_name(json.loads(step.step[1])) for step in steps if step.kind == "modifier"]
+        text = "SoftCopy" if copy is None or copy.kind == "soft" else "HardCopy"
+        if copy is not None and copy.step[1] is not None:
+            text += f" {copy.step[1]}x{copy.step[2]}"
+        if copy is not None and copy.kind == "hard":
+            text += f" @ {copy.step[3]} fps"
+        if modifiers:
+            text += f" [{', '.join(modifiers)}]"
+        return text
+
+    def __repr__(self):
+        return f"<GraphNode {self.step[:2]} {len(self.children)} children>"
+
+
+class StreamGraph():
+    """
+    Stream graph loaded from a TOML config. See streams.toml for the format.
+    The whole config is validated when it is loaded, and all problems with it are reported at once.
+    """
+
+    def __init__(self, config: dict, name: str = "<config>"):
+        self.config = config
+        self.name = name
+
+        # Every video, named or inline (named after its route)
+        self.videos: dict[str, dict] = {}
+        # Stream options of every route
+        self.streams: dict[str, dict] = {}
+        # Planned graph
+        self.roots: dict[tuple, GraphNode] = {}
+        self.nodes: dict[str, GraphNode] = {}
+
+        problems = self.validate()
+        if problems:
+            raise ValueError(f"Invalid Stream Graph {name}!\n" + "\n".join(f" - {problem}" for problem in problems))
+        self.plan()
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as config_file:
+            return cls(tomllib.load(config_file), name=path)
+
+    def validate(self):
+        """
+        Checks the whole config and returns a list of problems with it. Also collects the videos and streams.
+        """
+
+        problems = []
+        for key in self.config:
+            if key not in ("videos", "streams"):
+                problems.append(f"Unknown Section [{key}]! Must Be [videos] Or [streams].")
+
+        def check_keys(where: str, table: dict, known: dict, required: tuple = ()):
+            for key, value in table.items():
+                if key not in known:
+                    problems.append(f"{where}: Unknown Setting {key}!")
+                elif not check_type(value, known[key]):
+                    problems.append(f"{where}: {key} Must Be A {TYPE_NAMES[known[key]]}, Not {type(value).__name__}!")
+            for key in required:
+                if key not in table:
+                    problems.append(f"{where}: Missing Setting {key}!")
+
+        def check_video(where: str, table: dict, extra_keys: dict):
+            video_type = table.get("type")
+            if video_type not in VIDEO_KEYS:
+                problems.append(f"{where}: Unknown Video Type {video_type!r}! Must Be One Of {', '.join(VIDEO_KEYS)}.")
+                return False
+            check_keys(where, {key: value for key, value in table.items() if key != "type"}, {**VIDEO_KEYS[video_type], **extra_keys}, REQUIRED_VIDEO_KEYS[video_type])
+
+            # Sizes and frame rates
+            if ("width" in table) != ("height" in table):
+                problems.append(f"{where}: Width And Height Must Be Given Together!")
+            for key in ("width", "height", "max_fps"):
+                if check_type(table.get(key), "number") and not table[key] > 0:
+                    problems.append(f"{where}: {key} Must Be Larger Than 0!")
+
+            # Sources
+            if video_type == "file" and isinstance(table.get("path"), str) and not os.path.exists(table["path"]):
+                problems.append(f"{where}: Video File {table['path']} Does Not Exist!")
+
+            # Frame modifiers must all exist
+            for index, spec in enumerate(table.get("modifiers", []) if isinstance(table.get("modifiers"), list) else []):
+                label = get_modifier_name(spec) if isinstance(spec, (str, dict)) else repr(spec)
+                problems.extend(f"{where}: Modifier {index + 1} ({label}): {problem}" for problem in self.check_modifier(spec))
+            return True
+
+        # Videos
+        videos = self.config.get("videos", {})
+        if not isinstance(videos, dict):
+            problems.append("[videos] Must Be A Table!")
+            videos = {}
+        streams = self.config.get("streams", {})
+        if not isinstance(streams, dict) or not streams:
+            problems.append("No Streams! Add At Least One [streams.\"/route\"] Table.")
+            streams = {}
+        # Streams can define their own video, named after their route
+        names = set(videos) | {route for route, table in streams.items() if isinstance(table, dict) and "video" not in table}
+
+        for name, table in videos.items():
+            if not isinstance(table, dict):
+                problems.append(f"videos.{name}: Must Be A Table!")
+            elif check_video(f"videos.{name}", table, {}):
+                self.videos[name] = table
+
+        # Streams
+        for route, table in streams.items():
+            where = f"streams.\"{route}\""
+            if not route.startswith("/"):
+                problems.append(f"{where}: Routes Must Start With '/'!")
+            if not isinstance(table, dict):
+                problems.append(f"{where}: Must Be A Table!")
+                continue
+
+            # Streams either point to a video, or define their own
+            if "video" in table:
+                check_keys(where, table, STREAM_KEYS)
+                if table["video"] not in names:
+                    problems.append(f"{where}: Unknown Video {table['video']}!")
+            elif check_video(where, table, STREAM_KEYS):
+                if route in videos:
+                    problems.append(f"{where}: A Video Named {route} Already Exists!")
+                self.videos[route] = {key: value for key, value in table.items() if key not in STREAM_KEYS}
+            else:
+                continue
+            stream_keys = {key: value for key, value in table.items() if key in STREAM_KEYS}
+            self.streams[route] = stream_keys
+
+            # Stream settings
+            if isinstance(stream_keys.get("subsampling"), str):
+                from turbofix import SUBSAMPLING
+                if stream_keys["subsampling"] not in SUBSAMPLING:
+                    problems.append(f"{where}: Unknown Chroma Subsampling {stream_keys['subsampling']}! Must Be One Of {', '.join(SUBSAMPLING)}.")
+            for key in ("quality", "fallback_quality"):
+                if check_type(stream_keys.get(key), int) and not 1 <= stream_keys[key] <= 100:
+                    problems.append(f"{where}: {key} Must Be Between 1 And 100!")
+
+        # Copies must point to existing videos, without going in circles
+        for name, table in self.videos.items():
+            seen = [name]
+            while "from" in table:
+                upstream = table["from"]
+                if upstream not in self.videos:
+                    problems.append(f"{name}: Copies Unknown Video {upstream}!")
+                    break
+                if upstream in seen:
+                    problems.append(f"{name}: Copies Itself! ({' -> '.join(seen + [upstream])})")
+                    break
+                seen.append(upstream)
+                table = self.videos[upstream]
+
+        return problems
+
+    def check_modifier(self, spec):
+        if isinstance(spec, dict):
+            if not isinstance(spec.get("name"), str):
+                return ["Modifier Tables Need A name!"]
+            nested = spec.get("frame_modifiers", [])
+            if not isinstance(nested, list):
+                return ["frame_modifiers Must Be A List!"]
+            problems = [problem for nested_spec in nested for problem in self.check_modifier(nested_spec)]
+            name = spec["name"]
+        elif isinstance(spec, str):
+            problems, name = [], spec
+        else:
+            return [f"Modifiers Must Be Names Or Tables, Not {type(spec).__name__}!"]
+
+        try:
+            resolve_name(name)
+        except Exception as e:
+            problems.append(str(e))
+        return problems
+
+    def get_steps(self, name: str):
+        """
+        Returns the chain of steps that make up a video, starting with its source
+        """
+
+        table = self.videos[name]
+        video_type = table["type"]
+        if video_type == "file":
+            return [(
+                "file",
+                table["path"],
+                table.get("max_fps", 30),
+                table.get("width"),
+                table.get("height"),
+                table.get("repeat", True),
+                table.get("frame_cache")
+            )]
+        if video_type == "relay":
+            return [("relay", table["url"], table["width"], table["height"], table.get("max_fps", 30))]
+
+        steps = self.get_steps(table["from"])
+        if video_type == "soft":
+            steps.append(("soft", table.get("width"), table.get("height")))
+        else:
+            steps.append(("hard", table.get("width"), table.get("height"), table.get("max_fps", 30)))
+        steps.extend(("modifier", json.dumps(spec, sort_keys=True)) for spec in table.get("modifiers", []))
+        return steps
+
+    def plan(self):
+        """
+        Lays out the steps of every video in use in one tree, so that shared steps are only done once
+        """
+
+        # Only plan videos that are streamed, or that streamed videos copy
+        used, pending = [], [table.get("video", route) for route, table in self.streams.items()]
+        while pending:
+            name = pending.pop()
+            if name not in used:
+                used.append(name)
+                if "from" in self.videos[name]:
+                    pending.append(self.videos[name]["from"])
+        for name in self.videos:
+            if name not in used:
+                logging.warning(f"Video {name} In Stream Graph {self.name} Is Never Used!")
+
+        for name in used:
+            source, *steps = self.get_steps(name)
+            node = self.roots.get(source)
+            if node is None:
+                node = self.roots[source] = GraphNode(None, source)
+            for step in steps:
+                if step not in node.children:
+                    node.children[step] = GraphNode(node, step)
+                node = node.children[step]
+            node.names.append(name)
+            # Always on videos keep their whole chain running anyways, so shared nodes can stay on demand
+            node.on_demand = node.on_demand and self.videos[name].get("on_demand", True)
+            self.nodes[name] = node
+
+    def walk(self):
+        """
+        Yields every node, parents first
+        """
+
+        pending = list(self.roots.values())
+        while pending:
+            node = pending.pop(0)
+            yield node
+            pending.extend(node.children.values())
+
+    def describe(self):
+        """
+        Returns a text overview of the videos that will be built, and the routes streaming them
+        """
+
+        routes: dict[str, list[str]] = {}
+        for route, table in self.streams.items():
+            routes.setdefault(table.get("video", route), []).append(route)
+
+        built = [node for node in self.walk() if node.is_built()]
+        shared = [node for node in built if not node.names]
+        lines = [f"Stream Graph {self.name}: {len(self.streams)} Routes, {len(built)} Videos ({len(shared)} Shared Between Routes)"]
+
+        def add_node(node: GraphNode, depth: int):
+            if node.names:
+                served = [route for name in node.names for route in routes.get(name, [])]
+                # Inline videos are named after their route already
+                named = [name for name in node.names if name not in self.streams]
+                label = " -> ".join(part for part in (", ".join(named), ", ".join(served)) if part)
+            else:
+                label = "(shared)"
+            lines.append(f"{'  ' * depth}{label}: {node.describe()}")
+            for child in self.get_built_children(node):
+                add_node(child, depth + 1)
+
+        for root in self.roots.values():
+            add_node(root, 1)
+        return lines
+
+    def get_built_children(self, node: GraphNode):
+        # Closest built nodes below the node
+        children, pending = [], list(node.children.values())
+        while pending:
+            child = pending.pop(0)
+            if child.is_built():
+                children.append(child)
+            else:
+                pending.extend(child.children.values())
+        return children
+
+    def build_node(self, node: GraphNode):
+        """
+        Creates the video of a node. Its base (the closest built ancestor) must already be built.
+        """
+
+        # Imported here, so that configs can be checked without loading the whole pipeline
+        from pipeline import SoftCopy, HardCopy
+        from profiler import profiler
+        from relay import RelayVideo
+        from sources import open_file_video
+
+        if node.kind == "file":
+            _, path, max_fps, width, height, repeat, frame_cache = node.step
+            print_fps = any(self.videos[name].get("print_fps", False) for name in node.names)
+            return open_file_video(path, max_fps=max_fps, width=width, height=height, repeat=repeat, print_fps=print_fps, frame_cache_dir=frame_cache)
+        if node.kind == "relay":
+            _, url, width, height, max_fps = node.step
+            return RelayVideo(url, width, height, max_fps=max_fps, on_demand=node.on_demand)
+
+        base, steps = node.get_base()
+        original = base.video
+        modifiers = [create_modifier(json.loads(step.step[1])) for step in steps if step.kind == "modifier"]
+        copy = steps[0] if steps[0].kind in ("soft", "hard") else None
+
+        if copy is not None and copy.kind == "hard":
+            _, width, height, max_fps = copy.step
+            video = HardCopy(original, width or original.width, height or original.height, max_fps=max_fps, on_demand=node.on_demand, frame_modifiers=modifiers)
+        else:
+            width, height = copy.step[1:] if copy is not None else (None, None)
+            video = SoftCopy(original, width, height, on_demand=node.on_demand, frame_modifiers=modifiers)
+
+        # Name videos after the config. Shared videos are named after what they do.
+        if node.names:
+            profiler.name_video(video, node.names[0])
+        else:
+            modifier_names = [get_modifier_name(json.loads(step.step[1])) for step in steps if step.kind == "modifier"]
+            profiler.name_video(video, f"{profiler.get_video_name(original)}+{'+'.join(modifier_names) or node.kind}")
+        return video
+
+    def get_video(self, node: GraphNode):
+        """
+        Returns the video of a built node, building it (and the videos it copies) the first time it is asked for
+        """
+
+        if node.video is None:
+            if node.parent is not None:
+                self.get_video(node.get_base()[0])
+            node.video = self.build_node(node)
+        return node.video
+
+    def build_stream(self, server, route: str, streamer, relay_streamer):
+        """
+        Builds the video of a stream, if it isn't already, and adds the stream to the server.
+        Relays that are streamed as they are get passed through.
+        """
+
+        from pipeline import set_priority
+        from relay import RelayVideo
+
+        table = self.streams[route]
+        video = self.get_video(self.nodes[table.get("video", route)])
+        options = {key: value for key, value in table.items() if key not in ("video", "managed", "priority")}
+        if table.get("managed", False):
+            server.stream_video(video)
+        if "priority" in table:
+            set_priority(video, table["priority"])
+        server.create_stream(relay_streamer if isinstance(video, RelayVideo) else streamer, video, route, **options)
+
+    def build(self, server, streamer, relay_streamer):
+        """
+        Builds every video and adds every stream to the server
+        """
+
+        for route in self.streams:
+            self.build_stream(server, route, streamer, relay_streamer)
+
+        for line in self.describe():
+            logging.info(line)
+
+    def add_streams(self, streams, streamer, relay_streamer):
+        """
+        Adds every stream through a LazyStreams (see lazy.py), so that streams can be built on their first request.
+        Videos are still only built once, by whichever stream needs them first. Managed streams are built right away.
+        """
+
+        for route, table in self.streams.items():
+            streams.add(
+                route,
+                functools.partial(self.build_stream, streams.server, route, streamer, relay_streamer),
+                preload=table.get("managed", False))
+
+        for line in self.describe():
+            logging.info(line)
+
+    def __repr__(self):
+        return f"<StreamGraph {self.name} {len(self.streams)} streams>"
+
+
+if __name__ == "__main__":
+    # Checks a stream graph config, and shows what would be built from it
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <config.toml>")
+        sys.exit(2)
+    try:
+        graph = StreamGraph.load(sys.argv[1])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print("\n".join(graph.describe()))
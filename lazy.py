@@ -0,0 +1,245 @@
+#
+# Fast cold starts.
+# With lazy streams, routes are added right away, but the video pipeline behind each stream is only built
+# once someone first asks for it. Until then, viewers get a "Starting Stream" frame, and are handed over
+# to the actual stream as soon as it is ready.
+#
+
+from wormhole.controller import FlaskController
+from wormhole.utils import blank_frame_color, draw_text
+from asynchttp import parse_rendition_query
+from errorstate import ErrorState
+from startup import startup_timer
+
+import asyncio
+import cv2
+import logging
+import socket
+import time
+from flask import request
+from flask.wrappers import Response
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+
+class ListenerFlaskController(FlaskController):
+    """
+    Flask network controller that serves on a listener socket that is already bound (see startup.create_listener),
+    instead of binding its own once the server thread starts. Only the gevent server supports that.
+    Without a listener, or with any other server, it starts like the regular FlaskController.
+    """
+
+    def __init__(self, *args, listener: Optional[socket.socket] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listener = listener
+
+    def start_server(self, *args, **kwargs):
+        if self.listener is None or self.socketio.server.eio.async_mode != "gevent":
+            if self.listener is not None:
+                # Free up the port for the server to bind
+                self.listener.close()
+            return super().start_server(*args, **kwargs)
+
+        # Same server as socketio.run would start under gevent
+        from gevent import pywsgi
+        try:
+            from geventwebsocket.handler import WebSocketHandler
+            handler_options = {"handler_class": WebSocketHandler}
+        except ImportError:
+            handler_options = {}
+
+        logging.info(f"Starting Flask Server on {self.host}:{self.port} (Listening Since Startup)")
+        # The listener was created before gevent patched the socket module, so hand it over to a gevent socket
+        listener = socket.socket(self.listener.family, self.listener.type, fileno=self.listener.detach())
+        self.socketio.wsgi_server = pywsgi.WSGIServer(
+            listener,
+            self.app,
+            log="default" if self.debug else None,
+            **handler_options,
+            **self.server_kwargs)
+        self.socketio.wsgi_server.serve_forever()
+
+
+class LazyStreams():
+    """
+    Adds streams to a Wormhole server, each from a function that builds it.
+    Without lazy, streams are built right away. With lazy, a placeholder route is added instead, and the stream is built
+    in the background on its first request (or right away with preload, for streams that are always on anyways).
+    Builds run one at a time, so builders can share videos without locking. Failed builds are retried on a later request.
+    Snapshot routes only exist once their stream is built.
+    Anything that needs to know about every stream (like the worker pool) can add a build listener.
+    """
+
+    def __init__(
+        self,
+        server,
+        lazy: bool = True,
+        boundary: str = "WORMHOLE",
+        placeholder_size: tuple[int, int] = (1280, 720),
+        placeholder_interval: float = 0.5,
+        retry_interval: float = 5.0
+    ):
+        self.server = server
+        self.lazy = lazy
+        self.boundary = boundary
+        self.placeholder_interval = placeholder_interval
+        self.retry_interval = retry_interval
+        self.use_async = hasattr(server.controller, "add_stream_route")
+
+        # Stream builders, and their build state
+        self.builders: dict[str, Callable[[], None]] = {}
+        self.building: set[str] = set()
+        self.failed_at: dict[str, float] = {}
+        self.error_states: dict[str, ErrorState] = {}
+        self.build_listeners: list[Callable[[str], None]] = []
+        self.lock = Lock()
+        self.build_lock = Lock()
+
+        # Placeholder part, encoded once for every stream
+        self.placeholder_part = self.create_placeholder(*placeholder_size) if lazy else b""
+
+        # Streams add their routes (like snapshot.jpg) as they get built, which may be after Flask served its first request.
+        # Wormhole allows hot-adding routes by patching _is_setup_finished, but newer Flask versions check _check_setup_finished instead.
+        if lazy:
+            server.controller.app._check_setup_finished = lambda f_name: None
+
+    def create_placeholder(self, width: int, height: int):
+        frame = blank_frame_color(width, height, (0, 0, 0))
+        draw_text(frame, "Starting Stream...", (10, 60), font_size=2, font_stroke=4)
+        draw_text(frame, "This stream was just started up, and will begin playing in a moment.", (10, 100))
+        jpeg = cv2.imencode(".jpg", frame)[1].tobytes()
+        return f"--{self.boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode() + jpeg + b"\r\n"
+
+    def add(self, route: str, build: Callable[[], None], preload: bool = False):
+        """
+        Adds a stream. build has to add the stream for the route to the server (with server.create_stream).
+        """
+
+        self.builders[route] = build
+        if not self.lazy:
+            self.build(route)
+            return
+
+        self.error_states[route] = ErrorState(f"Stream Build {route}")
+        if self.use_async:
+            async def placeholder_feed(request, writer):
+                await self.serve_placeholder_async(route, request, writer)
+            self.server.controller.add_stream_route(route, placeholder_feed, placeholder=True)
+        else:
+            def placeholder_feed():
+                return Response(
+                    self.generate_placeholder(route, parse_rendition_query(request.args)),
+                    mimetype=f"multipart/x-mixed-replace; boundary={self.boundary}")
+            # Flask keeps serving the route from the first handler added for it, so the placeholder hands viewers over itself
+            self.server.controller.add_route(route, placeholder_feed)
+
+        if preload:
+            self.request_build(route)
+
+    def request_build(self, route: str):
+        """
+        Starts building a stream in the background, unless it is built, being built, or failed too recently
+        """
+
+        with self.lock:
+            if route in self.server.routes or route in self.building:
+                return
+            if time.time() - self.failed_at.get(route, 0) < self.retry_interval:
+                return
+            self.building.add(route)
+        Thread(target=self.build_in_background, args=(route,), daemon=True).start()
+
+    def build_in_background(self, route: str):
+        try:
+            self.build(route)
+            self.failed_at.pop(route, None)
+            self.error_states[route].recover()
+        except Exception as e:
+            self.failed_at[route] = time.time()
+            self.error_states[route].record(e, "Error While Building Stream!")
+        finally:
+            with self.lock:
+                self.building.discard(route)
+
+    def add_build_listener(self, listener: Callable[[str], None]):
+        """
+        Calls the listener with the route of every stream once it is built, starting with the streams that already are
+        """
+
+        with self.build_lock:
+            self.build_listeners.append(listener)
+            for route in self.builders:
+                if route in self.server.routes:
+                    self.notify_listeners(route, [listener])
+
+    def notify_listeners(self, route: str, listeners: list[Callable[[str], None]]):
+        # The stream itself is built either way, so listener errors are only logged
+        for listener in listeners:
+            try:
+                listener(route)
+            except Exception as e:
+                logging.error(f"Error While Handing Over Stream {route} To {listener}! {e}", exc_info=True)
+
+    def build(self, route: str):
+        with self.build_lock:
+            build_start = time.time()
+            self.builders[route]()
+            build_time = time.time() - build_start
+            if route not in self.server.routes:
+                raise RuntimeError(f"Builder For Stream {route} Did Not Add The Stream!")
+            self.notify_listeners(route, self.build_listeners)
+        startup_timer.record_build(route, build_time)
+        logging.info(f"Built Stream {route} In {build_time * 1000:.1f}ms")
+
+    def get_streamer(self, route: str):
+        # The built stream, if it uses the same boundary as the placeholder. Otherwise, the viewer has to reconnect.
+        streamer = self.server.routes[route]
+        if streamer.boundary != self.boundary:
+            logging.warning(f"Stream {route} Uses A Different Boundary Than Its Placeholder! Viewers Have To Reconnect.")
+            return None
+        return streamer
+
+    def generate_placeholder(self, route: str, rendition: dict):
+        """
+        Sends the placeholder until the stream is built, then the stream itself
+        """
+
+        last_send_time = 0.0
+        while route not in self.server.routes:
+            self.request_build(route)
+            if time.time() - last_send_time >= self.placeholder_interval:
+                last_send_time = time.time()
+                yield self.placeholder_part
+                startup_timer.frame_sent(placeholder=True)
+            time.sleep(0.05)
+
+        streamer = self.get_streamer(route)
+        if streamer is not None:
+            yield from streamer.generate_frames(**rendition)
+
+    async def serve_placeholder_async(self, route: str, request, writer: asyncio.StreamWriter):
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: multipart/x-mixed-replace; boundary={self.boundary}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1"))
+
+        loop = asyncio.get_running_loop()
+        last_send_time = 0.0
+        while route not in self.server.routes:
+            self.request_build(route)
+            if loop.time() - last_send_time >= self.placeholder_interval:
+                last_send_time = loop.time()
+                writer.write(self.placeholder_part)
+                await writer.drain()
+                startup_timer.frame_sent(placeholder=True)
+            await asyncio.sleep(0.05)
+
+        streamer = self.get_streamer(route)
+        if streamer is not None:
+            await streamer.send_frames(request, writer)
+
+    def __repr__(self):
+        pending = [route for route in self.builders if route not in self.server.routes]
+        return f"<LazyStreams {len(self.builders)} streams, {len(pending)} not built>"
@@ -3,35 +3,13 @@
 #
 
 # Import Libraries
+# Only the bare minimum is imported up here. Wormhole (along with OpenCV, Flask and gevent)
+# takes most of a second to load, so it is only imported once main() has had a chance
+# to open the server port. (More on that in main!)
 import argparse
-import cv2
-import numpy as np
+import functools
 import math
-
-from wormhole import Wormhole
-from wormhole.video import FileVideo, SoftCopy, HardCopy, CustomVideo
-from wormhole.utils import (
-    render_fraps_fps, 
-    render_full_fps,
-    render_debug_info, 
-    render_watermark,
-    draw_overlay,
-    blend_frames,
-    draw_text)
-from turbofix import TurboMJPEGStreamer
-
-# Move message rendering to another file to save space
-from render_messages import (
-    render_welcome_message,
-    render_low_res_message,
-    render_grayscale_message,
-    render_inverted_message,
-    render_advanced_message,
-    render_overlay_message,
-    render_webcam_message,
-    render_proxy_message,
-    render_custom_message
-)
+from startup import startup_timer, create_listener
 
 
 def main():
@@ -45,36 +23,144 @@ def main():
     parser.add_argument('--port', type=int, default=8000)
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--video', type=str, default='video.webm')
+    parser.add_argument('--frame-cache', type=str, default=None)
+    parser.add_argument('--async', dest='use_async', action='store_true')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--producer-port', type=int, default=None)
+    parser.add_argument('--relay-url', type=str, default=None)
+    parser.add_argument('--config', type=str, default=None)
+    parser.add_argument('--lazy', action='store_true')
     args = parser.parse_args()
 
+    # With --workers, this process only produces the streams, and worker processes serve viewers on the public port.
+    # (More on that at the bottom!) Wormhole itself then listens privately, for the workers to pass requests on to.
+    if args.workers:
+        host, port = "127.0.0.1", args.producer_port or args.port + 1
+    else:
+        host, port = args.host, args.port
+    
+    # With --lazy, the server starts up as fast as it can, for example after a container restart.
+    # The port is opened before anything heavy is loaded, so early visitors wait a moment instead of being refused,
+    # and each stream is only built once someone first asks for it. Until then, viewers see a "Starting Stream" frame.
+    # How long every step took is logged once the first frame is sent, and served on /metrics.
+    listener = None
+    if args.lazy:
+        listener = create_listener(host, port)
+        startup_timer.mark("listening")
+    
+    # Load Wormhole and the streaming backends
+    from wormhole import Wormhole
+    from turbofix import TurboMJPEGStreamer
+    from asyncstreamer import AsyncController, AsyncTurboMJPEGStreamer
+    from relay import RelayStreamer, AsyncRelayStreamer
+    from lazy import LazyStreams, ListenerFlaskController
+    startup_timer.mark("imports")
+
     # Create Wormhole Instance
-    server = Wormhole(host = args.host, port = args.port, debug = args.debug, welcome_screen = False)
+    # With --async, streams are served from an asyncio event loop instead of a thread per viewer.
+    if args.use_async:
+        server = Wormhole(network_controller = AsyncController, host = host, port = port, listener = listener, debug = args.debug, welcome_screen = False)
+        streamer = AsyncTurboMJPEGStreamer
+        relay_streamer = AsyncRelayStreamer
+    else:
+        server = Wormhole(network_controller = ListenerFlaskController, host = host, port = port, listener = listener, debug = args.debug, welcome_screen = False)
+        streamer = TurboMJPEGStreamer
+        relay_streamer = RelayStreamer
+    startup_timer.mark("server")
+    
+    # Streams are added along with the function that builds them.
+    # Without --lazy, they are simply built right away.
+    streams = LazyStreams(server, lazy = args.lazy)
+    
+    # With --config, the streams are built from a stream graph config (see streams.toml and graph.py)
+    # instead of from the demo code below. Both get the same pages and metrics after that.
+    if args.config:
+        from graph import StreamGraph
+        StreamGraph.load(args.config).add_streams(streams, streamer, relay_streamer)
+    else:
+        create_demo_streams(streams, streamer, relay_streamer, args, port)
+    
+    serve(server, streams, args, host, port)
+
+
+def create_demo_streams(streams, streamer, relay_streamer, args, port):
+    """
+    Sets up every stream of the demo.
+    Each stream is built by its own function, which streams.add either runs right away, or (with --lazy)
+    on the first request for the stream. Videos that several streams share are only created once.
+    """
+    
+    from wormhole.utils import (
+        render_fraps_fps, 
+        render_full_fps,
+        render_debug_info, 
+        render_watermark,
+        draw_text)
+    from relay import RelayVideo
+    from sources import open_file_video
+    from compositing import composite_overlay
+    from filters import GrayscaleFilter, InvertFilter
+    from pipeline import CustomVideo, SoftCopy, HardCopy, add_dependency, set_priority
+    
+    # Move message rendering to another file to save space
+    from render_messages import (
+        render_welcome_message,
+        render_low_res_message,
+        render_grayscale_message,
+        render_inverted_message,
+        render_advanced_message,
+        render_overlay_message,
+        render_webcam_message,
+        render_proxy_message,
+        render_custom_message
+    )
+    
+    server = streams.server
     
     """
-    Stream Main Video Stream
+    Load Video From File
     """
     
-    server.stream(
-        args.video, 
-        print_video_fps=True, 
-        frame_modifiers=[
-            render_fraps_fps, 
-            render_debug_info, 
-            render_watermark,
-            render_welcome_message])
-    
-    # This creates an alias to the "managed" default video stream.
-    server.create_stream(TurboMJPEGStreamer, server.managed_streams.get("default", (None,))[0], '/')
+    # Every stream in this demo is built from the same video file.
+    # open_file_video makes sure the file is only decoded once, no matter
+    # how many streams end up reading from it.
+    # With --frame-cache, decoded frames are also saved to disk so that
+    # every loop after the first (and every restart) skips decoding entirely.
+    # The file is opened by the first stream that gets built.
+    def get_video():
+        return open_file_video(args.video, print_fps=True, frame_cache_dir=args.frame_cache)
     
     """
-    Load Video From File
+    Stream Main Video Stream
     """
-     
-    # The reason why we dont use this above is because
-    # I'm trying to show the basic server.stream method
-    # of streaming a video file. Everything down here 
-    # are more advanced features that Wormhole supports.
-    video = FileVideo(args.video)
+    
+    def build_default_stream():
+        # The main stream is a "Soft Copy" of the video with the welcome message drawn on top.
+        # (More on copies below!) It is always on, as managed streams can be viewed
+        # through protocols that don't report their viewers.
+        default_video = SoftCopy(
+            get_video(), 
+            on_demand=False,
+            frame_modifiers=[
+                render_fraps_fps, 
+                render_debug_info, 
+                render_watermark,
+                render_welcome_message])
+        
+        # server.stream_video turns the video into a "managed" stream
+        # that other Wormhole instances can connect to and view.
+        server.stream_video(default_video)
+        
+        # This creates an alias to the "managed" default video stream.
+        server.create_stream(streamer, default_video, '/')
+        
+        # Every video gets its frames from one shared frame scheduler (see scheduler.py).
+        # When the server falls behind, videos with a higher priority get their frames first.
+        # This also raises the video file to the same priority, as the main stream depends on it.
+        set_priority(default_video, 10)
+    
+    # As it is always on anyways, the main stream is built right away, even with --lazy. (In the background, if so)
+    streams.add('/', build_default_stream, preload=True)
     
     """
     Stream Original Video
@@ -82,24 +168,37 @@ def main():
     
     # This is all the code needed to stream to a custom url!
     # Raw unprocessed video stream as simple as that!
-    server.create_stream(TurboMJPEGStreamer, video, '/original')
+    def build_original_stream():
+        server.create_stream(streamer, get_video(), '/original')
+    
+    streams.add('/original', build_original_stream)
     
     """
     Low Resolution Stream Demo
     """
     
-    # Here, we create a realtime "Hard Copy" of the original video.
-    # This creates a brand new video thread that implements its own 
-    # frame rate controller, with frames being pulled directly from 
-    # the original video.
-    # We use this to create a low resolution and frame rate copy of
-    # the original stream.
-    lowres_video = HardCopy(video, 640, 360, max_fps=10, frame_modifiers = [render_full_fps, render_fraps_fps, render_low_res_message])
+    def build_lowres_stream():
+        # Here, we create a realtime "Hard Copy" of the original video.
+        # This creates a brand new video thread that implements its own 
+        # frame rate controller, with frames being pulled directly from 
+        # the original video.
+        # We use this to create a low resolution and frame rate copy of
+        # the original stream.
+        # Copies are "on demand" by default, meaning that they only pull and
+        # process frames while someone is actually watching them.
+        lowres_video = HardCopy(get_video(), 640, 360, max_fps=10, frame_modifiers = [render_full_fps, render_fraps_fps, render_low_res_message])
+        
+        # Here, we stream with custom imencode configs passed to the MJPEGStreamer.
+        # In this instance, we are significantly dropping the quality of the video
+        # to add to the crusty:tm: feel. 4:2:0 chroma subsampling (instead of the default 4:2:2)
+        # halves the color data again, which nobody will notice at this quality anyways.
+        server.create_stream(streamer, lowres_video, '/lowres', quality = 10, subsampling = "420")
+    
+    streams.add('/lowres', build_lowres_stream)
     
-    # Here, we stream with custom imencode configs passed to the MJPEGStreamer.
-    # In this instance, we are significantly dropping the quality of the video
-    # to add to the crusty:tm: feel.
-    server.create_stream(TurboMJPEGStreamer, lowres_video, '/lowres', quality = 10)
+    # If all you need is a smaller or crustier version of a stream, you don't even need a copy!
+    # Every stream accepts the width, quality and fps query parameters, such as /original?width=640&quality=10&fps=10.
+    # Each distinct rendition is encoded once and shared by every viewer asking for it.
     
     """
     Postprocessed Video Streams - Grayscale
@@ -108,100 +207,147 @@ def main():
     # Here is where the fun starts.
     # Wormhole supports many advanced postprocessing features.
     
-    # Here, we create a basic filter
-    def grayscale_filter(video):
-        video._frame = cv2.cvtColor(video._frame, cv2.COLOR_BGR2GRAY)
-        video._frame = cv2.cvtColor(video._frame, cv2.COLOR_GRAY2BGR)  # Make sure image is still 3 channel
+    # The grayscale video is also drawn on top of the overlay video further down,
+    # so it is created once, by whichever of the two streams gets built first.
+    @functools.cache
+    def get_grayscale_video():
+        # Here, we use a basic filter. Filters are just frame modifiers,
+        # and the built-in ones in filters.py work on the frame in place without
+        # allocating any new frames. With channels=1, GrayscaleFilter hands out a single channel
+        # frame, which streams as a grayscale JPEG without expanding it back to 3 channels.
+        # (It goes after render_fraps_fps, as the yellow FPS counter would draw black on a single channel frame)
+        grayscale_filter = GrayscaleFilter(channels=1)
+        
+        # then, we create a realtime "Soft Copy" of the original video
+        # so that any modifications dont modify the original
+        # Soft copies are realtime copies of the original video using
+        # frame subscribes and publishers. This is better for light weight video modifications
+        return SoftCopy(get_video(), frame_modifiers = [render_debug_info, render_fraps_fps, grayscale_filter, render_grayscale_message])
+    
+    def build_grayscale_stream():
+        server.create_stream(streamer, get_grayscale_video(), '/grayscale')
     
-    # then, we create a realtime "Soft Copy" of the original video
-    # so that any modifications dont modify the original
-    # Soft copies are realtime copies of the original video using
-    # frame subscribes and publishers. This is better for light weight video modifications
-    grayscale_video = SoftCopy(video, frame_modifiers = [render_debug_info, render_fraps_fps, grayscale_filter, render_grayscale_message])
-    server.create_stream(TurboMJPEGStreamer, grayscale_video, '/grayscale')
+    streams.add('/grayscale', build_grayscale_stream)
     
     """
     Postprocessed Video Streams - Inverted
     """
     
-    # Here is another example of a video filter. This one is applied during runtime!
-    # (After initializing the video stream)
-    def invert_filter(video):
-        video._frame = (255 - video._frame)
+    # Same goes for the inverted video.
+    @functools.cache
+    def get_inverted_video():
+        # Here is another example of a video filter. This one is applied during runtime!
+        # (After the video is already running)
+        # filters.py also has brightness/contrast, lookup table and channel swap filters.
+        invert_filter = InvertFilter()
         
-    inverted_video = SoftCopy(video, frame_modifiers = [render_debug_info, render_fraps_fps]) 
-    server.create_stream(TurboMJPEGStreamer, inverted_video, '/inverted')
-    # This filter is added in realtime!
-    inverted_video.add_frame_modifier(invert_filter)
-    inverted_video.add_frame_modifier(render_inverted_message)
+        inverted_video = SoftCopy(get_video(), frame_modifiers = [render_debug_info, render_fraps_fps]) 
+        # This filter is added in realtime!
+        inverted_video.add_frame_modifier(invert_filter)
+        inverted_video.add_frame_modifier(render_inverted_message)
+        return inverted_video
+    
+    def build_inverted_stream():
+        server.create_stream(streamer, get_inverted_video(), '/inverted')
+    
+    streams.add('/inverted', build_inverted_stream)
     
     """
     Advanced Postprocessed Video Streams
     """
     
-    # Here is an example of a computationally heavy postprocessed video stream
-    from advanced_video_effect import circle_video_filter, wavy_image_filter
-    
-    # We first create a hard copy of the video with half the resolution
-    # This makes it so that the video is somewhat useable.
-    # postprocessing_test_video = HardCopy(
-    #     video, 
-    #     video.width//2, 
-    #     video.height//2, 
-    #     frame_modifiers = [
-    #         circle_video_filter, 
-    #         wavy_image_filter, 
-    #         render_debug_info, 
-    #         render_fraps_fps,
-    #         render_advanced_message
-    #     ]) 
-    # server.create_stream(TurboMJPEGStreamer, postprocessing_test_video, '/postprocessing')
+    def build_postprocessing_stream():
+        # Here is an example of a computationally heavy postprocessed video stream
+        from advanced_video_effect import circle_video_filter, wavy_image_filter
+        
+        # Heavy filters like these would slow down every other stream in the process,
+        # so we offload them to a pool of worker processes. Frames are passed over
+        # through shared memory, and get dropped if the workers fall behind.
+        # The workers take a moment to start, so the first few frames are shown without the filters.
+        from offload import OffloadedModifiers
+        
+        # We first create a hard copy of the video with half the resolution
+        # This makes it so that the video is somewhat useable.
+        video = get_video()
+        postprocessing_test_video = HardCopy(
+            video, 
+            video.width//2, 
+            video.height//2, 
+            max_fps=30,
+            frame_modifiers = [
+                OffloadedModifiers([circle_video_filter, wavy_image_filter], workers=2), 
+                render_debug_info, 
+                render_fraps_fps,
+                render_advanced_message
+            ]) 
+        server.create_stream(streamer, postprocessing_test_video, '/postprocessing')
+    
+    streams.add('/postprocessing', build_postprocessing_stream)
     
     """
     Video Overlaying Demo
     """
     
-    # In this example, we are drawing two other live video feeds on top of the original video.
-    # This is done by creating a new video stream that is a hard copy of the original video.
-    # and adding frame modifiers that will draw on top of the original video.
-    
-    # Here is a helper function that will draw a video feed on top of the original video.
-    def render_overlay_feeds(video):
-        # In this example, we will the grayscale and inverted video feeds
-        grayscale_frame = grayscale_video.get_frame()
-        inverted_frame = inverted_video.get_frame()
-        
-        # First, overlay the grayscale video with a moving offset
-        draw_overlay(
-            video._frame, 
-            grayscale_frame, 
-            (video.width//4 + int(math.sin(video.frame_controller.frames_rendered/10)*video.width//8), 32), 
-            (video.width//4, video.height//4))
+    def build_overlay_stream():
+        # In this example, we are drawing two other live video feeds on top of the original video.
+        # This is done by creating a new video stream that is a hard copy of the original video.
+        # and adding frame modifiers that will draw on top of the original video.
+        video = get_video()
         
-        # Draw Description Text
-        draw_text(video._frame, "Moving Video Demo", (video.width//4, 300), font_size=2)
+        # The feeds are drawn at a quarter of the size, so instead of shrinking the full
+        # frames on every tick, we subscribe to pre-scaled taps of the grayscale and inverted videos.
+        # Each frame is only resized once, as it is published.
+        inset_size = (video.width//4, video.height//4)
+        grayscale_inset = SoftCopy(get_grayscale_video(), *inset_size)
+        inverted_inset = SoftCopy(get_inverted_video(), *inset_size)
         
-        # Then, draw the inverted video with a transparency
-        # Render the watermark onto a copy of the frame
-        transparent_frame = draw_overlay(video._frame.copy(), inverted_frame, (video.width//4, 440), (video.width//4, video.height//4))
+        # Here is a helper function that will draw a video feed on top of the original video.
+        # composite_overlay only touches the part of the frame under the feed.
+        def render_overlay_feeds(video):
+            # In this example, we will the grayscale and inverted video feeds
+            grayscale_frame = grayscale_inset.get_frame()
+            inverted_frame = inverted_inset.get_frame()
+            
+            # First, overlay the grayscale video with a moving offset
+            composite_overlay(
+                video._frame, 
+                grayscale_frame, 
+                (video.width//4 + int(math.sin(video.frame_controller.frames_rendered/10)*video.width//8), 32), 
+                inset_size)
+            
+            # Draw Description Text
+            draw_text(video._frame, "Moving Video Demo", (video.width//4, 300), font_size=2)
+            
+            # Then, draw the inverted video with a transparency
+            composite_overlay(video._frame, inverted_frame, (video.width//4, 440), inset_size, transparency=0.2)
+            
+            # Draw Description Text
+            draw_text(video._frame, "Transparent Video Demo", (video.width//4, 700), font_size=2)
 
-        # Render the watermark with the new width and height
-        blend_frames(video._frame, transparent_frame, transparency=0.2)
+        # Here we create a hard copy of the original video
+        overlay_video = HardCopy(
+            video, 
+            video.width, 
+            video.height, 
+            frame_modifiers = [
+                render_overlay_feeds,
+                render_debug_info, 
+                render_fraps_fps,
+                render_overlay_message])
         
-        # Draw Description Text
-        draw_text(video._frame, "Transparent Video Demo", (video.width//4, 700), font_size=2)
-
-    # Here we create a hard copy of the original video
-    overlay_video = HardCopy(
-        video, 
-        video.width, 
-        video.height, 
-        frame_modifiers = [
-            render_overlay_feeds,
-            render_debug_info, 
-            render_fraps_fps,
-            render_overlay_message])
-    server.create_stream(TurboMJPEGStreamer, overlay_video, '/overlay')
+        # The overlay stream is pretty heavy on bandwidth, so viewers on slow connections
+        # that keep falling behind get switched over to a lower quality version of it.
+        server.create_stream(streamer, overlay_video, '/overlay', fallback_quality = 40)
+        
+        # The overlay pulls frames from the grayscale and inverted feeds,
+        # so let them know to keep running while the overlay is being watched.
+        add_dependency(overlay_video, grayscale_inset)
+        add_dependency(overlay_video, inverted_inset)
+        
+        # The overlay is the heaviest stream of the demo, so it goes last when the server falls behind.
+        set_priority(overlay_video, -10)
+    
+    streams.add('/overlay', build_overlay_stream)
     
     """
     Webcam Demo
@@ -213,7 +359,35 @@ def main():
     Video Proxying Demo
     """
     
-    # TODO
+    # Wormhole can also relay video streams from other servers, such as other Wormhole instances!
+    # Here, we relay the /original stream back from this very server, but --relay-url
+    # can point it at any Motion JPEG stream.
+    relay_url = args.relay_url or f"http://127.0.0.1:{port}/original"
+    
+    # Both relay streams below share the same relay.
+    @functools.cache
+    def get_relayed_video():
+        # The relay only connects to the upstream while someone is watching.
+        # Relayed frames are scaled to the given size, if they ever need to be decoded (more on that below).
+        video = get_video()
+        return RelayVideo(relay_url, video.width, video.height)
+    
+    def build_rebroadcast_stream():
+        # Rebroadcasting the stream as is does not need any decoding or encoding at all!
+        # Each JPEG from the upstream is sent on to every viewer byte for byte,
+        # so an edge server like this one barely uses any CPU, no matter how many viewers it has.
+        # (Asking for another width or quality, such as /rebroadcast?width=640, still encodes that rendition locally)
+        server.create_stream(relay_streamer, get_relayed_video(), '/rebroadcast')
+    
+    streams.add('/rebroadcast', build_rebroadcast_stream)
+    
+    def build_proxy_stream():
+        # To draw on top of a relayed stream, make a copy of it just like any other video.
+        # Frames are only decoded while the copy is actually being watched.
+        proxied_video = SoftCopy(get_relayed_video(), frame_modifiers = [render_debug_info, render_fraps_fps, render_proxy_message])
+        server.create_stream(streamer, proxied_video, '/proxy')
+    
+    streams.add('/proxy', build_proxy_stream)
     
     """
     Custom Video Demo
@@ -222,19 +396,24 @@ def main():
     # Here, we dont use any video source. We generate new image frames during runtime!
     
     # Here is a helper function that will generate a new image frame
+    # video.new_frame() hands out a reusable frame buffer, so nothing new gets allocated every frame
+    # (This needs import cv2)
     # def frame_generator(video):
-    #     new_frame = np.zeros((video.height, video.width, 3), np.uint8)
+    #     new_frame = video.new_frame()
     #     new_frame[:] = (video.frame_controller.frames_rendered % 196, 255, 255)
-    #     new_frame = cv2.cvtColor(new_frame, cv2.COLOR_HSV2BGR)
+    #     cv2.cvtColor(new_frame, cv2.COLOR_HSV2BGR, dst=new_frame)
         
     #     video.set_frame(new_frame)
 
-    # custom_video = CustomVideo(1920, 804, 100, frame_generator, frame_modifiers = [
-    #     render_debug_info, 
-    #     render_fraps_fps,
-    #     render_custom_message
-    # ])
-    # server.create_stream(TurboMJPEGStreamer, custom_video, '/custom')
+    # def build_custom_stream():
+    #     custom_video = CustomVideo(1920, 804, 100, frame_generator, frame_modifiers = [
+    #         render_debug_info, 
+    #         render_fraps_fps,
+    #         render_custom_message
+    #     ])
+    #     server.create_stream(streamer, custom_video, '/custom')
+    
+    # streams.add('/custom', build_custom_stream)
     
     """
     Error Handling Demo
@@ -247,9 +426,24 @@ def main():
                         "In this example, Wormhole gracefully captures the error "
                         "and continues processing all other video streams with no issues.")
 
-    # Wormhole gracefully handles such error and continues on with all other streams
-    error_video = CustomVideo(1920, 804, 100, error_generator)
-    server.create_stream(TurboMJPEGStreamer, error_video, '/error')
+    def build_error_stream():
+        # Wormhole gracefully handles such error and continues on with all other streams.
+        # The error is only logged once (with a short summary every so often after that),
+        # and every viewer is sent the same "stream unavailable" frame until the video recovers.
+        error_video = CustomVideo(1920, 804, 100, error_generator)
+        
+        # Custom videos can end up publishing the same image over and over again, so we let
+        # the streamer check for duplicate frames. Duplicates are not encoded again, and viewers
+        # only get the frame resent once a second to keep the connection alive.
+        server.create_stream(streamer, error_video, '/error', dedupe_frames = True)
+    
+    streams.add('/error', build_error_stream)
+
+
+def serve(server, streams, args, host, port):
+    """
+    Adds the pages shared by every setup, then serves until the process exits
+    """
     
     """
     Static Webpage Demo
@@ -288,6 +482,40 @@ def main():
 
     server.controller.add_route("/debug", serve_debug, methods=["GET"], strict_slashes=False)
     
+    """
+    Pipeline Metrics
+    """
+    
+    # Every video times its decoding, copying and each of its frame modifiers,
+    # and every stream times encoding and sending its frames.
+    # /metrics serves those timings (p50/p95/p99), along with client counts and
+    # dropped frames per stream and per offloaded modifier, in a format that Prometheus can scrape.
+    from flask import Response
+    from profiler import profiler
+    
+    def serve_metrics():
+        return Response(profiler.generate_metrics(server), mimetype="text/plain; version=0.0.4")
+
+    server.controller.add_route("/metrics", serve_metrics, methods=["GET"], strict_slashes=False)
+    
+    """
+    Multi-Process Serving
+    """
+    
+    # Serving lots of viewers competes with the video pipelines for the GIL.
+    # With --workers, every stream set up above is still decoded and encoded once, in this process,
+    # but the encoded frames are handed over through shared memory to worker processes
+    # that serve viewers on the public port. Viewer capacity then scales with the number of cores.
+    # Everything else (pages, snapshots, renditions, ...) is passed on to this process.
+    # Viewers that fall behind get dropped to the fallback quality of their stream, just like they would here.
+    # With --lazy, streams get handed over to the workers as they are built.
+    if args.workers:
+        from workers import WorkerPool
+        worker_pool = WorkerPool(server, args.host, args.port, args.workers, upstream=(host, port))
+        streams.add_build_listener(worker_pool.add_stream)
+    
+    startup_timer.mark("routes")
+    
     # Join server thread to keep process alive
     server.join()
 
@@ -0,0 +1,270 @@
+#
+# Offloaded frame modifiers.
+# Heavy frame modifiers run in a pool of worker processes instead of holding the GIL of the server process.
+# Frames go back and forth through shared memory slots, and frames the workers can't keep up with are dropped.
+#
+
+import atexit
+import logging
+import multiprocessing
+import numpy as np
+import os
+import time
+import traceback
+from collections import deque
+from threading import Thread
+from multiprocessing.shared_memory import SharedMemory
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+# Shared memory slot states
+SLOT_FREE = 0
+SLOT_QUEUED = 1
+SLOT_DONE = 2
+SLOT_ERROR = 3
+
+
+class WorkerVideo():
+    """
+    Stand-in for the video object that frame modifiers see when running inside of a worker process
+    """
+
+    def __init__(self, frame: np.ndarray, width: int, height: int, frames_rendered: int):
+        self._frame = frame
+        self.width = width
+        self.height = height
+        self.pixel_size = frame.shape[2] if frame.ndim == 3 else 1
+        self.frame_controller = SimpleNamespace(frames_rendered=frames_rendered)
+
+
+def offload_worker(shm_name: str, num_slots: int, frame_shape: tuple, frame_modifiers: list, job_queue):
+    """
+    Worker process main loop. Runs the modifier chain on frames placed in shared memory slots.
+    """
+
+    shared_memory = SharedMemory(name=shm_name)
+    slot_states = np.ndarray((num_slots,), dtype=np.int64, buffer=shared_memory.buf)
+    slot_frames = np.ndarray((num_slots, *frame_shape), dtype=np.uint8, buffer=shared_memory.buf, offset=num_slots * 8)
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        slot, width, height, frames_rendered = job
+
+        try:
+            # Run the modifier chain straight on the slot
+            video = WorkerVideo(slot_frames[slot], width, height, frames_rendered)
+            for modifier in frame_modifiers:
+                modifier(video)
+
+            # Modifiers usually replace the frame, so copy the result back into the slot
+            if video._frame is not slot_frames[slot]:
+                slot_frames[slot][...] = video._frame
+            slot_states[slot] = SLOT_DONE
+        except Exception as e:
+            logging.error(f"Error While Running Offloaded Frame Modifiers {frame_modifiers}: {e}")
+            traceback.print_exc()
+            slot_states[slot] = SLOT_ERROR
+
+    shared_memory.close()
+
+
+class OffloadedModifiers():
+    """
+    Frame modifier that runs a chain of heavy frame modifiers in a pool of worker processes.
+    Frames are handed over through shared memory slots instead of being pickled.
+    Results come back in order, and new frames are dropped while every slot is busy.
+    Workers start in the background, and frames are shown unprocessed until the first result comes back,
+    so that video ticks never wait on the workers (see scheduler.py).
+    If a worker dies (from a crash, or from running out of memory), or a frame takes longer than frame_timeout
+    (startup_timeout for the first one), the frames that were handed out are given up on and the workers are restarted,
+    no sooner than restart_interval after they last started, so modifiers that keep crashing don't keep spawning processes.
+    Offloaded modifiers must be picklable (defined at the top level of a module) and should only touch the frame.
+    """
+
+    def __init__(
+        self,
+        frame_modifiers: list[Callable],
+        workers: Optional[int] = None,
+        slots: Optional[int] = None,
+        startup_timeout: float = 30,
+        frame_timeout: float = 10,
+        restart_interval: float = 5
+    ):
+        self.frame_modifiers = list(frame_modifiers)
+        self.workers = workers or max((os.cpu_count() or 2) - 1, 1)
+        self.num_slots = slots or self.workers * 2
+        self.startup_timeout = startup_timeout
+        self.frame_timeout = frame_timeout
+        self.restart_interval = restart_interval
+
+        # Worker state. Workers are started on the first frame, once the frame size is known
+        self.context = multiprocessing.get_context("spawn")
+        self.starting: bool = False
+        self.processes = []
+        self.job_queue = None
+        self.shared_memory: Optional[SharedMemory] = None
+        self.frame_shape: Optional[tuple] = None
+        self.slot_states: Optional[np.ndarray] = None
+        self.slot_frames: Optional[np.ndarray] = None
+
+        # Frame tracking
+        self.free_slots: list[int] = []
+        self.pending_slots: deque[int] = deque()
+        # When each slot was handed out to the workers
+        self.slot_times: list[float] = []
+        self.last_output: Optional[np.ndarray] = None
+        self.frames_dropped: int = 0
+        self.started_at: float = 0.0
+
+        atexit.register(self.stop)
+
+    def __repr__(self):
+        names = ", ".join(getattr(modifier, "__name__", repr(modifier)) for modifier in self.frame_modifiers)
+        return f"<OffloadedModifiers [{names}] on {self.workers} workers>"
+
+    def start(self, frame_shape: tuple):
+        """
+        Sets up the shared memory slots and worker processes for the given frame size
+        """
+
+        logging.info(f"Starting {self.workers} Workers For {self}")
+        self.frame_shape = frame_shape
+        frame_size = int(np.prod(frame_shape))
+        self.shared_memory = SharedMemory(create=True, size=self.num_slots * 8 + self.num_slots * frame_size)
+        self.slot_states = np.ndarray((self.num_slots,), dtype=np.int64, buffer=self.shared_memory.buf)
+        self.slot_states[:] = SLOT_FREE
+        self.slot_frames = np.ndarray((self.num_slots, *frame_shape), dtype=np.uint8, buffer=self.shared_memory.buf, offset=self.num_slots * 8)
+        self.free_slots = list(range(self.num_slots))
+        self.slot_times = [0.0] * self.num_slots
+        self.pending_slots.clear()
+        self.last_output = None
+        self.started_at = time.time()
+
+        self.job_queue = self.context.Queue()
+        self.processes = [
+            self.context.Process(
+                target=offload_worker,
+                args=(self.shared_memory.name, self.num_slots, frame_shape, self.frame_modifiers, self.job_queue),
+                daemon=True)
+            for _ in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def start_in_background(self, frame_shape: tuple, delay: float = 0):
+        """
+        Restarts the workers for the given frame size without holding up the video. Frames pass through unprocessed meanwhile.
+        """
+
+        def restart():
+            try:
+                time.sleep(delay)
+                self.stop()
+                self.start(frame_shape)
+            except Exception as e:
+                logging.error(f"Error While Starting Workers For {self}! {e}")
+                traceback.print_exc()
+            finally:
+                self.starting = False
+
+        self.starting = True
+        self.frame_shape = frame_shape
+        Thread(target=restart, daemon=True).start()
+
+    def stop(self):
+        """
+        Stops the worker processes and frees the shared memory
+        """
+
+        for _ in self.processes:
+            self.job_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+        if self.shared_memory is not None:
+            self.slot_states = None
+            self.slot_frames = None
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
+
+    def check_workers(self):
+        """
+        Restarts the workers if any of them died or got stuck on a frame. Returns False if so.
+        """
+
+        dead = [process for process in self.processes if not process.is_alive()]
+        if dead:
+            exit_codes = ", ".join(str(process.exitcode) for process in dead)
+            logging.error(f"{len(dead)} Workers For {self} Died (Exit Codes {exit_codes})! Restarting Them.")
+        elif self.pending_slots:
+            # Frames finish in order, so a stuck worker shows up as the oldest frame never finishing
+            timeout = self.frame_timeout if self.last_output is not None else self.startup_timeout
+            waited = time.time() - max(self.slot_times[self.pending_slots[0]], self.started_at)
+            if waited <= timeout:
+                return True
+            logging.error(f"Workers For {self} Did Not Finish A Frame Within {timeout}s! Restarting Them.")
+        else:
+            return True
+
+        # Nobody is going to finish the frames that were handed out, so give up on them
+        for slot in self.pending_slots:
+            self.slot_states[slot] = SLOT_ERROR
+        self.collect()
+        self.start_in_background(self.frame_shape, delay=max(self.started_at + self.restart_interval - time.time(), 0))
+        return False
+
+    def collect(self):
+        """
+        Collects finished frames in submission order, keeping the newest one
+        """
+
+        newest_slot = None
+        while self.pending_slots and self.slot_states[self.pending_slots[0]] in (SLOT_DONE, SLOT_ERROR):
+            slot = self.pending_slots.popleft()
+            if self.slot_states[slot] == SLOT_DONE:
+                if newest_slot is not None:
+                    self.free_slots.append(newest_slot)
+                newest_slot = slot
+            else:
+                self.free_slots.append(slot)
+
+        # Only the newest finished frame needs to be copied out of its slot
+        if newest_slot is not None:
+            if self.last_output is None:
+                self.last_output = np.empty(self.frame_shape, dtype=np.uint8)
+            np.copyto(self.last_output, self.slot_frames[newest_slot])
+            self.free_slots.append(newest_slot)
+
+    def __call__(self, video):
+        frame = video._frame
+        if self.starting:
+            return
+        if frame.shape != self.frame_shape or self.shared_memory is None:
+            self.start_in_background(frame.shape)
+            return
+
+        # Pick up any frames the workers have finished
+        if not self.check_workers():
+            return
+        self.collect()
+
+        # Hand the new frame over to the workers, or drop it if they are all busy
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            np.copyto(self.slot_frames[slot], frame)
+            self.slot_states[slot] = SLOT_QUEUED
+            self.slot_times[slot] = time.time()
+            self.job_queue.put((slot, video.width, video.height, video.frame_controller.frames_rendered))
+            self.pending_slots.append(slot)
+        else:
+            self.frames_dropped += 1
+
+        # Show the newest processed frame. Until the workers are up, the frame is shown unprocessed.
+        if self.last_output is not None:
+            np.copyto(frame, self.last_output)
@@ -0,0 +1,454 @@
+#
+# Demand-driven versions of Wormhole's video copies.
+# Copies only pull and process frames while something downstream is consuming them.
+# File videos, custom videos and hard copies run their frame ticks on the shared frame scheduler (see scheduler.py)
+# instead of a thread each.
+# Every video here also takes its frames from the shared frame buffer pool, instead of allocating new ones,
+# and reports how long each of its stages take to the pipeline profiler.
+#
+
+from wormhole.video import AbstractVideo
+from wormhole.video import FileVideo as WormholeFileVideo
+from wormhole.video import CustomVideo as WormholeCustomVideo
+from wormhole.video import HardCopy as WormholeHardCopy
+from wormhole.utils import blank_frame_color, draw_text
+from bufferpool import checkout_frame
+from errorstate import ErrorState
+from profiler import profiler
+from scheduler import frame_scheduler, count_frame
+
+import cv2
+import logging
+import numpy as np
+import time
+import traceback
+from threading import Event, RLock, Thread
+from typing import Callable, Optional
+
+
+#
+# --- Demand Tracking ---
+#
+
+# Number of consumers (viewers or dependent videos) of each video
+demand_counts: dict[AbstractVideo, int] = {}
+# Videos that each video pulls frames from
+video_upstreams: dict[AbstractVideo, list[AbstractVideo]] = {}
+# Set while a video has at least one consumer
+demand_events: dict[AbstractVideo, Event] = {}
+# When the temporary demand on each video (see lease_demand) runs out
+demand_leases: dict[AbstractVideo, float] = {}
+# Called whenever a video gets its first consumer
+demand_listeners: dict[AbstractVideo, list[Callable[[], None]]] = {}
+demand_lock = RLock()
+
+
+def get_demand_event(video: AbstractVideo):
+    with demand_lock:
+        event = demand_events.get(video)
+        if event is None:
+            event = Event()
+            demand_events[video] = event
+        return event
+
+
+def acquire_demand(video: AbstractVideo):
+    """
+    Registers a consumer of the video. The first consumer wakes up the video and everything upstream of it.
+    """
+
+    with demand_lock:
+        demand_counts[video] = demand_counts.get(video, 0) + 1
+        if demand_counts[video] == 1:
+            get_demand_event(video).set()
+            for upstream in video_upstreams.get(video, []):
+                acquire_demand(upstream)
+            for listener in demand_listeners.get(video, []):
+                listener()
+
+
+def release_demand(video: AbstractVideo):
+    """
+    Removes a consumer of the video. Once the last consumer leaves, the video and everything upstream of it can idle.
+    """
+
+    with demand_lock:
+        if demand_counts.get(video, 0) <= 0:
+            return
+        demand_counts[video] -= 1
+        if demand_counts[video] == 0:
+            get_demand_event(video).clear()
+            for upstream in video_upstreams.get(video, []):
+                release_demand(upstream)
+
+
+def has_demand(video: AbstractVideo):
+    return demand_counts.get(video, 0) > 0
+
+
+def wait_for_demand(video: AbstractVideo, timeout: Optional[float] = None):
+    return get_demand_event(video).wait(timeout)
+
+
+def lease_demand(video: AbstractVideo, duration: float):
+    """
+    Keeps the video running for a while, for consumers that only grab a frame every now and then.
+    Leasing a video that is already leased pushes the end of the lease back.
+    """
+
+    with demand_lock:
+        expires = time.time() + duration
+        if video in demand_leases:
+            demand_leases[video] = max(demand_leases[video], expires)
+            return
+        demand_leases[video] = expires
+        acquire_demand(video)
+
+    def expire_lease():
+        while True:
+            with demand_lock:
+                remaining = demand_leases[video] - time.time()
+                if remaining <= 0:
+                    del demand_leases[video]
+                    release_demand(video)
+                    return
+            time.sleep(remaining)
+
+    Thread(target=expire_lease, daemon=True).start()
+
+
+def add_demand_listener(video: AbstractVideo, listener: Callable[[], None]):
+    """
+    Calls the listener every time the video goes from no consumers to having one
+    """
+
+    with demand_lock:
+        demand_listeners.setdefault(video, []).append(listener)
+
+
+def add_dependency(video: AbstractVideo, upstream: AbstractVideo):
+    """
+    Marks that the video pulls frames from the upstream video, so demand for the video is carried over to it
+    """
+
+    with demand_lock:
+        video_upstreams.setdefault(video, []).append(upstream)
+        if has_demand(video):
+            acquire_demand(upstream)
+
+
+def set_priority(video: AbstractVideo, priority: int):
+    """
+    Sets the scheduling priority of a video (see scheduler.py). Higher priorities get their frames first
+    when the server falls behind. Videos it pulls frames from are raised to at least the same priority,
+    as the video can't get its frames any sooner than they do.
+    """
+
+    frame_scheduler.set_priority(video, priority)
+    with demand_lock:
+        upstreams = list(video_upstreams.get(video, []))
+    for upstream in upstreams:
+        if frame_scheduler.get_priority(upstream) < priority:
+            set_priority(upstream, priority)
+
+
+#
+# --- Error Handling ---
+#
+
+
+class VideoErrorState():
+    """
+    Shared error handling for the videos below. Errors are logged through a rate limited ErrorState,
+    and the error frame is only redrawn when the error changes, so streamers don't need to encode it again.
+    Streamers check video.error_state to know when a video is failing.
+    """
+
+    error_state: Optional[ErrorState] = None
+    error_frame: Optional[np.ndarray] = None
+    error_frame_text: Optional[tuple[str, str]] = None
+
+    def handle_render_error(self, error, message="Error While Generating Next Frame!", wait: bool = True):
+        try:
+            # Record the error. Created here, as video threads can start before __init__ finishes
+            if self.error_state is None:
+                self.error_state = ErrorState(f"{type(self).__name__} {self.width}x{self.height}")
+            self.error_state.record(error, message)
+
+            # Render an error video frame, unless the same one is already up
+            if self.error_frame_text != (message, str(error)):
+                error_frame = blank_frame_color(self.width, self.height, (0, 0, 0))
+                error_frame = draw_text(error_frame, "ERROR!", (10, 60), font_color=(0, 0, 255), font_size=2, font_stroke=4)
+                error_frame = draw_text(error_frame, message, (10, 100))
+                error_frame = draw_text(error_frame, f"Error: {error}", (10, 130), font_size=0.5, font_stroke=1)
+                self.error_frame = error_frame
+                self.error_frame_text = (message, str(error))
+            self.finished_frame = self.error_frame
+
+            # Sleep one second so its not hotlooping like crazy.
+            # Scheduled videos return a delay to the scheduler instead, as sleeping would hold up every other video.
+            if wait:
+                time.sleep(1)
+
+            # Reset FPS statistics in case the video works again
+            self.frame_controller.reset_fps_stats()
+        except Exception as e:
+            print(f"Error while processing error frame!!!!! {e}")
+            print(f"Something is seriously wrong with this video object or this instance of Wormhole!")
+
+    def set_frame(self, frame: np.ndarray):
+        super().set_frame(frame)
+        # A frame made it through, so the video works again
+        if self.error_state is not None:
+            self.error_state.recover()
+
+
+#
+# --- Profiling ---
+#
+
+
+class ProfiledVideo():
+    """
+    Times each frame modifier of the videos below. Otherwise runs them exactly like Wormhole does.
+    """
+
+    def call_frame_modifiers(self):
+        for modifier in self.frame_modifiers:
+            start = time.perf_counter()
+            try:
+                modifier(self)
+            except Exception as error:
+                logging.error(f"Error While Running Frame Modifier {modifier}")
+                traceback.print_exc()
+
+                # Render error to video frame
+                draw_text(self._frame, "ERROR!", (10, 60), font_color=(0, 0, 255), font_size=2, font_stroke=4)
+                draw_text(self._frame, f"Error While Running Frame Modifier {modifier}!", (10, 100))
+                draw_text(self._frame, f"Error: {error}", (10, 130), font_size=0.5, font_stroke=1)
+            # Modifiers are functions or filter objects
+            modifier_name = getattr(modifier, "__name__", type(modifier).__name__)
+            profiler.record_video(self, f"modifier:{modifier_name}", time.perf_counter() - start)
+
+
+#
+# --- Video Sources ---
+#
+
+
+class FileVideo(ProfiledVideo, VideoErrorState, WormholeFileVideo):
+    """
+    Creates a video object from a video file. Frames are decoded straight into pooled buffers.
+    Frames are read on the frame scheduler (see scheduler.py), at max_fps.
+    """
+
+    def video_loop(self):
+        # Hand the video over to the frame scheduler. The thread Wormhole started for it ends here.
+        self.frame_task = frame_scheduler.add(self, self.render_frame, 1 / self.max_fps)
+
+    def read_frame(self):
+        frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        start = time.perf_counter()
+        ret, frame = self.cap.read(image=checkout_frame((frame_height, frame_width, self.pixel_size)))
+        profiler.record_video(self, "decode", time.perf_counter() - start)
+        return ret, frame
+
+    def render_frame(self):
+        try:
+            # Read Frame. Start over from the beginning once the video ends.
+            ret, frame = self.read_frame()
+            if not ret and self.repeat:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self.read_frame()
+            # Check if Frame is Valid
+            if not ret:
+                if self.repeat:
+                    raise ValueError(f"Could Not Read A Frame From {self.filename}!")
+                self.set_blank_frame()
+                return None
+
+            # If sizes does not match, resize frame
+            if frame.shape[1] != self.width or frame.shape[0] != self.height:
+                start = time.perf_counter()
+                frame = cv2.resize(frame, (self.width, self.height), dst=self.new_frame())
+                profiler.record_video(self, "resize", time.perf_counter() - start)
+
+            # Set Frame
+            self.set_frame(frame)
+            count_frame(self.frame_controller)
+        except Exception as e:
+            self.handle_render_error(e, message="Error While Rendering Video File!", wait=False)
+            return 1.0
+
+    def new_frame(self):
+        return checkout_frame((self.height, self.width, self.pixel_size))
+
+
+class CustomVideo(ProfiledVideo, VideoErrorState, WormholeCustomVideo):
+    """
+    Creates a video object from a custom video stream.
+    Frame generators can call video.new_frame() to draw into a pooled buffer instead of allocating their own.
+    frame_version goes up with every set_frame, so streamers notice frames that were redrawn in place.
+    Frames are generated on the frame scheduler (see scheduler.py), at max_fps.
+    Frame generators that wait on anything (like the network) have to be created with blocking, to run on a thread of their own.
+    """
+
+    def __init__(self, *args, blocking: bool = False, **kwargs):
+        self.frame_version: int = 0
+        self.blocking = blocking
+        super().__init__(*args, **kwargs)
+
+    def video_loop(self):
+        # Hand the video over to the frame scheduler. The thread Wormhole started for it ends here.
+        self.frame_task = frame_scheduler.add(self, self.render_frame, 1 / self.max_fps, blocking=self.blocking)
+
+    def render_frame(self):
+        try:
+            # The frame generator might've already set the frame using set_frame(),
+            # so only run set_frame again if the return type is of ndarray
+            frame = self.frame_generator(self)
+            if isinstance(frame, np.ndarray):
+                self.set_frame(frame)
+            count_frame(self.frame_controller)
+        except Exception as e:
+            self.handle_render_error(e, message="Frame Generator Encountered An Error!", wait=False)
+            return 1.0
+
+    def set_frame(self, frame: np.ndarray):
+        super().set_frame(frame)
+        self.frame_version += 1
+
+    def new_frame(self):
+        return checkout_frame((self.height, self.width, self.pixel_size))
+
+
+#
+# --- Video Copies ---
+#
+
+
+def copy_frame(frame: np.ndarray, new_frame: np.ndarray):
+    """
+    Copies a frame into another one. The frame is resized if sizes does not match,
+    and converted if one is grayscale (see filters.GrayscaleFilter) and the other is color.
+    """
+
+    height, width = new_frame.shape[:2]
+    channels = 1 if frame.ndim == 2 else frame.shape[2]
+    new_channels = 1 if new_frame.ndim == 2 else new_frame.shape[2]
+
+    if channels != new_channels:
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, (width, height))
+        cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR if channels == 1 else cv2.COLOR_BGR2GRAY, dst=new_frame)
+    elif frame.shape[1] != width or frame.shape[0] != height:
+        cv2.resize(frame, (width, height), dst=new_frame)
+    else:
+        np.copyto(new_frame, frame.reshape(new_frame.shape))
+    return new_frame
+
+
+class SoftCopy(ProfiledVideo, VideoErrorState, AbstractVideo):
+    """
+    Creates a soft copy of another video stream. Uses Frame Subscribers to achieve this effect.
+    With on_demand, new frames are skipped while nobody is consuming the copy.
+    With a width and height, the copy is a pre-scaled tap of the original, resized once per published frame.
+    """
+
+    def __init__(
+        self,
+        original: AbstractVideo,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        on_demand: bool = True,
+        **kwargs  # Any Additional Arguments for AbstractVideo
+    ):
+        # Initialize Video Object with the original parameters
+        super().__init__(width or original.width, height or original.height, original.max_fps, **kwargs)
+        self.original = original
+        self.on_demand = on_demand
+
+        # Link demand to the original video. Copies that are always on keep the original on too.
+        add_dependency(self, original)
+        if not self.on_demand:
+            acquire_demand(self)
+
+        # Create a subscriber for the other video stream
+        original.add_frame_subscriber(self.video_update_subscriber)
+
+    def video_update_subscriber(self, video: AbstractVideo):
+        # Skip the frame if nobody is watching
+        if self.on_demand and not has_demand(self):
+            return
+
+        # Copy the frame into a pooled buffer
+        start = time.perf_counter()
+        new_frame = copy_frame(video.get_frame(), self.new_frame())
+        profiler.record_video(self, "copy", time.perf_counter() - start)
+        self.set_frame(new_frame)
+        # Never sleeps, as this runs as part of the tick of the original
+        count_frame(self.frame_controller)
+
+    def new_frame(self):
+        return checkout_frame((self.height, self.width, self.pixel_size))
+
+
+class HardCopy(ProfiledVideo, VideoErrorState, WormholeHardCopy):
+    """
+    Creates a hard copy of another video stream, with its own size and frame rate.
+    Copies run on the frame scheduler (see scheduler.py), after every frame the original publishes,
+    but no more than max_fps times a second. With on_demand, the copy skips frames while nobody is consuming it.
+    """
+
+    def __init__(
+        self,
+        original: AbstractVideo,
+        width: int,
+        height: int,
+        max_fps: float = 30,
+        on_demand: bool = True,
+        **kwargs  # Any Additional Arguments for AbstractVideo
+    ):
+        # Set up demand before the parent starts the video thread
+        self.on_demand = on_demand
+        add_dependency(self, original)
+        if not self.on_demand:
+            acquire_demand(self)
+
+        # Initialize Hard Copy
+        super().__init__(original, width, height, max_fps=max_fps, **kwargs)
+
+    def video_loop(self):
+        # Hand the copy over to the frame scheduler. The thread Wormhole started for it ends here.
+        self.frame_task = frame_scheduler.add(self, self.render_frame, 1 / self.max_fps, triggered=True, wanted=self.is_wanted)
+        self.original.add_frame_subscriber(self.frame_task.trigger)
+
+        # Also copy whatever the original shows right away once someone starts watching,
+        # instead of waiting for its next frame (which may never come, if the original is failing)
+        add_demand_listener(self, self.on_demand_acquired)
+        self.frame_task.trigger()
+
+    def is_wanted(self):
+        return not self.on_demand or has_demand(self)
+
+    def on_demand_acquired(self):
+        self.frame_controller.reset_fps_stats()
+        self.frame_task.trigger()
+
+    def render_frame(self):
+        try:
+            # Copy the new video data into a pooled buffer
+            start = time.perf_counter()
+            new_frame = copy_frame(self.original.get_frame(), self.new_frame())
+            profiler.record_video(self, "copy", time.perf_counter() - start)
+
+            # Set Frame Size
+            self.set_frame(new_frame)
+            count_frame(self.frame_controller)
+        except Exception as e:
+            self.handle_render_error(e, message="Error While Reading Video Copy!", wait=False)
+            return 1.0
+
+    def new_frame(self):
+        return checkout_frame((self.height, self.width, self.pixel_size))
@@ -0,0 +1,221 @@
+#
+# Per-stage timings of the video pipeline, for finding out where the frame budget goes.
+# Videos time decoding, copying and each of their frame modifiers, and streamers time encoding and sending frames.
+# Everything is exposed in the Prometheus text format by generate_metrics (see /metrics in main.py).
+#
+
+import numpy as np
+from collections import deque
+from threading import Lock
+from typing import Any
+
+# Quantiles reported for every stage
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageTimer():
+    """
+    Timings of a single pipeline stage, reported like a Prometheus summary.
+    Quantiles are taken over the most recent samples, while the count and sum cover every sample.
+    """
+
+    def __init__(self, max_samples: int = 1024):
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.count: int = 0
+        self.total: float = 0.0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def get_quantiles(self, quantiles: tuple[float, ...] = QUANTILES):
+        # Copy the samples first, as the pipeline keeps adding to them
+        samples = list(self.samples)
+        if not samples:
+            return [0.0] * len(quantiles)
+        return list(np.quantile(samples, quantiles))
+
+    def __repr__(self):
+        p50, p95, p99 = self.get_quantiles()
+        return f"<StageTimer count={self.count} p50={p50 * 1000:.2f}ms p95={p95 * 1000:.2f}ms p99={p99 * 1000:.2f}ms>"
+
+
+def format_labels(**labels: Any):
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f"{key}=\"{value}\"" for key, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    return f"{value:.9g}"
+
+
+class PipelineProfiler():
+    """
+    Collects stage timings per video (keyed by the video object) and per stream (keyed by its route).
+    Videos are named after the first stream or file they are registered with, or after their type otherwise.
+    """
+
+    def __init__(self, max_samples: int = 1024):
+        self.max_samples = max_samples
+        self.enabled: bool = True
+        self.lock = Lock()
+
+        self.video_timers: dict[Any, dict[str, StageTimer]] = {}
+        self.stream_timers: dict[str, dict[str, StageTimer]] = {}
+        self.video_names: dict[Any, str] = {}
+
+    def get_timer(self, timers: dict, key: Any, stage: str):
+        stages = timers.get(key)
+        if stages is None or stage not in stages:
+            with self.lock:
+                stages = timers.setdefault(key, {})
+                stages.setdefault(stage, StageTimer(self.max_samples))
+        return stages[stage]
+
+    def record_video(self, video, stage: str, seconds: float):
+        if self.enabled:
+            self.get_timer(self.video_timers, video, stage).add(seconds)
+
+    def record_stream(self, stream: str, stage: str, seconds: float):
+        if self.enabled:
+            self.get_timer(self.stream_timers, stream, stage).add(seconds)
+
+    def name_video(self, video, name: str):
+        """
+        Names the video in the metrics, unless it already has a name
+        """
+
+        with self.lock:
+            self.video_names.setdefault(video, name)
+
+    def get_video_name(self, video):
+        with self.lock:
+            name = self.video_names.get(video)
+            if name is None:
+                name = f"{type(video).__name__}-{len(self.video_names)}"
+                self.video_names[video] = name
+            return name
+
+    def generate_metrics(self, server):
+        """
+        Renders every stage timing, along with per stream client counts and dropped frames, in the Prometheus text format
+        """
+
+        # Imported here, as the pipeline itself reports to the profiler
+        from pipeline import demand_counts, video_upstreams
+        from scheduler import frame_scheduler
+        from startup import startup_timer
+
+        lines = []
+
+        def add_family(name: str, metric_type: str, help_text: str, samples: list[tuple[str, dict, float]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{format_labels(**labels)} {format_value(value)}")
+
+        def summarize(timers: dict, label: str, get_name):
+            samples = []
+            for key, stages in list(timers.items()):
+                for stage, timer in list(stages.items()):
+                    labels = {label: get_name(key), "stage": stage}
+                    for quantile, value in zip(QUANTILES, timer.get_quantiles()):
+                        samples.append(("", {**labels, "quantile": quantile}, value))
+                    samples.append(("_sum", labels, timer.total))
+                    samples.append(("_count", labels, timer.count))
+            return samples
+
+        # Stage Timings
+        add_family(
+            "wormhole_video_stage_seconds", "summary",
+            "Time spent in each stage of a video (decode, resize, copy, and modifier:<name> for each frame modifier)",
+            summarize(self.video_timers, "video", self.get_video_name))
+        add_family(
+            "wormhole_stream_stage_seconds", "summary",
+            "Time spent in each stage of a stream (resize and encode per frame, write per frame sent to a client)",
+            summarize(self.stream_timers, "stream", lambda stream: stream))
+
+        # Which videos make up each stream, from the streamed video back to its sources
+        stream_videos, clients, dropped, renditions = [], [], [], []
+        for route, streamer in list(server.routes.items()):
+            seen, pending = [], [(streamer.video, 0)]
+            while pending:
+                video, depth = pending.pop(0)
+                if video not in seen:
+                    seen.append(video)
+                    stream_videos.append(("", {"stream": route, "video": self.get_video_name(video), "depth": depth}, 1))
+                    pending.extend((upstream, depth + 1) for upstream in video_upstreams.get(video, []))
+
+            # Stream Statistics. Not every streamer keeps track of these.
+            if hasattr(streamer, "clients"):
+                clients.append(("", {"stream": route}, streamer.clients))
+            if hasattr(streamer, "frames_skipped"):
+                dropped.append(("", {"stream": route}, streamer.frames_skipped))
+            if hasattr(streamer, "renditions"):
+                renditions.append(("", {"stream": route}, len(streamer.renditions.encoders)))
+
+        add_family("wormhole_stream_video_info", "gauge", "Videos feeding each stream. Depth 0 is the streamed video itself", stream_videos)
+        add_family("wormhole_stream_clients", "gauge", "Clients currently connected to each stream", clients)
+        # Counter families are named with their _total suffix, as the text format wants samples named like their family
+        add_family("wormhole_stream_frames_dropped_total", "counter", "Encoded frames that clients were too slow to receive", dropped)
+        add_family("wormhole_stream_renditions", "gauge", "Renditions currently being encoded for each stream", renditions)
+
+        # Video Statistics
+        frames, fps, consumers, modifier_dropped = [], [], [], []
+        for video in list(self.video_timers):
+            labels = {"video": self.get_video_name(video)}
+            frame_controller = getattr(video, "frame_controller", None)
+            if frame_controller is not None:
+                frames.append(("", labels, frame_controller.frames_rendered))
+                fps.append(("", labels, frame_controller.fps_window))
+            consumers.append(("", labels, demand_counts.get(video, 0)))
+
+            # Modifiers that drop frames when they fall behind (like offload.OffloadedModifiers) count them
+            for modifier in getattr(video, "frame_modifiers", []):
+                if hasattr(modifier, "frames_dropped"):
+                    modifier_name = getattr(modifier, "__name__", type(modifier).__name__)
+                    modifier_dropped.append(("", {**labels, "modifier": modifier_name}, modifier.frames_dropped))
+
+        add_family("wormhole_video_frames_rendered", "gauge", "Frames rendered since the video last (re)started", frames)
+        add_family("wormhole_video_fps", "gauge", "Frame rate over the last few seconds", fps)
+        add_family("wormhole_video_consumers", "gauge", "Viewers and dependent videos currently pulling frames from each video", consumers)
+        add_family("wormhole_modifier_frames_dropped_total", "counter", "Frames that a frame modifier dropped because it was falling behind", modifier_dropped)
+
+        # Scheduler Statistics
+        lateness, ticks, missed, priorities = [], [], [], []
+        for task in list(frame_scheduler.tasks):
+            labels = {"video": self.get_video_name(task.key)}
+            for quantile, value in zip(QUANTILES, task.lateness.get_quantiles()):
+                lateness.append(("", {**labels, "quantile": quantile}, value))
+            lateness.append(("_sum", labels, task.lateness.total))
+            lateness.append(("_count", labels, task.lateness.count))
+            ticks.append(("", labels, task.ticks))
+            missed.append(("", labels, task.ticks_missed))
+            priorities.append(("", labels, task.priority))
+
+        add_family("wormhole_scheduler_lateness_seconds", "summary", "How late each frame tick ran after its deadline", lateness)
+        add_family("wormhole_scheduler_ticks_total", "counter", "Frame ticks run by the frame scheduler", ticks)
+        add_family("wormhole_scheduler_ticks_missed_total", "counter", "Frame ticks skipped because a video fell more than a frame behind", missed)
+        add_family("wormhole_scheduler_priority", "gauge", "Scheduling priority of each video (higher runs first)", priorities)
+
+        # Startup Timings
+        add_family(
+            "wormhole_startup_seconds", "gauge",
+            "Seconds from process start until each startup phase was reached (see startup.py)",
+            [("", {"phase": phase}, seconds) for phase, seconds in list(startup_timer.phases.items())])
+        add_family(
+            "wormhole_stream_build_seconds", "gauge",
+            "Time spent building the video pipeline of each stream",
+            [("", {"stream": route}, seconds) for route, seconds in list(startup_timer.builds.items())])
+
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return f"<PipelineProfiler {len(self.video_timers)} videos {len(self.stream_timers)} streams>"
+
+
+# Profiler shared by every video and stream in the process
+profiler = PipelineProfiler()
@@ -0,0 +1,344 @@
+#
+# Relaying of Motion JPEG streams from other servers (or other Wormhole instances).
+# Parts are read from the upstream stream and sent on to local viewers byte for byte, without decoding or re-encoding them.
+# Frames are only decoded once something local actually needs pixels: frame modifiers, copies, or resized renditions.
+#
+
+from wormhole.video import AbstractVideo
+from pipeline import (
+    ProfiledVideo,
+    VideoErrorState,
+    copy_frame,
+    demand_lock,
+    has_demand,
+    video_upstreams,
+    wait_for_demand)
+from turbofix import SharedJPEGEncoder, TurboMJPEGStreamer, get_encoder_pool
+from asyncstreamer import AsyncTurboMJPEGStreamer
+from bufferpool import checkout_frame
+from errorstate import ErrorState
+from profiler import profiler
+from scheduler import FrameSignal, count_frame
+
+import cv2
+import numpy as np
+import time
+from threading import Lock, Thread
+from typing import Optional
+from urllib.request import Request, urlopen
+
+# Reduced decode modes, by how much they shrink the image
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+)
+
+
+def read_parts(stream, boundary: str, read_size: int = 64 * 1024, max_part_size: int = 16 * 1024 * 1024):
+    """
+    Splits a multipart stream into the bodies of its parts.
+    Parts with a Content-Length header are cut at that length, and everything else runs up to the next boundary.
+    Stops once the stream ends.
+    """
+
+    delimiter = b"--" + boundary.encode("latin-1")
+    buffer = bytearray()
+    # Where to continue looking for the end of the current part, so data is only scanned once
+    search_from = 0
+
+    while True:
+        # Skip anything before the boundary, but keep enough to catch a boundary split over two reads
+        start = buffer.find(delimiter)
+        if start == -1:
+            del buffer[:max(len(buffer) - len(delimiter), 0)]
+        elif start > 0:
+            del buffer[:start]
+            search_from = 0
+            start = 0
+
+        # Read the part headers, then the part itself
+        header_end = buffer.find(b"\r\n\r\n") if start == 0 else -1
+        if header_end != -1:
+            headers = {}
+            for line in bytes(buffer[len(delimiter):header_end]).decode("latin-1").split("\r\n"):
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body_start = header_end + 4
+
+            if "content-length" in headers:
+                body_end = body_start + int(headers["content-length"])
+                next_part = body_end if len(buffer) >= body_end else -1
+            else:
+                body_end = buffer.find(b"\r\n" + delimiter, max(body_start, search_from))
+                next_part = body_end + 2 if body_end != -1 else -1
+                search_from = max(body_start, len(buffer) - len(delimiter) - 2)
+
+            if next_part != -1:
+                with memoryview(buffer) as view:
+                    body = bytes(view[body_start:body_end])
+                del buffer[:next_part]
+                search_from = 0
+                yield body
+                continue
+
+        # Sanity Check
+        if len(buffer) > max_part_size:
+            raise ValueError(f"Multipart Part Larger Than {max_part_size} Bytes! Is The Upstream Really A Motion JPEG Stream?")
+
+        # Need more data
+        data = stream.read1(read_size)
+        if not data:
+            return
+        buffer += data
+
+
+def decode_jpeg(jpeg: bytes, flags: int = cv2.IMREAD_COLOR):
+    """
+    Decodes a JPEG to a BGR frame. Runs on the encoder pool.
+    """
+
+    start = time.perf_counter()
+    frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flags)
+    return frame, time.perf_counter() - start
+
+
+#
+# --- Relay Video ---
+#
+
+
+class RelayVideo(ProfiledVideo, VideoErrorState, AbstractVideo):
+    """
+    Video that relays a Motion JPEG stream from an upstream URL.
+    The latest JPEG is kept as is in latest_jpeg, for streamers to pass on without re-encoding it (see PassthroughEncoder).
+    Frames are decoded to the video size as they arrive only while the video has frame modifiers, or frame subscribers
+    (such as soft copies) that are being watched. Otherwise, they are decoded lazily, the first time get_frame asks for them.
+    With on_demand, the upstream is only connected to while something is consuming the video,
+    and disconnected idle_timeout seconds after the last consumer leaves.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        width: int,
+        height: int,
+        max_fps: float = 30,
+        on_demand: bool = True,
+        idle_timeout: float = 5.0,
+        timeout: float = 10.0,
+        read_size: int = 64 * 1024,
+        **kwargs  # Any Additional Arguments for AbstractVideo
+    ):
+        super().__init__(width, height, max_fps, **kwargs)
+        self.url = url
+        self.on_demand = on_demand
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.read_size = read_size
+        # Created here instead of on the first error, as relays record decode errors outside of the relay thread too
+        self.error_state = ErrorState(f"RelayVideo {url}")
+
+        # Latest JPEG from the upstream, stored as a (sequence, jpeg) tuple so that it can be read without locking.
+        # The sequence number goes up by one with every part received.
+        self.latest_jpeg: tuple[int, bytes] = (0, b"")
+        # Sequence number of the JPEG that finished_frame was decoded from
+        self.decoded_sequence: int = 0
+        # Size of the upstream frames, for picking a reduced decode mode
+        self.upstream_size: Optional[tuple[int, int]] = None
+        self.decode_lock = Lock()
+        # Streams wait on this for new parts, as parts that are passed through never go through set_frame
+        self.frame_signal = FrameSignal()
+
+        # The upstream sets the pace, so relays keep their own thread instead of running on the frame scheduler
+        Thread(target=self.relay_loop, daemon=True).start()
+
+    def relay_loop(self):
+        while True:
+            # Sleep until someone starts watching
+            if self.on_demand and not has_demand(self):
+                wait_for_demand(self)
+                self.frame_controller.reset_fps_stats()
+
+            try:
+                with urlopen(Request(self.url, headers={"Accept": "multipart/x-mixed-replace"}), timeout=self.timeout) as response:
+                    boundary = response.headers.get_param("boundary")
+                    if not boundary:
+                        raise ValueError(f"Upstream Is Not A Multipart Stream! (Content-Type: {response.headers.get('Content-Type')})")
+
+                    idle_since = None
+                    for jpeg in read_parts(response, boundary, read_size=self.read_size):
+                        self.publish_jpeg(jpeg)
+
+                        # Hang up once nobody has been watching for a while
+                        if self.on_demand and not has_demand(self):
+                            idle_since = idle_since or time.time()
+                            if time.time() - idle_since >= self.idle_timeout:
+                                break
+                        else:
+                            idle_since = None
+                    else:
+                        raise ConnectionError("Upstream Closed The Stream!")
+            except Exception as e:
+                self.handle_render_error(e, message="Error While Relaying Video!")
+
+    def publish_jpeg(self, jpeg: bytes):
+        """
+        Publishes a JPEG received from the upstream, decoding it right away only if anything needs the decoded frame
+        """
+
+        self.latest_jpeg = (self.latest_jpeg[0] + 1, jpeg)
+
+        # Update FPS statistics. The upstream sets the pace, so there is no need to sleep.
+        count_frame(self.frame_controller)
+
+        if self.needs_decoding():
+            with self.decode_lock:
+                sequence, jpeg = self.latest_jpeg
+                frame = self.decode(jpeg)
+                self.decoded_sequence = sequence
+            # Outside of the lock, as subscribers call get_frame
+            self.set_frame(frame)
+        else:
+            # Nothing got decoded, but the upstream works again
+            self.error_state.recover()
+        self.frame_signal.notify()
+
+    def needs_decoding(self):
+        """
+        Whether frames have to be decoded as they arrive.
+        Subscribers of videos that are registered as dependents (see pipeline.add_dependency) only need frames while those are consumed.
+        """
+
+        if self.frame_modifiers:
+            return True
+        if not self.frame_subscribers:
+            return False
+        with demand_lock:
+            dependents = [video for video, upstreams in video_upstreams.items() if self in upstreams]
+            return not dependents or any(has_demand(video) for video in dependents)
+
+    def decode(self, jpeg: bytes):
+        """
+        Decodes a JPEG to a frame of the video size.
+        JPEGs at least twice the size of the video are decoded at a reduced size, which skips most of the decoding work.
+        Decodes run on the shared encoder pool, so they don't hold up the server while they run.
+        """
+
+        flags = cv2.IMREAD_COLOR
+        if self.upstream_size is not None:
+            upstream_width, upstream_height = self.upstream_size
+            for factor, reduced_flags in REDUCED_DECODE_FLAGS:
+                if upstream_width // factor >= self.width and upstream_height // factor >= self.height:
+                    flags = reduced_flags
+                    break
+
+        frame, decode_time = get_encoder_pool().run(decode_jpeg, jpeg, flags)
+        profiler.record_video(self, "decode", decode_time)
+        if frame is None:
+            raise ValueError(f"Could Not Decode JPEG From Upstream! ({len(jpeg)} Bytes)")
+        if flags == cv2.IMREAD_COLOR:
+            self.upstream_size = (frame.shape[1], frame.shape[0])
+
+        # If sizes does not match, resize frame
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            start = time.perf_counter()
+            frame = copy_frame(frame, self.new_frame())
+            profiler.record_video(self, "resize", time.perf_counter() - start)
+        return frame
+
+    def get_frame(self):
+        # While failing, the error frame is shown. Frames that get modified are always decoded as they arrive.
+        if self.error_state.failing or self.frame_modifiers:
+            return self.finished_frame
+
+        # Decode the latest JPEG if nobody did yet
+        sequence = self.latest_jpeg[0]
+        if sequence != self.decoded_sequence:
+            with self.decode_lock:
+                sequence, jpeg = self.latest_jpeg
+                if sequence != self.decoded_sequence:
+                    # Each JPEG is only tried once, even if decoding it fails
+                    self.decoded_sequence = sequence
+                    try:
+                        self.finished_frame = self.decode(jpeg)
+                    except Exception as e:
+                        self.error_state.record(e, "Error While Decoding Relayed Frame!")
+        return self.finished_frame
+
+    def new_frame(self):
+        return checkout_frame((self.height, self.width, self.pixel_size))
+
+    def __repr__(self):
+        return f"<RelayVideo {self.url} {self.width}x{self.height} frame {self.latest_jpeg[0]}>"
+
+
+#
+# --- Relay Streamers ---
+#
+
+
+class PassthroughEncoder(SharedJPEGEncoder):
+    """
+    Stands in for the shared encoder of a relayed stream, wrapping the upstream JPEGs into parts as they are.
+    Falls back to encoding like usual while the relay video has frame modifiers (its frames are then different
+    from the upstream ones), and to the placeholder while the upstream is unavailable.
+    """
+
+    def __init__(self, video: RelayVideo, *args, **kwargs):
+        super().__init__(video, *args, **kwargs)
+        # Sequence number of the upstream JPEG that the latest part was built from
+        self.relay_sequence: int = 0
+
+    def get_part(self):
+        # Frames are modified locally, or the upstream is failing
+        if self.video.frame_modifiers or self.video.error_state.failing:
+            self.relay_sequence = 0
+            return super().get_part()
+
+        # Fast path. Part was already built by another client
+        relay_sequence, jpeg = self.video.latest_jpeg
+        if relay_sequence == self.relay_sequence or not relay_sequence:
+            return self.latest
+
+        with self.lock:
+            if relay_sequence != self.relay_sequence:
+                self.latest = (self.latest[0] + 1, self.part_header + jpeg + b"\r\n")
+                self.latest_jpeg = (self.latest[0], jpeg)
+                self.relay_sequence = relay_sequence
+                # Make sure the frame gets encoded if the stream ever falls back to encoding
+                self.source_frame = None
+                self.error_state.recover()
+            return self.latest
+
+
+class RelayStreamer(TurboMJPEGStreamer):
+    """
+    Motion JPEG streamer for a RelayVideo. The full size stream is passed through from the upstream as is.
+    Everything else works like TurboMJPEGStreamer: other renditions (width and quality) are decoded and encoded locally,
+    and the fps parameter and snapshots work the same.
+    """
+
+    default_encoder_type = PassthroughEncoder
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Sanity Check
+        if not isinstance(self.video, RelayVideo):
+            raise TypeError(f"RelayStreamer Can Only Stream A RelayVideo! (Got {type(self.video).__name__})")
+
+
+class AsyncRelayStreamer(AsyncTurboMJPEGStreamer):
+    """
+    RelayStreamer for the AsyncController
+    """
+
+    default_encoder_type = PassthroughEncoder
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Sanity Check
+        if not isinstance(self.video, RelayVideo):
+            raise TypeError(f"AsyncRelayStreamer Can Only Stream A RelayVideo! (Got {type(self.video).__name__})")
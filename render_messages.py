@@ -3,6 +3,91 @@ import numpy as np
 
 from wormhole.utils import blend_frames, draw_multiline_text
 
+
+class InfoPanel():
+    """
+    Pre-rasterized message panel. Holds the darkened box and the text alpha layer for one resolution and text.
+    """
+
+    def __init__(self, width: int, height: int, box: tuple[int, int, int, int, int], text: list[str]):
+        box_x, box_y, box_width, box_height, box_margin = box
+
+        # Rasterize the text once onto a blank layer the size of the frame.
+        # As the text is white, the rendered value of each pixel doubles as its alpha.
+        text_alpha = np.zeros((height, width), dtype=np.uint8)
+        draw_multiline_text(text_alpha, width, height, (box_x, box_y), text)
+
+        # Find the dark box, clipped to the frame
+        # (cv2.rectangle includes both corners, hence the +1)
+        box_x0, box_y0 = max(box_x - box_margin, 0), max(box_y - box_margin, 0)
+        box_x1, box_y1 = min(box_x + box_width + box_margin + 1, width), min(box_y + box_height + box_margin + 1, height)
+
+        # The region of interest covers both the box and any text that spills out of it
+        text_ys, text_xs = np.nonzero(text_alpha)
+        if len(text_xs):
+            self.x0, self.y0 = min(box_x0, int(text_xs.min())), min(box_y0, int(text_ys.min()))
+            self.x1, self.y1 = max(box_x1, int(text_xs.max()) + 1), max(box_y1, int(text_ys.max()) + 1)
+        else:
+            self.x0, self.y0, self.x1, self.y1 = box_x0, box_y0, box_x1, box_y1
+
+        # Box and text alpha, relative to the region of interest
+        self.box = (box_x0 - self.x0, box_y0 - self.y0, box_x1 - self.x0, box_y1 - self.y0)
+        self.text_alpha = text_alpha[self.y0:self.y1, self.x0:self.x1].copy()
+        self.has_text = len(text_xs) > 0
+
+        # Layers that depend on the channel count of the frame. Created the first time they are needed
+        self.layers = {}
+
+    def get_layers(self, roi: np.ndarray):
+        """
+        Returns the black box layer, the text alpha layer, and a scratch buffer matching the frame's channels
+        """
+
+        layers = self.layers.get(roi.shape)
+        if layers is None:
+            box_x0, box_y0, box_x1, box_y1 = self.box
+            dark_layer = np.zeros((box_y1 - box_y0, box_x1 - box_x0, *roi.shape[2:]), dtype=np.uint8)
+            text_alpha = self.text_alpha if roi.ndim == 2 else cv2.merge([self.text_alpha] * roi.shape[2])
+            scratch = np.empty(roi.shape, dtype=np.uint8)
+            layers = (dark_layer, text_alpha, scratch)
+            self.layers[roi.shape] = layers
+        return layers
+
+    def render(self, frame: np.ndarray):
+        """
+        Composites the panel onto the frame, only touching the panel region
+        """
+
+        roi = frame[self.y0:self.y1, self.x0:self.x1]
+        dark_layer, text_alpha, scratch = self.get_layers(roi)
+
+        # Darken the box
+        box_x0, box_y0, box_x1, box_y1 = self.box
+        blend_frames(roi[box_y0:box_y1, box_x0:box_x1], dark_layer)
+
+        # Blend in the white text: roi += (255 - roi) * alpha
+        if self.has_text:
+            cv2.bitwise_not(roi, dst=scratch)
+            cv2.multiply(scratch, text_alpha, dst=scratch, scale=1 / 255)
+            cv2.add(roi, scratch, dst=roi)
+
+
+# Cache of rasterized panels, keyed by resolution, box, and text
+info_panel_cache: dict[tuple, InfoPanel] = {}
+
+def render_info_panel(video, box: tuple[int, int, int, int, int], text: list[str]):
+    """
+    Renders a dark box with text on top of the video. The box is given as (x, y, width, height, margin).
+    The panel is rasterized the first time it is seen and cached for every frame after that.
+    """
+
+    key = (video.width, video.height, box, tuple(text))
+    panel = info_panel_cache.get(key)
+    if panel is None:
+        panel = InfoPanel(video.width, video.height, box, text)
+        info_panel_cache[key] = panel
+    panel.render(video._frame)
+
 def render_welcome_message(video):
     """
     Renders welcome message on the video.
@@ -15,18 +100,8 @@ def render_welcome_message(video):
     BOX_X_OFFSET = video.width-640
     BOX_Y_OFFSET = 24
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "========================================",
         "> Welcome to the Wormhole Realtime Video Streaming Demo! <",
         "========================================",
@@ -50,9 +125,9 @@ def render_welcome_message(video):
         " | Grayscale (Simple Postprocessing) Demo: [ /grayscale ]",
         " | Inverted (Simple Postprocessing) Demo: [ /inverted ]",
         " | Live Video Overlaying Demo: [ /overlay ]",
-        " | Advanced Video Postprocessing Demo: (WIP)",
+        " | Advanced Video Postprocessing Demo: [ /postprocessing ]",
         " | Webcam Demo: (WIP)",
-        " | Video Proxying & Rebroadcasting Demo: (WIP)",
+        " | Video Proxying & Rebroadcasting Demo: [ /proxy ] or [ /rebroadcast ]",
         " | Custom Renderer Demo: (WIP)",
         " | Error Handling Demo: [ /error ]",
         " | Static Webpage Demo: [ /static ]",
@@ -82,18 +157,8 @@ def render_low_res_message(video):
     BOX_X_OFFSET = 360
     BOX_Y_OFFSET = 10
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "================",
         "Low Resolution Video Demo",
         "================",
@@ -127,18 +192,8 @@ def render_grayscale_message(video):
     BOX_X_OFFSET = video.width-640
     BOX_Y_OFFSET = 24
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "========================================",
         "> Wormhole Grayscale Video Demo <",
         "========================================",
@@ -175,18 +230,8 @@ def render_inverted_message(video):
     BOX_X_OFFSET = video.width-640
     BOX_Y_OFFSET = 24
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "========================================",
         "> Wormhole Inverted Video Demo <",
         "========================================",
@@ -216,18 +261,8 @@ def render_advanced_message(video):
     BOX_X_OFFSET = video.width-490
     BOX_Y_OFFSET = 12
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "==================================",
         "> Wormhole Advanced Video Postprocessing Demo <",
         "==================================",
@@ -262,18 +297,8 @@ def render_overlay_message(video):
     BOX_X_OFFSET = video.width-640
     BOX_Y_OFFSET = 24
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "========================================",
         "> Wormhole Real-time Video Overlay Demo <",
         "========================================",
@@ -314,7 +339,39 @@ def render_proxy_message(video):
     """
     Renders description for the proxied video feed.
     """
-    pass
+    
+    # Constants
+    BOX_MARGIN = 10
+    BOX_WIDTH = 540
+    BOX_HEIGHT = 440
+    BOX_X_OFFSET = video.width-640
+    BOX_Y_OFFSET = 24
+
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
+        "========================================",
+        "> Wormhole Video Proxying Demo <",
+        "========================================",
+        "",
+        "This video does not come from a file! Wormhole is",
+        "relaying it from another video stream over HTTP,",
+        "which could be on any other server on the internet.",
+        "",
+        "Relayed frames are only decoded when they need to be,",
+        "such as to draw this message on top of them.",
+        "Go to [ /rebroadcast ] to see the relayed stream as is.",
+        "There, every frame is sent on to viewers exactly as",
+        "it was received, without decoding or re-encoding it.",
+        "",
+        "Go to [ / ] to check out other examples!",
+        "",
+        "========================================",
+        "[Video Attribution]",
+        "Spring by Andy Goralczyk / Blender Foundation",
+        "CC BY 4.0 <https://creativecommons.org/licenses/by/4.0>",
+        "via Wikimedia Commons",
+        "========================================"
+    ])
     
 def render_custom_message(video):
     """
@@ -328,18 +385,8 @@ def render_custom_message(video):
     BOX_X_OFFSET = video.width-640
     BOX_Y_OFFSET = 24
 
-    # Render a dark box around the message
-    dark_rectangle = np.copy(video._frame)
-    cv2.rectangle(
-        dark_rectangle, 
-        (BOX_X_OFFSET-BOX_MARGIN, BOX_Y_OFFSET-BOX_MARGIN),
-        (BOX_X_OFFSET+BOX_WIDTH+BOX_MARGIN, BOX_Y_OFFSET+BOX_HEIGHT+BOX_MARGIN),
-        (0,0,0), -1)
-    blend_frames(video._frame, dark_rectangle)
-    
-    # Render The Text
-    from wormhole.version import __version__
-    draw_multiline_text(video._frame, video.width, video.height, (BOX_X_OFFSET, BOX_Y_OFFSET), [
+    # Render the message panel
+    render_info_panel(video, (BOX_X_OFFSET, BOX_Y_OFFSET, BOX_WIDTH, BOX_HEIGHT, BOX_MARGIN), [
         "========================================",
         "> Wormhole Custom Video Demo <",
         "========================================",
@@ -0,0 +1,320 @@
+#
+# Central frame scheduler.
+# Instead of every video running its own thread with its own frame controller sleep loop, videos hand their frame ticks
+# to a single scheduler loop. Ticks run in order of their deadlines, with more important videos first whenever several
+# are due at once. Copies are triggered by the frames their source publishes, so they line up with the source
+# instead of drifting against it on a timer of their own, and only do work when there is a new frame to copy.
+# Streams wait on the frame signal of their video the same way, instead of polling it at their frame rate.
+#
+
+from profiler import StageTimer
+
+import heapq
+import itertools
+import logging
+import time
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Callable, Optional
+
+
+def count_frame(frame_controller):
+    """
+    Updates the frame rate statistics of a frame controller without sleeping, for videos that something else paces
+    """
+
+    now = time.time()
+    frame_controller.frame_time = now - frame_controller.last_frame
+    frame_controller.last_frame = now
+    frame_controller.update_fps()
+
+
+#
+# --- Frame Signals ---
+#
+
+
+class FrameSignal():
+    """
+    Fires every time a video publishes a frame. Waiters pass in the frame count they last saw,
+    so frames published in between are never missed.
+    """
+
+    def __init__(self):
+        self.count: int = 0
+        self.condition = Condition()
+        self.callbacks: list[Callable[[], None]] = []
+
+    def notify(self, video=None):
+        # Takes the video, so it can be used as a frame subscriber
+        with self.condition:
+            self.count += 1
+            self.condition.notify_all()
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback()
+
+    def wait(self, frames_seen: int, timeout: Optional[float] = None):
+        """
+        Waits until a frame newer than frames_seen is published, or the timeout runs out. Returns the frame count.
+        """
+
+        with self.condition:
+            if self.count == frames_seen:
+                self.condition.wait(timeout)
+            return self.count
+
+    async def wait_async(self, frames_seen: int, timeout: Optional[float] = None):
+        """
+        Same as wait, for coroutines. Frames can be published from any thread.
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self.condition:
+            if self.count != frames_seen:
+                return self.count
+            self.callbacks.append(wake)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self.callbacks.remove(wake)
+        return self.count
+
+    def __repr__(self):
+        return f"<FrameSignal frame {self.count}, {len(self.callbacks)} async waiters>"
+
+
+# Frame signals of videos that publish frames through set_frame, created on first use
+frame_signals: dict[Any, FrameSignal] = {}
+frame_signals_lock = Lock()
+
+
+def get_frame_signal(video):
+    """
+    Returns the signal that fires whenever the video publishes a frame.
+    Videos that publish frames without set_frame (like relays passing JPEGs through) bring their own frame_signal.
+    """
+
+    signal = getattr(video, "frame_signal", None)
+    if signal is not None:
+        return signal
+    with frame_signals_lock:
+        signal = frame_signals.get(video)
+        if signal is None:
+            signal = frame_signals[video] = FrameSignal()
+            video.add_frame_subscriber(signal.notify)
+        return signal
+
+
+#
+# --- Scheduling ---
+#
+
+
+class ScheduledTask():
+    """
+    Frame tick of a single video.
+    Periodic tasks run every interval, on a fixed grid of deadlines. Triggered tasks run once after being triggered,
+    at most once per interval, so triggers that come in faster than that are merged,
+    and triggers are ignored while wanted returns False.
+    Ticks can return a number of seconds to wait before the next tick (after an error, for example).
+    Ticks must never block, as that holds up every other video. Blocking tasks run on a thread of their own instead,
+    still in the order the scheduler hands them out.
+    """
+
+    def __init__(
+        self,
+        scheduler: "FrameScheduler",
+        key: Any,
+        tick: Callable[[], Optional[float]],
+        interval: float,
+        triggered: bool = False,
+        wanted: Optional[Callable[[], bool]] = None,
+        blocking: bool = False
+    ):
+        self.scheduler = scheduler
+        self.key = key
+        self.tick = tick
+        self.interval = interval
+        self.triggered = triggered
+        self.wanted = wanted
+        self.blocking = blocking
+        # Set whenever a blocking task is due, to wake up its thread
+        self.due = Event()
+
+        # Scheduling State
+        self.deadline: Optional[float] = None  # Set while queued or running
+        self.queued: bool = False
+        self.running: bool = False
+        self.pending: bool = False  # Triggered while queued or running
+        self.next_allowed: float = 0.0
+
+        # Statistics
+        self.ticks: int = 0
+        self.ticks_missed: int = 0
+        self.lateness = StageTimer()
+
+    @property
+    def priority(self):
+        return self.scheduler.get_priority(self.key)
+
+    def is_wanted(self):
+        return self.wanted is None or self.wanted()
+
+    def trigger(self, *args):
+        # Takes any arguments, so it can be used as a frame subscriber
+        self.scheduler.trigger(self)
+
+    def __repr__(self):
+        kind = "triggered" if self.triggered else f"every {self.interval * 1000:.1f}ms"
+        if self.blocking:
+            kind += " blocking"
+        state = "running" if self.running else "queued" if self.queued else "idle"
+        return f"<ScheduledTask {type(self.key).__name__} {kind} priority {self.priority} {state}, {self.ticks} ticks>"
+
+
+class FrameScheduler():
+    """
+    Runs the frame ticks of every scheduled video from one loop.
+    Due ticks run highest priority first, then earliest deadline first. Periodic tasks that fall more than a frame
+    behind skip the frames they missed instead of rushing through them, and continue from the current time.
+    Wormhole runs its threads as gevent greenlets, which already take turns on a single thread,
+    so running every tick from one loop costs no parallelism. Encodes still run on the encoder pool.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.queue: list[tuple[float, int, ScheduledTask]] = []
+        self.order = itertools.count()
+        self.tasks: list[ScheduledTask] = []
+        self.priorities: dict[Any, int] = {}
+        self.thread: Optional[Thread] = None
+
+    def add(
+        self,
+        key: Any,
+        tick: Callable[[], Optional[float]],
+        interval: float,
+        triggered: bool = False,
+        wanted: Optional[Callable[[], bool]] = None,
+        blocking: bool = False
+    ):
+        """
+        Schedules the frame tick of a video (the key). Periodic tasks start right away, triggered tasks on their first trigger.
+        Ticks that can block (waiting on I/O or other processes) have to be added with blocking.
+        """
+
+        task = ScheduledTask(self, key, tick, interval, triggered=triggered, wanted=wanted, blocking=blocking)
+        if blocking:
+            Thread(target=self.run_blocking, args=(task,), daemon=True).start()
+        with self.condition:
+            self.tasks.append(task)
+            if not triggered:
+                self.queue_task(task, time.monotonic())
+            # The loop only starts once there is something to run
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return task
+
+    def get_priority(self, key: Any):
+        return self.priorities.get(key, 0)
+
+    def set_priority(self, key: Any, priority: int):
+        """
+        Sets the priority of a video. Higher priorities run first when several ticks are due at once. Defaults to 0.
+        """
+
+        with self.condition:
+            self.priorities[key] = priority
+
+    def queue_task(self, task: ScheduledTask, deadline: float):
+        # Must hold the condition
+        task.deadline = deadline
+        task.queued = True
+        heapq.heappush(self.queue, (deadline, next(self.order), task))
+        self.condition.notify()
+
+    def trigger(self, task: ScheduledTask):
+        with self.condition:
+            if not task.is_wanted():
+                return
+            if task.queued or task.running:
+                task.pending = True
+                return
+            self.queue_task(task, max(time.monotonic(), task.next_allowed))
+
+    def run(self):
+        while True:
+            # Wait for the next deadline, then take every task that is due
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(max(self.queue[0][0] - time.monotonic(), 0) if self.queue else None)
+                now = time.monotonic()
+                due = []
+                while self.queue and self.queue[0][0] <= now:
+                    task = heapq.heappop(self.queue)[2]
+                    task.queued = False
+                    task.running = True
+                    task.pending = False
+                    due.append(task)
+                due.sort(key=lambda task: (-task.priority, task.deadline))
+
+            for task in due:
+                if task.blocking:
+                    task.due.set()
+                else:
+                    self.run_task(task)
+
+    def run_blocking(self, task: ScheduledTask):
+        # Thread of a blocking task. The task stays running until its tick is done, so it is never due twice at once.
+        while True:
+            task.due.wait()
+            task.due.clear()
+            self.run_task(task)
+
+    def run_task(self, task: ScheduledTask):
+        start = time.monotonic()
+        delay = None
+        try:
+            task.lateness.add(start - task.deadline)
+            delay = task.tick()
+            task.ticks += 1
+        except Exception as e:
+            # Videos handle their own errors, so this should not happen normally
+            logging.error(f"Error While Running Scheduled Task {task}! {e}", exc_info=True)
+            delay = 1.0
+
+        with self.condition:
+            task.running = False
+            now = time.monotonic()
+            if task.triggered:
+                task.next_allowed = start + task.interval if delay is None else now + delay
+                if task.pending and task.is_wanted():
+                    self.queue_task(task, max(now, task.next_allowed))
+                task.pending = False
+            elif delay is not None:
+                self.queue_task(task, now + delay)
+            else:
+                # Stay on the grid of deadlines, unless whole frames were missed
+                deadline = task.deadline + task.interval
+                if now - deadline > task.interval:
+                    task.ticks_missed += int((now - deadline) / task.interval)
+                    deadline = now
+                self.queue_task(task, deadline)
+
+    def __repr__(self):
+        return f"<FrameScheduler {len(self.tasks)} tasks, {len(self.queue)} queued>"
+
+
+# Scheduler shared by every video in the process
+frame_scheduler = FrameScheduler()
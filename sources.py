@@ -0,0 +1,60 @@
+from pipeline import FileVideo
+from framecache import CachedFileVideo
+from profiler import profiler
+
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Any, Optional
+
+# Registry of shared file videos, keyed by the resolved file path and decode parameters
+shared_file_videos: dict[tuple, FileVideo] = {}
+shared_file_videos_lock = Lock()
+
+
+def open_file_video(
+    filename: str,
+    max_fps: Optional[float] = 30,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    repeat: bool = True,
+    cv2_config: Optional[list[tuple[Any, Any]]] = None,
+    print_fps: bool = False,
+    frame_cache_dir: Optional[str] = None
+):
+    """
+    Returns a shared FileVideo for the given file, only creating it the first time it is asked for.
+    Every stream opening the same file with the same decode parameters shares one decode thread and frame publisher.
+    Shared videos are always raw. Attach frame modifiers to a SoftCopy or HardCopy of the video instead.
+    If frame_cache_dir is given, the decoded frames are cached on disk and played back from there (see CachedFileVideo).
+    """
+
+    key = (
+        str(Path(filename).resolve()),
+        max_fps,
+        width,
+        height,
+        repeat,
+        tuple(cv2_config) if cv2_config else None,
+        frame_cache_dir
+    )
+
+    with shared_file_videos_lock:
+        video = shared_file_videos.get(key)
+        if video is None:
+            logging.info(f"Opening Shared Video File {filename}")
+            if frame_cache_dir:
+                video = CachedFileVideo(filename, frame_cache_dir, max_fps=max_fps, width=width, height=height, repeat=repeat, cv2_config=cv2_config)
+            else:
+                video = FileVideo(filename, max_fps=max_fps, width=width, height=height, repeat=repeat, cv2_config=cv2_config)
+            shared_file_videos[key] = video
+            profiler.name_video(video, Path(filename).name)
+        else:
+            logging.debug(f"Reusing Shared Video File {filename}")
+
+    # FPS printing is not a decode parameter, so turn it on for whoever asks for it
+    if print_fps:
+        video.print_fps = True
+        video.frame_controller.print_fps = True
+
+    return video
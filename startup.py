@@ -0,0 +1,101 @@
+#
+# Startup timing, for tracking how long the server takes to become useful after a (re)start.
+# Kept free of Wormhole imports, so that main.py can open the server port before loading anything heavy.
+#
+
+import os
+import socket
+import time
+from threading import Lock
+
+# Startup phases, in the order they normally happen
+PHASES = ("listening", "imports", "server", "routes", "first_byte", "first_frame")
+
+
+def get_process_start_time():
+    """
+    Wall clock time the process started at, so that interpreter startup counts towards the startup time too.
+    Only supported on Linux. Falls back to the time this module was loaded elsewhere.
+    """
+
+    try:
+        with open("/proc/self/stat") as file:
+            # The process name can contain spaces, so the fields are read from after it
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+def create_listener(host: str, port: int, backlog: int = 1024):
+    """
+    Binds and listens on the server address right away.
+    Connections made while the rest of the server is still loading wait in the backlog instead of being refused,
+    and get answered as soon as the server starts accepting them.
+    """
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+class StartupTimer():
+    """
+    Records when each startup phase was reached, in seconds since the process started:
+      listening    The server port is open (only with --lazy), so connections queue up instead of being refused
+      imports      Wormhole and the streaming backends are loaded
+      server       The server is up and accepting requests
+      routes       Every route is added (with --lazy, most streams are not built yet)
+      first_byte   The first part of any stream was sent, even if it was only a placeholder
+      first_frame  The first actual video frame of any stream was sent
+    Along with how long building each stream took. The report is logged once the first frame goes out.
+    """
+
+    def __init__(self):
+        self.start_time = get_process_start_time()
+        self.lock = Lock()
+        self.phases: dict[str, float] = {}
+        self.builds: dict[str, float] = {}
+
+    def mark(self, phase: str):
+        # Only the first time a phase is reached counts
+        with self.lock:
+            if phase in self.phases:
+                return
+            self.phases[phase] = time.time() - self.start_time
+        if phase == "first_frame":
+            self.report()
+
+    def frame_sent(self, placeholder: bool = False):
+        """
+        Called by streams for every part they send. Only does anything until the first frame goes out.
+        """
+
+        if "first_frame" in self.phases:
+            return
+        self.mark("first_byte")
+        if not placeholder:
+            self.mark("first_frame")
+
+    def record_build(self, route: str, build_time: float):
+        self.builds[route] = build_time
+
+    def report(self):
+        # Printed like the stream stats, so it ends up in the container logs without --debug
+        phases = ", ".join(f"{phase} {self.phases[phase]:.3f}s" for phase in PHASES if phase in self.phases)
+        print(f"Startup Timings (Since Process Start): {phases}")
+        if self.builds:
+            builds = ", ".join(f"{route} {build_time * 1000:.1f}ms" for route, build_time in list(self.builds.items()))
+            print(f"Stream Build Times: {builds}")
+
+    def __repr__(self):
+        return f"<StartupTimer {len(self.phases)} phases, {len(self.builds)} builds>"
+
+
+# Startup timer of the process
+startup_timer = StartupTimer()
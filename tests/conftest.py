@@ -0,0 +1,8 @@
+#
+# The server modules live at the top level of the repository, so tests import them from there.
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
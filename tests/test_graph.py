@@ -0,0 +1,135 @@
+#
+# Tests for planning and validating stream graphs (graph.py). Nothing gets built, so no video pipeline is needed.
+# Modifiers are given as "test_graph:<name>", so they resolve to the functions below instead of real ones.
+#
+
+from graph import StreamGraph
+
+import pytest
+
+
+def draw_a(video):
+    pass
+
+
+def draw_b(video):
+    pass
+
+
+def draw_c(video):
+    pass
+
+
+def create_graph(streams: dict, videos: dict = {}):
+    # Every config gets a file source, with this file standing in for the video file
+    return StreamGraph({"videos": {"source": {"type": "file", "path": __file__}, **videos}, "streams": streams})
+
+
+def soft(*modifiers, **settings):
+    return {"type": "soft", "from": "source", "modifiers": [f"test_graph:{name}" for name in modifiers], **settings}
+
+
+def hard(*modifiers, **settings):
+    return {"type": "hard", "from": "source", "modifiers": [f"test_graph:{name}" for name in modifiers], **settings}
+
+
+def get_built(graph: StreamGraph):
+    return [node for node in graph.walk() if node.is_built()]
+
+
+@pytest.mark.parametrize("streams", [
+    # Same modifiers
+    {"/a": soft("draw_a", "draw_b"), "/b": soft("draw_a", "draw_b")},
+    # Same resize
+    {"/a": soft(width=640, height=360), "/b": soft(width=640, height=360)},
+    # Same hard copy
+    {"/a": hard("draw_a", max_fps=10), "/b": hard("draw_a", max_fps=10)},
+])
+def test_identical_chains_share_one_node(streams):
+    graph = create_graph(streams)
+
+    assert graph.nodes["/a"] is graph.nodes["/b"]
+    # The source, and the one video both routes stream
+    assert len(get_built(graph)) == 2
+
+
+@pytest.mark.parametrize("streams, shared_kind", [
+    # Split after a shared modifier
+    ({"/a": soft("draw_a", "draw_b"), "/b": soft("draw_a", "draw_c")}, "modifier"),
+    # Split after a shared resize
+    ({"/a": soft("draw_b", width=640, height=360), "/b": soft("draw_c", width=640, height=360)}, "soft"),
+    # Split after a shared hard copy
+    ({"/a": hard("draw_b", max_fps=10), "/b": hard("draw_c", max_fps=10)}, "hard"),
+    # Split after a shared hard copy and modifier
+    ({"/a": hard("draw_a", "draw_b"), "/b": hard("draw_a", "draw_c")}, "modifier"),
+])
+def test_split_builds_one_shared_video(streams, shared_kind):
+    graph = create_graph(streams)
+
+    # Both routes are built on the same shared video, which no route streams itself
+    base_a, steps_a = graph.nodes["/a"].get_base()
+    base_b, steps_b = graph.nodes["/b"].get_base()
+    assert base_a is base_b
+    assert base_a.kind == shared_kind
+    assert not base_a.names
+    assert len(get_built(graph)) == 4
+
+    # Branches only apply their own modifier, as soft copies of the shared video
+    for route, steps in (("/a", steps_a), ("/b", steps_b)):
+        assert [step.kind for step in steps] == ["modifier"]
+        assert graph.nodes[route].describe().startswith("SoftCopy")
+
+
+def test_split_without_shared_work_copies_the_source():
+    # Plain soft copies cost nothing, so there is nothing worth sharing
+    graph = create_graph({"/a": soft("draw_a"), "/b": soft("draw_b")})
+
+    base_a, _ = graph.nodes["/a"].get_base()
+    base_b, _ = graph.nodes["/b"].get_base()
+    assert base_a is base_b is graph.nodes["source"]
+    assert len(get_built(graph)) == 3
+
+
+def test_named_videos_are_built_even_without_a_split():
+    graph = create_graph(
+        {"/gray": {"video": "gray"}, "/gray-marked": {"type": "soft", "from": "gray", "modifiers": ["test_graph:draw_b"]}},
+        {"gray": soft("draw_a")})
+
+    base, steps = graph.nodes["/gray-marked"].get_base()
+    assert base is graph.nodes["gray"]
+    assert [step.kind for step in steps] == ["soft", "modifier"]
+
+
+@pytest.mark.parametrize("videos, streams, problems", [
+    # Copy cycles and unknown references, all reported at once
+    (
+        {"loop_a": {"type": "soft", "from": "loop_b"}, "loop_b": {"type": "soft", "from": "loop_a"}, "orphan": {"type": "soft", "from": "missing"}},
+        {"/a": {"video": "loop_a"}, "/b": {"video": "nowhere"}, "/c": {"video": "orphan"}},
+        [
+            "loop_a: Copies Itself! (loop_a -> loop_b -> loop_a)",
+            "loop_b: Copies Itself! (loop_b -> loop_a -> loop_b)",
+            "orphan: Copies Unknown Video missing!",
+            "streams.\"/b\": Unknown Video nowhere!",
+        ]
+    ),
+    # Bad settings and modifiers, along with a copy of an unknown video
+    (
+        {},
+        {"/a": {**soft("draw_a", "not_a_modifier"), "width": 640}, "/b": {"type": "hard", "from": "missing", "max_fps": 0}, "c": soft()},
+        [
+            "streams.\"/a\": Width And Height Must Be Given Together!",
+            "streams.\"/a\": Modifier 2 (test_graph:not_a_modifier)",
+            "streams.\"/b\": max_fps Must Be Larger Than 0!",
+            "/b: Copies Unknown Video missing!",
+            "streams.\"c\": Routes Must Start With '/'!",
+        ]
+    ),
+])
+def test_problems_are_reported_together(videos, streams, problems):
+    with pytest.raises(ValueError) as error:
+        create_graph(streams, videos)
+
+    message = str(error.value)
+    for problem in problems:
+        assert problem in message
+    assert message.count("\n - ") == len(problems)
@@ -0,0 +1,52 @@
+#
+# Tests for the frame scheduler (scheduler.py). Each test uses a scheduler of its own.
+#
+
+from scheduler import FrameScheduler
+
+import time
+
+
+def test_blocking_tick_does_not_delay_other_tasks():
+    scheduler = FrameScheduler()
+    fast = scheduler.add("fast", lambda: None, 0.01)
+    slow = scheduler.add("slow", lambda: time.sleep(0.3), 0.01, blocking=True)
+    time.sleep(1)
+
+    assert slow.ticks >= 2
+    assert fast.ticks >= 80
+    assert max(fast.lateness.samples) < 0.05
+    assert fast.ticks_missed == 0
+
+
+def test_higher_priority_runs_first():
+    scheduler = FrameScheduler()
+    order = []
+    scheduler.set_priority("high", 10)
+    scheduler.set_priority("low", -10)
+
+    # Holding the condition keeps the loop from running either task until both are due
+    with scheduler.condition:
+        scheduler.add("low", lambda: order.append("low"), 60)
+        scheduler.add("high", lambda: order.append("high"), 60)
+    time.sleep(0.1)
+
+    assert order == ["high", "low"]
+
+
+def test_triggers_are_merged_up_to_the_interval():
+    scheduler = FrameScheduler()
+    task = scheduler.add("copy", lambda: None, 0.2, triggered=True)
+
+    # Triggers that come in before the tick runs are covered by it
+    for _ in range(10):
+        task.trigger()
+    time.sleep(0.05)
+    assert task.ticks == 1
+
+    # Later triggers wait until the interval is up
+    task.trigger()
+    time.sleep(0.05)
+    assert task.ticks == 1
+    time.sleep(0.2)
+    assert task.ticks == 2
@@ -11,50 +11,603 @@
 
 
 from wormhole.streamer import AbstractStreamer
-from wormhole.utils import FrameController
+from wormhole.utils import FrameController, blank_frame_color, draw_text
+from pipeline import acquire_demand, release_demand, lease_demand
+from errorstate import ErrorState
+from profiler import profiler
+from startup import startup_timer
+from scheduler import get_frame_signal
+from asynchttp import parse_rendition_query
+from clientlag import ClientLagTracker, get_fallback_quality
 
+import cv2
 import logging
+import numpy as np
+import os
 import time
-import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
 from flask.wrappers import Response
-from turbojpeg import TurboJPEG, TJFLAG_FASTUPSAMPLE, TJFLAG_FASTDCT
+from threading import Lock
+from typing import Callable, Optional
+from uuid import uuid4
+from turbojpeg import (
+    TurboJPEG,
+    TJFLAG_FASTUPSAMPLE,
+    TJFLAG_FASTDCT,
+    TJPF_BGR,
+    TJPF_GRAY,
+    TJSAMP_444,
+    TJSAMP_422,
+    TJSAMP_420,
+    TJSAMP_GRAY)
 
+# Chroma subsampling modes, by name
+SUBSAMPLING = {
+    "444": TJSAMP_444,
+    "422": TJSAMP_422,
+    "420": TJSAMP_420,
+    "gray": TJSAMP_GRAY
+}
+
+
+class EncoderPool():
+    """
+    Bounded pool of native threads to run JPEG encodes on.
+    TurboJPEG releases the GIL while encoding, so frames of different streams (and renditions) get encoded in parallel.
+    Wormhole monkey patches threading with gevent, so gevent's own pool of real threads is used when that is the case.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or min(os.cpu_count() or 1, 4)
+
+        try:
+            from gevent import monkey
+            from gevent.threadpool import ThreadPool
+            use_gevent = monkey.is_module_patched("threading")
+        except ImportError:
+            use_gevent = False
+
+        if use_gevent:
+            self.pool = ThreadPool(self.workers)
+            self.executor = None
+        else:
+            self.pool = None
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="JPEGEncoder")
+
+    def run(self, function: Callable, *args, **kwargs):
+        """
+        Runs the function on the pool, blocking (cooperatively, under gevent) until it is done
+        """
+
+        if self.pool is not None:
+            return self.pool.apply(function, args, kwargs)
+        return self.executor.submit(function, *args, **kwargs).result()
+
+    def __repr__(self):
+        return f"<EncoderPool {self.workers} workers ({'gevent' if self.pool is not None else 'threads'})>"
+
+
+# Pool shared by every stream that doesn't bring its own. Created on first use.
+default_encoder_pool: Optional[EncoderPool] = None
+default_encoder_pool_lock = Lock()
+
+
+def get_encoder_pool():
+    global default_encoder_pool
+    with default_encoder_pool_lock:
+        if default_encoder_pool is None:
+            default_encoder_pool = EncoderPool()
+        return default_encoder_pool
+
+
+class SharedJPEGEncoder():
+    """
+    Encodes each new frame of a video exactly once and shares the resulting
+    multipart chunk (boundary and headers included) between every client of a stream.
+    With dedupe_frames, new frames are also hashed, and frames identical to the last one reuse its encoded part.
+    While the video (or encoding) is failing, every client gets the same pre-encoded placeholder instead.
+    With a width, frames are scaled down (keeping the aspect ratio) before being encoded.
+    Encodes run on an EncoderPool. 1 channel (grayscale) frames are encoded as grayscale JPEGs directly.
+    With a stream route, resize and encode times are also reported to the pipeline profiler.
+    """
+
+    def __init__(
+        self,
+        video,
+        boundary: str = "WORMHOLE",
+        quality: int = 85,
+        flags: int = TJFLAG_FASTUPSAMPLE | TJFLAG_FASTDCT,
+        subsampling: str = "422",
+        dedupe_frames: bool = False,
+        error_state: Optional[ErrorState] = None,
+        width: Optional[int] = None,
+        encoder_pool: Optional[EncoderPool] = None,
+        print_stats: bool = False,
+        stream: Optional[str] = None
+    ):
+        # Sanity Check
+        if subsampling not in SUBSAMPLING:
+            raise ValueError(f"Unknown Chroma Subsampling {subsampling}! Must be one of {', '.join(SUBSAMPLING)}")
+
+        self.video = video
+        self.quality = quality
+        self.subsampling = subsampling
+        # Output size. Heights are kept even, as chroma subsampling works on pairs of rows.
+        self.width: int = width or video.width
+        self.height: int = video.height if not width else max(round(width * video.height / video.width / 2) * 2, 2)
+        # Buffer that frames are scaled into. Only used while holding the lock
+        self.scaled_frame: Optional[np.ndarray] = None
+        self.flags = flags
+        self.dedupe_frames = dedupe_frames
+        self.error_state = error_state or ErrorState(f"{type(video).__name__} Encoder")
+        self.jpeg = TurboJPEG()
+        self.encoder_pool = encoder_pool or get_encoder_pool()
+        self.part_header = b"--" + boundary.encode("ascii") + b"\r\nContent-Type: image/jpeg\r\n\r\n"
+        # "Stream unavailable" image and part, encoded the first time they are needed
+        self.placeholder_jpeg: Optional[bytes] = None
+        self.placeholder_part: Optional[bytes] = None
+
+        # Encode Statistics
+        # Times only cover encoding itself, not waiting for a free worker
+        self.print_stats = print_stats
+        self.stream = stream
+        self.frames_encoded: int = 0
+        self.last_encode_time: float = 0.0
+        self.average_encode_time: float = 0.0
+        self.max_encode_time: float = 0.0
+        self.stats_printed_at: float = time.time()
+
+        # ETags are built from the sequence number, which starts over every time the server restarts
+        self.etag_prefix = uuid4().hex[:12]
+
+        # Latest encoded part, stored as a (sequence, part) tuple so that it can be read without locking.
+        # The sequence number goes up by one every time a new source frame gets encoded.
+        self.latest: tuple[int, bytes] = (0, b"")
+        # Same as latest, but with just the JPEG image. Used for snapshots.
+        self.latest_jpeg: tuple[int, bytes] = (0, b"")
+        # Frame object that the latest part was encoded from.
+        # Videos publish a different array for every frame, so identity tells us if the frame changed.
+        # Videos that redraw the same array in place also keep a frame_version counter (see pipeline.CustomVideo).
+        self.source_frame = None
+        self.source_version: Optional[int] = None
+        # Hash of the latest frame, when deduplicating frames
+        self.source_hash: Optional[int] = None
+        self.lock = Lock()
+
+    def frame_changed(self, frame, version: Optional[int]):
+        return frame is not self.source_frame or version != self.source_version
+
+    def get_placeholder(self):
+        """
+        Switches the latest part over to the "stream unavailable" placeholder, if it isn't already
+        """
+
+        with self.lock:
+            if self.placeholder_part is None:
+                frame = blank_frame_color(self.width, self.height, (0, 0, 0))
+                draw_text(frame, "Stream Unavailable", (10, 60), font_size=2, font_stroke=4)
+                draw_text(frame, "This stream will resume automatically once its source recovers.", (10, 100))
+                try:
+                    self.placeholder_jpeg = self.encode(frame)
+                    self.placeholder_part = self.part_header + self.placeholder_jpeg + b"\r\n"
+                except Exception as e:
+                    # Encoding is broken altogether. Keep sending whatever was sent last.
+                    self.error_state.record(e, "Error While Encoding Placeholder Frame!")
+                    self.placeholder_jpeg = self.latest_jpeg[1]
+                    self.placeholder_part = self.latest[1]
+
+            if self.latest[1] is not self.placeholder_part:
+                self.latest = (self.latest[0] + 1, self.placeholder_part)
+                self.latest_jpeg = (self.latest[0], self.placeholder_jpeg)
+                # Make sure the first frame after recovering gets encoded
+                self.source_frame = None
+                self.source_hash = None
+            return self.latest
+
+    def scale_frame(self, frame: np.ndarray):
+        if frame.shape[1] == self.width and frame.shape[0] == self.height:
+            return frame
+        if self.scaled_frame is None or self.scaled_frame.shape[2:] != frame.shape[2:]:
+            self.scaled_frame = np.empty((self.height, self.width, *frame.shape[2:]), dtype=frame.dtype)
+        start = time.perf_counter()
+        cv2.resize(frame, (self.width, self.height), dst=self.scaled_frame, interpolation=cv2.INTER_AREA)
+        if self.stream:
+            profiler.record_stream(self.stream, "resize", time.perf_counter() - start)
+        return self.scaled_frame
+
+    def encode_frame(self, frame: np.ndarray):
+        """
+        Encodes a frame to JPEG. Runs on the encoder pool.
+        """
+
+        start = time.perf_counter()
+        if frame.ndim == 2 or frame.shape[2] == 1:
+            jpg = self.jpeg.encode(frame, quality=self.quality, pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY, flags=self.flags)
+        else:
+            jpg = self.jpeg.encode(frame, quality=self.quality, pixel_format=TJPF_BGR, jpeg_subsample=SUBSAMPLING[self.subsampling], flags=self.flags)
+        return jpg, time.perf_counter() - start
+
+    def encode(self, frame: np.ndarray):
+        jpg, encode_time = self.encoder_pool.run(self.encode_frame, frame)
+
+        # Update Encode Statistics
+        self.frames_encoded += 1
+        self.last_encode_time = encode_time
+        self.average_encode_time = encode_time if self.frames_encoded == 1 else self.average_encode_time * 0.95 + encode_time * 0.05
+        self.max_encode_time = max(self.max_encode_time, encode_time)
+        if self.stream:
+            profiler.record_stream(self.stream, "encode", encode_time)
+        if self.print_stats and time.time() - self.stats_printed_at >= 5:
+            print(self.get_stats())
+            self.stats_printed_at = time.time()
+            self.max_encode_time = 0.0
+
+        return jpg
+
+    def get_stats(self):
+        return (
+            f"Encode Time ({self.width}x{self.height} q{self.quality} {self.subsampling}): "
+            f"Average {self.average_encode_time * 1000:.2f} ms Max {self.max_encode_time * 1000:.2f} ms "
+            f"Frames Encoded: {self.frames_encoded}"
+        )
+
+    def get_part(self):
+        """
+        Returns the (sequence, part) tuple for the current frame of the video, encoding it if needed
+        """
+
+        # While the video is failing, its frames are error screens. Send the placeholder instead.
+        video_errors = getattr(self.video, "error_state", None)
+        if video_errors is not None and video_errors.failing:
+            return self.get_placeholder()
+
+        # Read the version before the frame, so a frame published in between is never marked as encoded
+        version = getattr(self.video, "frame_version", None)
+        frame = self.video.get_frame()
+        # Fast path. Frame was already encoded by another client
+        if not self.frame_changed(frame, version):
+            return self.latest
+
+        # Only one client encodes the new frame. Everyone else waits for it and reuses the result
+        with self.lock:
+            if not self.frame_changed(frame, version):
+                return self.latest
+
+            # Each frame is only tried once, even if encoding it fails
+            self.source_frame = frame
+            self.source_version = version
+            try:
+                # Sources like error screens keep publishing the same image. Skip encoding those again.
+                frame_hash = zlib.crc32(frame) if self.dedupe_frames and frame.flags.c_contiguous else None
+                if frame_hash is None or frame_hash != self.source_hash or not self.latest[0]:
+                    jpg = self.encode(self.scale_frame(frame))
+                    self.latest = (self.latest[0] + 1, self.part_header + jpg + b"\r\n")
+                    self.latest_jpeg = (self.latest[0], jpg)
+                self.source_hash = frame_hash
+                self.error_state.recover()
+                return self.latest
+            except Exception as e:
+                self.error_state.record(e, "Error While Generating JPEG for Stream!")
+
+        return self.get_placeholder()
+
+
+class RenditionSet():
+    """
+    Shared encoders for every rendition (output width and JPEG quality) of a stream.
+    A rendition is created when the first client asks for it, shared by every client asking for the same one,
+    and dropped once its last client leaves. The full size rendition at the default quality is always kept.
+    It is created with default_encoder_type, so streams can serve it without encoding (see relay.PassthroughEncoder).
+    Requests are clamped and rounded so that similar requests end up on the same rendition.
+    """
+
+    def __init__(
+        self,
+        video,
+        quality: int = 85,
+        max_renditions: int = 8,
+        min_width: int = 160,
+        width_step: int = 32,
+        quality_step: int = 5,
+        default_encoder_type: type = SharedJPEGEncoder,
+        **encoder_options  # Any Additional Arguments for SharedJPEGEncoder
+    ):
+        self.video = video
+        self.quality = quality
+        self.encoder_options = encoder_options
+        self.max_renditions = max_renditions
+        self.min_width = min_width
+        self.width_step = width_step
+        self.quality_step = quality_step
+        self.lock = Lock()
+
+        # Renditions keyed by (width, quality), with the number of clients using each one
+        self.encoders: dict[tuple[int, int], SharedJPEGEncoder] = {}
+        self.clients: dict[tuple[int, int], int] = {}
+
+        # Default rendition. Never dropped, but only encoded while clients are using it.
+        self.default = default_encoder_type(self.video, quality=quality, **self.encoder_options)
+        self.encoders[self.get_key()] = self.default
+        self.clients[self.get_key()] = 0
+
+    def get_key(self, width: Optional[int] = None, quality: Optional[int] = None):
+        """
+        Clamps and rounds a requested width and quality to a rendition key. Missing values use the stream defaults.
+        """
+
+        if width is None:
+            width = self.video.width
+        else:
+            width = min(max(round(width / self.width_step) * self.width_step, self.min_width), self.video.width)
+        if quality is None:
+            quality = self.quality
+        else:
+            quality = min(max(round(quality / self.quality_step) * self.quality_step, 1), 100)
+        return (width, quality)
+
+    def acquire(self, width: Optional[int] = None, quality: Optional[int] = None):
+        """
+        Returns the shared encoder for the requested rendition, creating it if needed.
+        Once the maximum number of renditions exist, the closest existing one is used instead.
+        Every acquire must be paired with a release.
+        """
+
+        key = self.get_key(width, quality)
+        with self.lock:
+            if key not in self.encoders:
+                if len(self.encoders) >= self.max_renditions:
+                    key = min(self.encoders, key=lambda other: (abs(other[0] - key[0]), abs(other[1] - key[1])))
+                else:
+                    logging.debug(f"Creating Rendition {key[0]}w q{key[1]} For {self.video}")
+                    self.encoders[key] = SharedJPEGEncoder(
+                        self.video,
+                        quality=key[1],
+                        width=key[0] if key[0] != self.video.width else None,
+                        **self.encoder_options
+                    )
+                    self.clients[key] = 0
+            self.clients[key] += 1
+            return self.encoders[key]
+
+    def release(self, encoder: SharedJPEGEncoder):
+        with self.lock:
+            key = (encoder.width, encoder.quality)
+            if key not in self.clients:
+                return
+            self.clients[key] -= 1
+            if self.clients[key] <= 0 and encoder is not self.default:
+                logging.debug(f"Dropping Unused Rendition {key[0]}w q{key[1]} For {self.video}")
+                del self.encoders[key]
+                del self.clients[key]
+
+    def swap(self, encoder: SharedJPEGEncoder, width: Optional[int] = None, quality: Optional[int] = None):
+        """
+        Moves a client over to another rendition
+        """
+
+        new_encoder = self.acquire(width, quality)
+        self.release(encoder)
+        return new_encoder
+
+    def get_parts(self):
+        """
+        Returns the latest part of every rendition in use
+        """
+
+        with self.lock:
+            encoders = [encoder for key, encoder in self.encoders.items() if self.clients[key] > 0]
+        return {encoder: encoder.get_part() for encoder in encoders}
+
+    def __repr__(self):
+        renditions = ", ".join(f"{width}w q{quality}: {clients}" for (width, quality), clients in self.clients.items())
+        return f"<RenditionSet [{renditions}]>"
+
+
+def add_snapshot_route(streamer, encoder: SharedJPEGEncoder, lease_time: float = 5.0):
+    """
+    Adds a /<route>/snapshot.jpg route that returns the latest JPEG of the stream.
+    Frames are only encoded if they haven't been already, and clients can revalidate with If-None-Match.
+    Each snapshot keeps the video running for lease_time seconds, so polling clients keep getting fresh frames.
+    """
+
+    def snapshot():
+        lease_demand(streamer.video, lease_time)
+        encoder.get_part()
+        sequence, jpeg = encoder.latest_jpeg
+
+        response = Response(jpeg, mimetype="image/jpeg")
+        response.set_etag(f"{encoder.etag_prefix}-{sequence}")
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    route = f"{streamer.route.rstrip('/')}/snapshot.jpg"
+    streamer.controller.add_route(route, snapshot, strict_url=streamer.strict_url)
+    return route
+
+
+class StreamClient():
+    """
+    Rendition of a single client of a shared MJPEG stream.
+    Clients that fall behind are moved to the fallback quality of their rendition until they catch up (see ClientLagTracker).
+    """
+
+    def __init__(self, streamer: "SharedMJPEGStreamer", width: Optional[int] = None, quality: Optional[int] = None):
+        self.streamer = streamer
+        self.width = width
+        self.quality = quality
+        self.behind_quality = get_fallback_quality(quality, streamer.quality, streamer.fallback_quality)
+        self.lag = ClientLagTracker()
+        self.encoder = streamer.renditions.acquire(width, quality)
+        self.encoder_quality = quality
+
+    def get_encoder(self):
+        # Switch to the lower quality version of the rendition while the client is behind
+        wanted_quality = self.behind_quality if self.lag.behind else self.quality
+        if wanted_quality != self.encoder_quality:
+            self.encoder = self.streamer.renditions.swap(self.encoder, self.width, wanted_quality)
+            self.encoder_quality = wanted_quality
+        return self.encoder
+
+    def frame_sent(self, sequence: int, send_time: float):
+        profiler.record_stream(self.streamer.route, "write", send_time)
+        startup_timer.frame_sent()
+        frames_skipped = self.lag.frames_skipped
+        self.lag.frame_sent(sequence, send_time)
+        self.streamer.frames_skipped += self.lag.frames_skipped - frames_skipped
+
+    def __repr__(self):
+        return f"<StreamClient {self.streamer.route} {self.encoder.width}w q{self.encoder.quality}{' (behind)' if self.lag.behind else ''}>"
+
+
+class SharedMJPEGStreamer(AbstractStreamer):
+    """
+    Base for Motion JPEG streamers that encode each frame once for all clients.
+    Sets up the shared encoders of every rendition, the fallback quality for clients that fall behind,
+    and the snapshot route. Subclasses add the stream route itself with add_feed_route, and send the frames.
+    """
+
+    # Encoder for the default rendition. Subclasses can swap it out (see relay.RelayStreamer).
+    default_encoder_type: type = SharedJPEGEncoder
 
-class TurboMJPEGStreamer(AbstractStreamer):
     def __init__(
         self,
         *args,
         boundary: str = "WORMHOLE",
         quality: int = 85,
+        subsampling: str = "422",
+        flags: int = TJFLAG_FASTUPSAMPLE | TJFLAG_FASTDCT,
+        encoder_pool: Optional[EncoderPool] = None,
+        fallback_quality: Optional[int] = None,
+        dedupe_frames: bool = False,
+        keepalive_interval: Optional[float] = 1.0,
+        max_renditions: int = 8,
+        snapshot_lease: Optional[float] = 5.0,
         **kwargs
     ):
         super().__init__(*args, **kwargs)
         self.boundary = boundary
-        self.jpeg = TurboJPEG()
+        self.quality = quality
+        # Clients that stay behind get a lower quality stream, if enabled
+        self.fallback_quality = fallback_quality
+        # While the frame does not change, it is only resent this often.
+        # None resends it every tick with TurboMJPEGStreamer, and never with AsyncTurboMJPEGStreamer.
+        self.keepalive_interval = keepalive_interval
+
+        # Errors are tracked once for the whole stream, instead of once per client
+        self.error_state = ErrorState(f"Stream {self.route}")
+
+        # Create the shared encoders for this stream. Every rendition is shared between the clients asking for it.
+        # Encoding settings (chroma subsampling, TurboJPEG flags and the pool encodes run on) are the same for every rendition.
+        self.renditions = RenditionSet(
+            self.video,
+            quality=quality,
+            max_renditions=max_renditions,
+            boundary=boundary,
+            subsampling=subsampling,
+            flags=flags,
+            encoder_pool=encoder_pool,
+            dedupe_frames=dedupe_frames,
+            error_state=self.error_state,
+            print_stats=self.print_fps,
+            stream=self.route,
+            default_encoder_type=self.default_encoder_type
+        )
+        self.encoder = self.renditions.default
+
+        # Client Statistics
+        self.clients: int = 0
+        self.frames_skipped: int = 0
+        # Name the video after this stream in the pipeline metrics, unless another stream got to it first
+        profiler.name_video(self.video, self.route)
+
+        # Add the video feed route to the network controller
+        self.add_feed_route()
+
+        # Add the /<route>/snapshot.jpg route, for grabbing single frames. None turns it off.
+        self.snapshot_route = add_snapshot_route(self, self.encoder, lease_time=snapshot_lease) if snapshot_lease else None
+
+    def add_feed_route(self):
+        raise NotImplementedError
+
+    def add_client(self, width: Optional[int] = None, quality: Optional[int] = None):
+        """
+        Registers a client of the stream. Every add_client must be paired with a remove_client.
+        """
 
+        # Let the video pipeline know someone is watching
+        self.clients += 1
+        acquire_demand(self.video)
+        return StreamClient(self, width, quality)
+
+    def remove_client(self, client: StreamClient):
+        self.clients -= 1
+        self.renditions.release(client.encoder)
+        release_demand(self.video)
+
+
+class TurboMJPEGStreamer(SharedMJPEGStreamer):
+    """
+    Motion JPEG streamer that encodes each frame once for all clients.
+    Clients can ask for a smaller, lower quality or lower frame rate version of the stream
+    with the width, quality and fps query parameters (e.g. /stream?width=640&quality=50&fps=10).
+    The latest frame is also available as a single image from /stream/snapshot.jpg.
+    """
+
+    def add_feed_route(self):
         # Create Video Feed Handler for Flask
         def video_feed():
-            # Render and Send Frames for each client
-            def generate_next_frame():
-                frame_controller = FrameController(self.max_fps, print_fps=self.print_fps)
-                while True:
-                    try:
-                        jpg = self.jpeg.encode(self.video.get_frame(), flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT, quality = quality)
-                        yield (b"--" + boundary.encode("ascii") + b"\r\nContent-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n")
-                        frame_controller.next_frame()
-                    except Exception as e:
-                        # Print Error To User
-                        logging.error(f"Error While Generating JPEG for Stream! {e}")
-                        traceback.print_exc()
-                        time.sleep(1)
-
-                        # Reset FPS Statistics in case the video works again
-                        frame_controller.reset_fps_stats()
-
             return Response(
-                generate_next_frame(),
-                mimetype=f"multipart/x-mixed-replace; boundary={boundary}",
+                self.generate_frames(**parse_rendition_query(request.args)),
+                mimetype=f"multipart/x-mixed-replace; boundary={self.boundary}",
             )
 
         # Add the video feed route to the network controller
         self.controller.add_route(self.route, video_feed, strict_url=self.strict_url)
+
+    def generate_frames(self, width: Optional[int] = None, quality: Optional[int] = None, fps: Optional[float] = None):
+        """
+        Sends the newest shared encoded frame to a single client, skipping any frames it was too slow for.
+        The client waits for the video to publish new frames (see scheduler.FrameSignal), and the frame controller
+        only keeps it from going over its frame rate.
+        """
+
+        frame_controller = FrameController(min(fps or self.max_fps, self.max_fps), print_fps=self.print_fps)
+        frame_signal = get_frame_signal(self.video)
+        last_part = None
+        last_send_time = 0.0
+
+        client = self.add_client(width, quality)
+        try:
+            while True:
+                try:
+                    frames_seen = frame_signal.count
+                    sequence, part = client.get_encoder().get_part()
+
+                    # Nothing new to send. Wait for the next frame, and only resend this one as a keepalive.
+                    if part is last_part and self.keepalive_interval is not None and time.time() - last_send_time < self.keepalive_interval:
+                        frame_signal.wait(frames_seen, last_send_time + self.keepalive_interval - time.time())
+                        continue
+
+                    # The generator resumes once the server is done writing the frame to the client
+                    send_start = time.time()
+                    yield part
+                    last_part = part
+                    last_send_time = send_start
+                    client.frame_sent(sequence, time.time() - send_start)
+
+                    # Wait for the next frame. Without keepalives, the frame is resent at the client frame rate.
+                    frame_controller.next_frame()
+                    frame_signal.wait(frames_seen, self.keepalive_interval or 1 / frame_controller.target_fps)
+                except Exception as e:
+                    # Encoding errors are handled by the encoder, so this should not happen normally.
+                    # Still, only log through the shared error state to keep logs from flooding.
+                    self.error_state.record(e, "Error While Streaming JPEG!")
+                    time.sleep(1)
+
+                    # Reset FPS Statistics in case the video works again
+                    frame_controller.reset_fps_stats()
+        finally:
+            # Client disconnected
+            self.remove_client(client)
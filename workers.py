@@ -0,0 +1,494 @@
+#
+# Multi-process serving tier.
+# The main process (the producer) runs every video pipeline and encodes each stream once, like usual.
+# Encoded frames are published into one shared memory frame ring per stream (see framering.py),
+# and a number of worker processes, all listening on the same port with SO_REUSEPORT, serve viewers from those rings.
+# Anything that is not a plain stream (other pages, snapshots, renditions, ...) is proxied to the producer.
+#
+# Workers are started as their own Python processes ("python workers.py <index> <config>"),
+# so they only load what they need for serving, and not Wormhole or the pipelines.
+# Which streams have a frame ring is published through one more ring (the control ring), as a JSON table,
+# so that streams built after the workers started (with --lazy) are served from rings as well.
+#
+
+from framering import FrameRing
+from clientlag import ClientLagTracker, get_fallback_quality
+from asynchttp import AsyncRequest, read_request, normalize_route, parse_rendition_query
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from http import HTTPStatus
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Optional
+from urllib.parse import parse_qs
+
+
+#
+# --- Producer Side ---
+#
+
+
+class RingPublisher():
+    """
+    Publishes the frames of a TurboMJPEG stream into a frame ring, while any worker has viewers for it.
+    Viewers in the workers count as clients of the stream, and keep its video running just like local viewers.
+    With a quality, a lower quality rendition of the stream is published instead (see RenditionSet).
+    """
+
+    def __init__(
+        self,
+        streamer,
+        quality: Optional[int] = None,
+        slots: int = 3,
+        slot_size: Optional[int] = None,
+        max_readers: int = 64,
+        idle_interval: float = 0.1
+    ):
+        # Imported here, so that worker processes never load Wormhole
+        from wormhole.utils import FrameController
+
+        self.streamer = streamer
+        self.quality = quality
+        self.encoder = streamer.encoder
+        self.idle_interval = idle_interval
+        # Encoded frames are a lot smaller than raw ones. Frames that still don't fit are dropped.
+        video = streamer.video
+        self.ring = FrameRing(slots=slots, slot_size=slot_size or max(video.width * video.height * 3 // 4, 256 * 1024), max_readers=max_readers)
+        self.frame_controller = FrameController(streamer.max_fps)
+        self.viewers: int = 0
+
+        Thread(target=self.publish_loop, daemon=True).start()
+
+    def publish_loop(self):
+        from pipeline import acquire_demand, release_demand
+        from scheduler import get_frame_signal
+        from startup import startup_timer
+
+        frame_signal = get_frame_signal(self.streamer.video)
+
+        last_part = None
+        while True:
+            try:
+                # Follow the viewer counts of the workers
+                viewers = self.ring.get_viewers()
+                if viewers and not self.viewers:
+                    acquire_demand(self.streamer.video)
+                    self.encoder = self.streamer.renditions.acquire(None, self.quality)
+                    self.frame_controller.reset_fps_stats()
+                elif not viewers and self.viewers:
+                    self.streamer.renditions.release(self.encoder)
+                    release_demand(self.streamer.video)
+                self.streamer.clients += viewers - self.viewers
+                self.viewers = viewers
+
+                # Sleep while nobody is watching
+                if not viewers:
+                    time.sleep(self.idle_interval)
+                    continue
+
+                # Publish the frame, unless it was already published
+                frames_seen = frame_signal.count
+                sequence, part = self.encoder.get_part()
+                if sequence and part is not last_part:
+                    self.ring.publish(part)
+                    last_part = part
+                    startup_timer.frame_sent()
+
+                # Wait for the next frame, no sooner than the stream frame rate allows
+                self.frame_controller.next_frame()
+                frame_signal.wait(frames_seen, self.idle_interval)
+            except Exception as e:
+                self.streamer.error_state.record(e, "Error While Publishing Frames To Workers!")
+                time.sleep(1)
+
+
+class WorkerPool():
+    """
+    Publishes every TurboMJPEG stream of a Wormhole server into frame rings,
+    and starts the worker processes that serve them on the public host and port.
+    The Wormhole server itself should listen on a private address (the upstream) that workers proxy everything else to.
+    Streams added to the server later on have to be published with add_stream.
+    Workers that die are replaced, and the viewers they had are taken off the rings, so streams don't keep encoding for nobody.
+    Streams with a fallback quality get a second ring at that quality, for viewers that fall behind.
+    """
+
+    def __init__(
+        self,
+        server,
+        host: str,
+        port: int,
+        workers: int,
+        upstream: tuple[str, int],
+        send_buffer_size: Optional[int] = 256 * 1024,
+        check_interval: float = 1.0,
+        **publisher_options
+    ):
+        # Sanity Check
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("Serving With Worker Processes Requires SO_REUSEPORT, Which This Platform Does Not Support!")
+        if workers > publisher_options.get("max_readers", 64):
+            raise ValueError(f"Too Many Workers! Frame Rings Support Up To {publisher_options.get('max_readers', 64)} Readers.")
+
+        self.server = server
+        self.publisher_options = publisher_options
+        self.check_interval = check_interval
+        self.stopping: bool = False
+        self.lock = Lock()
+
+        # Publish every stream that has a shared encoder. Other streams are proxied like any other route.
+        self.publishers: dict[str, RingPublisher] = {}
+        self.fallback_publishers: dict[str, RingPublisher] = {}
+        self.control = FrameRing(slots=2, slot_size=256 * 1024, max_readers=1)
+        for route in list(server.routes):
+            self.add_stream(route)
+
+        self.config = {
+            "host": host,
+            "port": port,
+            "upstream": list(upstream),
+            "send_buffer_size": send_buffer_size,
+            "control": self.control.name
+        }
+
+        # Start the workers
+        logging.info(f"Starting {workers} Worker Processes On {host}:{port} For {len(self.publishers)} Streams")
+        self.processes = [self.start_worker(index) for index in range(workers)]
+        atexit.register(self.stop)
+        Thread(target=self.watch_workers, daemon=True).start()
+
+    def start_worker(self, index: int):
+        return subprocess.Popen([sys.executable, str(Path(__file__).resolve()), str(index), json.dumps(self.config)])
+
+    def watch_workers(self):
+        while not self.stopping:
+            time.sleep(self.check_interval)
+            for index, process in enumerate(list(self.processes)):
+                if self.stopping or process.poll() is None:
+                    continue
+
+                # A worker that was killed never got to take its viewers off the rings
+                logging.error(f"Worker {index} Exited With Code {process.returncode}! Starting A New One.")
+                with self.lock:
+                    for publisher in self.get_publishers():
+                        publisher.ring.set_viewers(index, 0)
+                self.processes[index] = self.start_worker(index)
+
+    def add_stream(self, route: str):
+        """
+        Publishes a stream of the server into a frame ring, and lets the workers know about it
+        """
+
+        with self.lock:
+            streamer = self.server.routes[route]
+            if route in self.publishers or not hasattr(streamer, "encoder"):
+                return
+            self.publishers[route] = RingPublisher(streamer, **self.publisher_options)
+            fallback_quality = get_fallback_quality(None, streamer.quality, streamer.fallback_quality)
+            if fallback_quality is not None:
+                self.fallback_publishers[route] = RingPublisher(streamer, quality=fallback_quality, **self.publisher_options)
+
+            # Workers pick up the new table on their next request
+            streams = {
+                route: {
+                    "ring": publisher.ring.name,
+                    "fallback_ring": self.fallback_publishers[route].ring.name if route in self.fallback_publishers else None,
+                    "boundary": publisher.streamer.boundary,
+                    "max_fps": publisher.streamer.max_fps,
+                    "keepalive_interval": publisher.streamer.keepalive_interval
+                }
+                for route, publisher in self.publishers.items()
+            }
+            if not self.control.publish(json.dumps(streams).encode()):
+                logging.error(f"Stream Table Does Not Fit In The Control Ring! Stream {route} Is Proxied Instead.")
+
+    def get_publishers(self):
+        return [*self.publishers.values(), *self.fallback_publishers.values()]
+
+    def stop(self):
+        self.stopping = True
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+
+        # Publishers may still be running, so the rings are only unlinked, not closed
+        for publisher in self.get_publishers():
+            publisher.ring.unlink()
+        self.control.unlink()
+
+    def __repr__(self):
+        return f"<WorkerPool {len(self.processes)} workers, {len(self.publishers)} streams>"
+
+
+#
+# --- Worker Side ---
+#
+
+
+class RingFeed():
+    """
+    One stream, as served by a worker. A single poller per stream checks the frame ring for new frames
+    and wakes up every viewer of the stream at once. The poller only runs while the stream has viewers.
+    Viewers that fall behind are moved to the fallback feed until they catch up, just like local viewers (see ClientLagTracker).
+    """
+
+    def __init__(
+        self,
+        route: str,
+        index: int,
+        ring: str,
+        boundary: str,
+        max_fps: float,
+        keepalive_interval: Optional[float],
+        send_buffer_size: Optional[int],
+        fallback_ring: Optional[str] = None
+    ):
+        self.route = route
+        self.index = index
+        self.ring = FrameRing(ring)
+        self.boundary = boundary
+        self.max_fps = max_fps
+        self.keepalive_interval = keepalive_interval
+        self.send_buffer_size = send_buffer_size
+        # Check for frames a few times per frame, to keep the added latency low
+        self.poll_interval = 1 / (max_fps * 4)
+        # Lower quality copy of the stream
+        self.fallback = RingFeed(route, index, fallback_ring, boundary, max_fps, keepalive_interval, send_buffer_size) if fallback_ring else None
+
+        # Viewer State
+        self.clients: int = 0
+        self.latest: tuple[int, bytes] = (0, b"")
+        self.new_part: Optional[asyncio.Future] = None
+        self.poller: Optional[asyncio.Task] = None
+
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        while self.clients > 0:
+            if self.ring.sequence != self.latest[0]:
+                latest = self.ring.read()
+                if latest[0]:
+                    self.latest = latest
+                    new_part, self.new_part = self.new_part, loop.create_future()
+                    new_part.set_result(latest)
+            await asyncio.sleep(self.poll_interval)
+        self.poller = None
+
+    def add_viewer(self):
+        # Let the producer know someone in this worker is watching
+        self.clients += 1
+        self.ring.set_viewers(self.index, self.clients)
+        if self.poller is None:
+            self.new_part = asyncio.get_running_loop().create_future()
+            self.poller = asyncio.ensure_future(self.poll())
+
+    def remove_viewer(self):
+        self.clients -= 1
+        self.ring.set_viewers(self.index, self.clients)
+
+    async def serve(self, request: AsyncRequest, writer: asyncio.StreamWriter, fps: Optional[float]):
+        # Keep the kernel send buffer small, so slow viewers push back on us
+        client_socket = writer.get_extra_info("socket")
+        if self.send_buffer_size and client_socket is not None:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+
+        writer.write((
+            f"HTTP/1.1 {HTTPStatus.OK.value} {HTTPStatus.OK.phrase}\r\n"
+            f"Content-Type: multipart/x-mixed-replace; boundary={self.boundary}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1"))
+        frame_time = 1 / min(fps or self.max_fps, self.max_fps)
+
+        loop = asyncio.get_running_loop()
+        feed = self
+        feed.add_viewer()
+        client_lag = ClientLagTracker()
+
+        last_sequence = 0
+        last_send_time = 0.0
+        try:
+            while True:
+                # Move over to the fallback feed while the viewer is behind. Joining before leaving keeps the video running.
+                wanted_feed = self.fallback if client_lag.behind and self.fallback is not None else self
+                if wanted_feed is not feed:
+                    wanted_feed.add_viewer()
+                    feed.remove_viewer()
+                    feed = wanted_feed
+                    last_sequence = 0
+
+                # Send the current frame right away, then wait for new ones.
+                # If nothing changes for a while, resend the current one as a keepalive.
+                if last_sequence and feed.latest[0] == last_sequence:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(feed.new_part), self.keepalive_interval)
+                    except asyncio.TimeoutError:
+                        pass
+
+                # Viewers with a lower frame rate wait out the rest of their frame time, then take the newest frame
+                wait_time = last_send_time + frame_time - loop.time()
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time)
+
+                sequence, part = feed.latest
+                if not sequence:
+                    await asyncio.shield(feed.new_part)
+                    continue
+                if sequence == last_sequence and (self.keepalive_interval is None or loop.time() - last_send_time < self.keepalive_interval):
+                    continue
+
+                last_send_time = loop.time()
+                writer.write(part)
+                await writer.drain()
+                client_lag.frame_sent(sequence, loop.time() - last_send_time)
+                last_sequence = sequence
+        finally:
+            feed.remove_viewer()
+
+
+class Worker():
+    """
+    Serving process. Streams are served from frame rings, and every other request is passed on to the producer.
+    """
+
+    def __init__(self, index: int, config: dict):
+        self.index = index
+        self.host = config["host"]
+        self.port = config["port"]
+        self.upstream = tuple(config["upstream"])
+        self.send_buffer_size = config["send_buffer_size"]
+        self.control = FrameRing(config["control"])
+        self.control_sequence: int = 0
+        self.feeds: dict[str, RingFeed] = {}
+        self.connections: set[asyncio.Task] = set()
+        self.stopped: Optional[asyncio.Event] = None
+        self.update_feeds()
+
+    def update_feeds(self):
+        """
+        Adds a feed for every stream that was published since the last check (see WorkerPool.add_stream)
+        """
+
+        if self.control.sequence == self.control_sequence:
+            return
+        sequence, table = self.control.read()
+        if not sequence:
+            return
+        for route, stream in json.loads(table).items():
+            if normalize_route(route) not in self.feeds:
+                self.feeds[normalize_route(route)] = RingFeed(route, self.index, send_buffer_size=self.send_buffer_size, **stream)
+        self.control_sequence = sequence
+
+    def create_socket(self):
+        # Every worker binds the same address. The kernel spreads incoming connections between them.
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        server_socket = socket.socket(family, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((self.host, self.port))
+        server_socket.listen(1024)
+        server_socket.setblocking(False)
+        return server_socket
+
+    async def serve(self):
+        # The producer stops workers with SIGTERM
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, self.stopped.set)
+
+        server = await asyncio.start_server(self.handle_connection, sock=self.create_socket())
+        parent_watcher = asyncio.ensure_future(self.watch_parent())
+        await self.stopped.wait()
+
+        # Stop accepting, then end the open connections so every viewer is taken off its ring before exiting
+        server.close()
+        parent_watcher.cancel()
+        for task in self.connections:
+            task.cancel()
+        await asyncio.gather(parent_watcher, *self.connections, return_exceptions=True)
+        await server.wait_closed()
+
+    async def watch_parent(self):
+        # Exit along with the producer, even if it was not able to stop us itself
+        parent = os.getppid()
+        while os.getppid() == parent:
+            await asyncio.sleep(1)
+        logging.info("Producer Process Exited. Stopping Worker.")
+        self.stopped.set()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            request = await read_request(reader, peer=writer.get_extra_info("peername"))
+            if request is None:
+                return
+
+            # Plain streams are served from the frame ring. Renditions are encoded by the producer, so those get proxied.
+            self.update_feeds()
+            feed = self.feeds.get(normalize_route(request.path))
+            rendition = parse_rendition_query(parse_qs(request.query))
+            if feed is not None and request.method == "GET" and rendition["width"] is None and rendition["quality"] is None:
+                await feed.serve(request, writer, rendition["fps"])
+            else:
+                await self.proxy(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Client went away
+            pass
+        except asyncio.CancelledError:
+            # Worker is stopping. Ending normally keeps asyncio from logging the cancelled handler.
+            pass
+        except Exception as e:
+            logging.error(f"Error While Handling Request! {e}")
+            traceback.print_exc()
+        finally:
+            writer.close()
+            self.connections.discard(task)
+
+    async def proxy(self, request: AsyncRequest, writer: asyncio.StreamWriter):
+        """
+        Passes the request on to the producer, and streams its response back as is
+        """
+
+        upstream_reader, upstream_writer = await asyncio.open_connection(*self.upstream)
+        try:
+            target = f"{request.path}?{request.query}" if request.query else request.path
+            head = f"{request.method} {target} {request.version}\r\n"
+            for key, value in request.headers.items():
+                if key != "connection":
+                    head += f"{key}: {value}\r\n"
+            head += "Connection: close\r\n\r\n"
+            upstream_writer.write(head.encode("latin-1") + request.body)
+            await upstream_writer.drain()
+
+            while True:
+                chunk = await upstream_reader.read(64 * 1024)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            upstream_writer.close()
+
+
+if __name__ == '__main__':
+    worker_index, worker_config = int(sys.argv[1]), json.loads(sys.argv[2])
+    logging.basicConfig(level=logging.INFO, format=f"[Worker {worker_index}] %(levelname)s: %(message)s")
+    try:
+        asyncio.run(Worker(worker_index, worker_config).serve())
+    except KeyboardInterrupt:
+        pass